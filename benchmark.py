@@ -0,0 +1,656 @@
+#! /usr/bin/env python
+
+"""Time the parts of wsgiwrapper that run on every request.
+
+Run this from the top of the source tree:  python benchmark.py
+
+The 'requests' section drives whole requests through a wsgiwrapper with
+synthetic WSGI environs (no network): GETs of small and huge forms,
+uploads, and large outputs.  Save its results with --json, and compare
+two saved runs with --compare, to catch regressions between versions."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Metadate...
+__author__ = "Samuel T. Denton, III <sam.denton@dell.com>"
+__contributors__ = []
+__copyright__ = "Copyright 2019 Samuel T. Denton, III"
+__version__ = '0.4'
+
+# Python standard libraries
+from io import BytesIO, StringIO
+import argparse, copy, gc, json, os, platform, sys, time, timeit
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2
+
+# Python site libraries
+
+# Python personal libraries
+from wsgiwrapper import wsgiwrapper, js_library, RequestContext
+from wsgiwrapper import __version__ as package_version
+from wsgiwrapper.metrics import Metrics, timer
+from wsgiwrapper.multipart import parse_form
+from wsgiwrapper.utils import print_where
+from wsgiwrapper.htmltags import compile_tree, Input, Option, Select
+
+def big_parser(n=200):
+    """Build a parser with n arguments of assorted kinds."""
+    parser = argparse.ArgumentParser(description='A parser with %d arguments.' % n)
+    for i in range(n):
+        group = parser.add_argument_group('Group %d' % (i // 10))
+        kind = i % 4
+        if kind == 0:
+            group.add_argument('--text-%d' % i, default='value %d' % i, help='Some text.')
+        elif kind == 1:
+            group.add_argument('--number-%d' % i, type=int, default=i, help='A number.')
+        elif kind == 2:
+            group.add_argument('--flag-%d' % i, action='store_true', help='A flag.')
+        else:
+            group.add_argument('--choice-%d' % i, choices=['red', 'green', 'blue'],
+                               default='green', help='A choice.')
+    return parser
+
+def process(args):
+    pass
+
+def measure(func, number):
+    """Return the best time per call, in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def bench_htmltags(args):
+    """Serializing the form: the recursive serializer vs. a compiled template."""
+    app = wsgiwrapper(big_parser(args.arguments), process)
+    environ = {'SCRIPT_NAME': '', 'PATH_INFO': '/'}
+    headers, template = app.page_template(environ)
+    form_template = compile_tree(app.form)
+    assert form_template.render().decode('utf-8') == str(app.form)
+    error = 'usage: big_parser [-h] ...\nerror: something went wrong\n'
+
+    def error_page_then():
+        # what wsgiwrapper did before the page was compiled
+        headers, form_iter = app.mk_form(
+            environ,
+            script=[js_library[func] for func in app.script],
+            toolbox=app.toolbox,
+            form=app.form,
+            error=[error],
+            )
+        return b''.join(form_iter)
+
+    results = [
+        ('str(form)', measure(lambda: str(app.form), args.number)),
+        ('compiled form', measure(form_template.render, args.number)),
+        ('error page, rendered', measure(error_page_then, args.number)),
+        ('error page, compiled', measure(lambda: template.render(error=error), args.number)),
+        ]
+    print('%d arguments, %d bytes of form, %d static segments' % (
+        args.arguments, len(form_template.render()), len(template.parts)))
+    for name, usec in results:
+        print('  %-24s %10.1f usec' % (name, usec))
+
+class DictElement(object):
+    """A node as htmltags used to store them, with a __dict__."""
+    def __init__(self, tagName, *childNodes, **attributes):
+        self.childNodes = list(childNodes)
+        self.tagName = tagName.upper()
+        self.attributes = attributes
+
+def allocated(build):
+    """Return the bytes still allocated by whatever build() returns."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+        del kept
+
+def bench_nodes(args):
+    """Memory used by a <select> with many choices, and cloning inputs."""
+    choices = ['choice %d' % i for i in range(args.choices)]
+
+    def old_select():
+        return DictElement('select', *[DictElement('option', c, value=c) for c in choices])
+
+    def new_select():
+        return Select(*[Option(c, value=c) for c in choices])
+
+    def app_with_choices():
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--pick', choices=choices, default=choices[0])
+        # every choice an <option>, not the typeahead used beyond max_select_choices
+        return wsgiwrapper(parser, process, max_select_choices=len(choices) + 1)
+
+    input = Input(type='text', name='x', value='y', placeholder='z')
+    if tracemalloc is None:
+        print('tracemalloc is not available; skipping memory measurements')
+    else:
+        print('%d choices:' % args.choices)
+        for name, build in [
+                ('nodes with a __dict__', old_select),
+                ('slotted nodes', new_select),
+                ('slotted nodes, frozen', lambda: new_select().freeze()),
+                ('whole wsgiwrapper', app_with_choices),
+                ]:
+            print('  %-24s %10d bytes' % (name, allocated(build)))
+    print('cloning an <input>:')
+    old_input = DictElement('input', type='text', name='x', value='y', placeholder='z')
+    print('  %-24s %10.1f usec' % ('copy.deepcopy, __dict__', measure(lambda: copy.deepcopy(old_input), args.number)))
+    print('  %-24s %10.1f usec' % ('clone()', measure(input.clone, args.number)))
+
+def namespace_then(app, request, invalid):
+    """How wsgiwrapper built a Namespace before it had decoders."""
+    fieldstorage = request.form
+    namespace = argparse.Namespace()
+    for action in app.parser._actions:
+        print_where('action =', action)
+        if action in app.buttons:
+            continue
+        dest = action.dest
+        if isinstance(action, argparse._StoreConstAction):
+            value = fieldstorage.getfirst(dest)
+            if value is None or dest not in app.registry:
+                value = action.default
+            else:
+                value = app.registry.redeem(dest, value, action.default)
+        elif action.nargs is None:
+            value = fieldstorage.getfirst(dest, action.default)
+        else:
+            value = fieldstorage.getlist(dest) or [action.default]
+            if dest+'.split' in app.hooks:
+                value = value[0].split()
+        if action in app.select_actions or dest in app.choice_indexes:
+            try:
+                value = app.registry.redeem(dest, value)
+            except KeyError:
+                invalid.append((action, value))
+        print_where('value =', repr(value)[:240])
+        if action.type:
+            try:
+                value = action.type(value)
+            except:
+                value = action.type()
+        print_where('value =', repr(value)[:240])
+        setattr(namespace, dest, value)
+    return namespace
+
+def bench_namespace(args):
+    """Building the Namespace for a POST."""
+    app = wsgiwrapper(big_parser(args.arguments), process)
+    fields = []
+    for action in app.parser._actions:
+        if action.option_strings[0].startswith('--text'):
+            fields.append('%s=some+text' % action.dest)
+        elif action.option_strings[0].startswith('--number'):
+            fields.append('%s=42' % action.dest)
+        elif action.option_strings[0].startswith('--flag'):
+            fields.append('%s=%%230' % action.dest)
+        elif action.option_strings[0].startswith('--choice'):
+            fields.append('%s=blue' % action.dest)
+    body = '&'.join(fields).encode('ascii')
+    request = RequestContext({
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+        }, None)
+    request.form = parse_form(request.environ)
+    print('Namespace for %d arguments:' % args.arguments)
+    print('  %-24s %10.1f usec' % ('action by action', measure(
+        lambda: namespace_then(app, request, []), args.number)))
+    print('  %-24s %10.1f usec' % ('decoders', measure(
+        lambda: app.mk_namespace(request, []), args.number)))
+
+class Untraced(object):
+    """A print_where that does nothing at all, as a baseline."""
+    active = False
+
+    def __call__(self, *args, **kwargs):
+        pass
+
+    def capturing(self):
+        return None
+
+def bench_tracing(args):
+    """The cost of tracing, on and off, to a GET and a POST."""
+    import wsgiwrapper as package
+    app = wsgiwrapper(big_parser(args.arguments), process)
+    body = b'text_0=some+text&number_1=42'
+
+    def get():
+        environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': '/'}
+        return app(environ, lambda status, headers, exc_info=None: None)
+
+    def post():
+        environ = {
+            'REQUEST_METHOD': 'POST', 'SCRIPT_NAME': '', 'PATH_INFO': '/',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': BytesIO() if str is bytes else StringIO(),
+            }
+        return app(environ, lambda status, headers, exc_info=None: None)
+
+    def both(label):
+        print('  %-24s %10.1f usec GET, %10.1f usec POST' % (
+            label, measure(get, args.number), measure(post, args.number)))
+
+    print('Tracing, with %d arguments:' % args.arguments)
+    package.print_where = Untraced()
+    try:
+        both('no print_where at all')
+    finally:
+        package.print_where = print_where
+    both('tracing disabled')
+    print_where.enable('wsgiwrapper')
+    try:
+        with print_where.capture():  # so the messages aren't printed
+            both('tracing enabled')
+    finally:
+        print_where.disable()
+
+def bench_metrics(args):
+    """The cost of recording metrics, to a GET and a POST."""
+    body = b'text_0=some+text&number_1=42'
+
+    def requests(app):
+        def get():
+            environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': '/'}
+            return app(environ, lambda status, headers, exc_info=None: None)
+        def post():
+            environ = {
+                'REQUEST_METHOD': 'POST', 'SCRIPT_NAME': '', 'PATH_INFO': '/',
+                'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': BytesIO(body),
+                }
+            return app(environ, lambda status, headers, exc_info=None: None)
+        return measure(get, args.number), measure(post, args.number)
+
+    print('Metrics, with %d arguments:' % args.arguments)
+    parser = big_parser(args.arguments)
+    for label, options in [
+            ('no metrics', {}),
+            ('metrics', {'metrics': Metrics()}),
+            ('metrics, Server-Timing', {'metrics': Metrics(), 'server_timing': True}),
+            ]:
+        print('  %-24s %10.1f usec GET, %10.1f usec POST' % (
+            (label,) + requests(wsgiwrapper(parser, process, **options))))
+
+MB = 1024 * 1024
+UPLOAD_SIZES = (1024, MB, 64 * MB, 1024 * MB)
+BOUNDARY = 'benchmarkboundary'
+
+class MultipartBody(object):
+    """\
+A multipart/form-data body with one uploaded file of size bytes, made
+up as it is read, so that even a huge upload takes no memory here."""
+
+    def __init__(self, size, fields=()):
+        head = ''.join('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                       % (BOUNDARY, name, value) for name, value in fields)
+        head += ('--%s\r\nContent-Disposition: form-data; name="upload"; filename="data.bin"\r\n'
+                 'Content-Type: application/octet-stream\r\n\r\n' % BOUNDARY)
+        self.head = head.encode('ascii')
+        self.tail = ('\r\n--%s--\r\n' % BOUNDARY).encode('ascii')
+        self.size = size
+        self.length = len(self.head) + size + len(self.tail)
+        self.position = 0
+        self.block = b'0123456789abcdef' * 4096
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self.position
+        chunks = []
+        end = min(self.position + size, self.length)
+        while self.position < end:
+            position = self.position
+            if position < len(self.head):
+                chunk = self.head[position:end]
+            elif position < len(self.head) + self.size:
+                offset = (position - len(self.head)) % len(self.block)
+                chunk = self.block[offset:offset + min(end, len(self.head) + self.size) - position]
+            else:
+                offset = position - len(self.head) - self.size
+                chunk = self.tail[offset:offset + end - position]
+            chunks.append(chunk)
+            self.position += len(chunk)
+        return b''.join(chunks)
+
+def upload_parser():
+    parser = argparse.ArgumentParser(description='Count the bytes in a file.')
+    parser.add_argument('--upload', type=argparse.FileType('rb'))
+    return parser
+
+def upload_process(args):
+    size = 0
+    for chunk in iter(lambda: args.upload.read(MB), b''):
+        size += len(chunk)
+    print(size)
+
+def output_parser():
+    parser = argparse.ArgumentParser(description='Write a lot of output.')
+    parser.add_argument('--megabytes', type=int, default=1)
+    parser.add_argument('--out', type=argparse.FileType('w'))
+    return parser
+
+def output_process(args):
+    f = args.out or sys.stdout
+    line = 'x' * 1023 + '\n'
+    for _ in range(args.megabytes * 1024):
+        f.write(line)
+
+def get_environ():
+    return {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': '/'}
+
+def post_environ(body, content_type='application/x-www-form-urlencoded'):
+    """Return the environ for a POST; body is bytes, or a MultipartBody."""
+    if isinstance(body, bytes):
+        body = BytesIO(body)
+        length = len(body.getvalue())
+    else:
+        length = body.length
+    return {
+        'REQUEST_METHOD': 'POST', 'SCRIPT_NAME': '', 'PATH_INFO': '/',
+        'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(length),
+        'wsgi.input': body, 'wsgi.errors': StringIO(),
+        }
+
+def run_request(app, environ):
+    """Run one request to the end, returning its status and body size."""
+    response = []
+    body = app(environ, lambda status, headers, exc_info=None: response.append(status))
+    try:
+        size = sum(len(chunk) for chunk in body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return response[-1], size
+
+def percentile(times, fraction):
+    """The nearest-rank percentile of a sorted list."""
+    return times[min(len(times) - 1, int(fraction * len(times)))]
+
+def peak_rss():
+    """The most memory this process has used so far, in bytes."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def scenario(name, app, make_environ, repeat, payload=0):
+    """Run make_environ()'s request repeat times, and describe how it went."""
+    status, size = run_request(app, make_environ())  # warm up, and check it works
+    if not status.startswith('200'):
+        raise RuntimeError('%s: %s' % (name, status))
+    times = []
+    for _ in range(repeat):
+        environ = make_environ()
+        started = timer()
+        run_request(app, environ)
+        times.append(timer() - started)
+    times.sort()
+    total = sum(times)
+    result = {
+        'requests': repeat,
+        'requests_per_sec': repeat / total,
+        'p50_ms': percentile(times, 0.50) * 1000,
+        'p99_ms': percentile(times, 0.99) * 1000,
+        'response_bytes': size,
+        'peak_rss_bytes': peak_rss(),
+        }
+    if payload:
+        result['mb_per_sec'] = payload * repeat / total / MB
+    return result
+
+def bench_requests(args):
+    """Whole requests, from environ to the last byte of the response."""
+    results = {}
+    small = wsgiwrapper(big_parser(10), process)
+    huge = wsgiwrapper(big_parser(args.arguments * 10), process)
+    results['get small form'] = scenario('get small form', small, get_environ, args.number)
+    results['get huge form'] = scenario('get huge form', huge, get_environ, args.number)
+    started = time.time()
+    wsgiwrapper(big_parser(args.arguments * 10), process)
+    results['build huge form'] = {'seconds': time.time() - started, 'peak_rss_bytes': peak_rss()}
+
+    uploads = wsgiwrapper(upload_parser(), upload_process)
+    for size in UPLOAD_SIZES:
+        if size > args.max_upload * MB:
+            continue
+        name = 'upload %s' % (('%d KB' % (size // 1024)) if size < MB else ('%d MB' % (size // MB)))
+        results[name] = scenario(
+            name, uploads,
+            lambda: post_environ(MultipartBody(size),
+                                 'multipart/form-data; boundary=' + BOUNDARY),
+            max(1, min(args.number, 64 * MB // size)), size)
+
+    outputs = wsgiwrapper(output_parser(), output_process)
+    megabytes = args.output
+    body = ('megabytes=%d' % megabytes).encode('ascii')
+    results['stdout %d MB' % megabytes] = scenario(
+        'stdout %d MB' % megabytes, outputs,
+        lambda: post_environ(body + b'&out='), max(1, args.number // 10), megabytes * MB)
+    results['download %d MB' % megabytes] = scenario(
+        'download %d MB' % megabytes, outputs,
+        lambda: post_environ(body + b'&out=big.txt'), max(1, args.number // 10), megabytes * MB)
+
+    print('Whole requests:')
+    for name, result in results.items():
+        if 'seconds' in result:
+            print('  %-24s %10.3f sec' % (name, result['seconds']))
+            continue
+        line = '  %-24s %10.1f req/s  p50 %8.2f ms  p99 %8.2f ms' % (
+            name, result['requests_per_sec'], result['p50_ms'], result['p99_ms'])
+        if 'mb_per_sec' in result:
+            line += '  %8.1f MB/s' % result['mb_per_sec']
+        print(line)
+    if results['get small form']['peak_rss_bytes'] is not None:
+        print('  peak RSS %d MB' % (peak_rss() // MB))
+    return results
+
+def compare(old, new, threshold):
+    """Print the results that got worse (or better) by more than threshold percent."""
+    better = {'requests_per_sec': 1, 'mb_per_sec': 1, 'p50_ms': -1, 'p99_ms': -1,
+              'seconds': -1, 'peak_rss_bytes': -1}
+    changes = 0
+    for name, result in sorted(new['requests'].items()):
+        before = old.get('requests', {}).get(name)
+        if before is None:
+            continue
+        for key, sign in sorted(better.items()):
+            if not before.get(key) or result.get(key) is None:
+                continue
+            change = (result[key] - before[key]) / before[key] * 100
+            if abs(change) >= threshold:
+                changes += 1
+                print('  %-24s %-16s %+7.1f%% %s' % (
+                    name, key, change, 'better' if change * sign > 0 else 'WORSE'))
+    if not changes:
+        print('  no changes of %s%% or more' % threshold)
+
+STARTUP = '''
+import json, sys, time
+timer = getattr(time, 'perf_counter', time.time)
+started = timer()
+import wsgiwrapper
+imported = timer()
+from benchmark import big_parser, process, get_environ, run_request
+parser = big_parser(%(arguments)d)
+built = timer()
+app = wsgiwrapper.wsgiwrapper(parser, process, snapshot_dir=%(snapshot_dir)r)
+run_request(app, get_environ())
+print(json.dumps({
+    'import': imported - started,
+    'first page': timer() - built,
+    'pystache': 'pystache' in sys.modules,
+    }))
+'''
+
+def bench_startup(args):
+    """Importing wsgiwrapper, and building the form and serving it, in a new process."""
+    import shutil, subprocess, tempfile
+    snapshot_dir = tempfile.mkdtemp(prefix='benchmark-')
+    arguments = args.arguments * 10
+
+    def cold_start(snapshot_dir):
+        runs = []
+        for _ in range(5):
+            output = subprocess.check_output(
+                [sys.executable, '-c', STARTUP % dict(arguments=arguments, snapshot_dir=snapshot_dir)])
+            runs.append(json.loads(output.decode('utf-8')))
+        return runs
+
+    try:
+        plain = cold_start(None)
+        cold_start(snapshot_dir)  # write the snapshot
+        snapped = cold_start(snapshot_dir)
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    results = {
+        'import wsgiwrapper': {'seconds': min(run['import'] for run in plain)},
+        'first page, built': {'seconds': min(run['first page'] for run in plain)},
+        'first page, snapshot': {'seconds': min(run['first page'] for run in snapped)},
+        }
+    print('Starting up, with %d arguments:' % arguments)
+    for name, result in results.items():
+        print('  %-24s %10.1f msec' % (name, result['seconds'] * 1000))
+    print('  pystache imported: %s without a snapshot, %s with one' % (
+        plain[-1]['pystache'], snapped[-1]['pystache']))
+    return results
+
+def memory(pid='self'):
+    """Return the (shared, private) bytes of a process, on Linux."""
+    sizes = {}
+    with open('/proc/%s/smaps_rollup' % pid) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                sizes[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    return (sizes.get('Shared_Clean', 0) + sizes.get('Shared_Dirty', 0),
+            sizes.get('Private_Clean', 0) + sizes.get('Private_Dirty', 0))
+
+def worker_memory(app, checkpoints):
+    """\
+Fork a worker that serves GETs and POSTs, and return its (shared,
+private) memory after each number of requests in checkpoints."""
+    body = b'text_0=some+text&number_1=42'
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_end)
+        results, served = [], 0
+        try:
+            for checkpoint in checkpoints:
+                while served < checkpoint:
+                    run_request(app, get_environ())
+                    run_request(app, post_environ(body))
+                    served += 2
+                gc.collect()  # as would happen sooner or later
+                results.append(memory())
+            os.write(write_end, json.dumps(results).encode('utf-8'))
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end, 'rb') as f:
+        results = json.loads(f.read().decode('utf-8'))
+    os.waitpid(pid, 0)
+    return results
+
+def bench_prefork(args):
+    """Memory of a forked worker as it serves requests, with and without freezing first."""
+    if not hasattr(os, 'fork') or not os.path.exists('/proc/self/smaps_rollup'):
+        print('Pre-forked memory can only be measured on Linux; skipping')
+        return
+    checkpoints = [0, args.number, args.number * 10]
+    print('A pre-forked worker, with %d arguments:' % (args.arguments * 10))
+    for label, freeze in [('as built', False), ('frozen', True)]:
+        app = wsgiwrapper(big_parser(args.arguments * 10), process)
+        if freeze:
+            app.freeze()
+            gc.collect()
+            gc.freeze()
+        try:
+            results = worker_memory(app, checkpoints)
+        finally:
+            if freeze:
+                gc.unfreeze()
+        for served, (shared, private) in zip(checkpoints, results):
+            print('  %-10s %6d requests: %8.1f MB shared, %8.1f MB private' % (
+                label, served, shared / MB, private / MB))
+        del app
+        gc.collect()
+
+SECTIONS = ('htmltags', 'nodes', 'namespace', 'tracing', 'metrics', 'prefork', 'startup', 'requests')
+SCENARIOS = ('startup', 'requests')  # sections whose results are saved by --json
+
+def mk_parser():
+    """Build an argument parser."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=100,
+            help='How many times to run each benchmark per trial; default is %(default)s.')
+    parser.add_argument('-a', '--arguments', type=int, default=200,
+            help='How many arguments the benchmark parser has; default is %(default)s.')
+    parser.add_argument('-c', '--choices', type=int, default=10000,
+            help='How many choices the benchmark <select> has; default is %(default)s.')
+    parser.add_argument('-u', '--max-upload', type=int, default=64, metavar='MB',
+            help='The biggest upload to time, up to 1024; default is %(default)s.')
+    parser.add_argument('-o', '--output', type=int, default=16, metavar='MB',
+            help='How much output the output benchmarks write; default is %(default)s.')
+    parser.add_argument('-j', '--json', metavar='FILE',
+            help="Save the results of the 'startup' and 'requests' sections in FILE.")
+    parser.add_argument('--compare', metavar='FILE',
+            help="Compare the results of the 'startup' and 'requests' sections with those saved in FILE.")
+    parser.add_argument('--threshold', type=float, default=10,
+            help='The smallest change, in percent, reported by --compare; default is %(default)s.')
+    parser.add_argument('sections', nargs='*', metavar='SECTION',
+            help='The benchmarks to run, from %s; the default is all of them.' % ', '.join(SECTIONS))
+    return parser
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = mk_parser()
+    args = parser.parse_args(argv)
+    for section in args.sections:
+        if section not in SECTIONS:
+            parser.error('unknown section %r' % section)
+    sections = args.sections or SECTIONS
+    if (args.json or args.compare) and not any(s in sections for s in SCENARIOS):
+        sections = list(sections) + list(SCENARIOS)
+    scenarios = {}
+    for section in SECTIONS:
+        if section in sections:
+            result = globals()['bench_' + section](args)
+            if section in SCENARIOS:
+                scenarios.update(result)
+    if scenarios:
+        results = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'wsgiwrapper': package_version,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'requests': scenarios,
+            }
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if args.compare:
+            with open(args.compare) as f:
+                old = json.load(f)
+            print('Compared with %s (wsgiwrapper %s, Python %s):' % (
+                args.compare, old.get('wsgiwrapper'), old.get('python')))
+            compare(old, results, args.threshold)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+"""Let the tests import wsgiwrapper (and example.py) from the source tree."""
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
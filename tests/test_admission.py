@@ -0,0 +1,119 @@
+"""Tests for wsgiwrapper.admission."""
+
+import threading
+import time
+
+import pytest
+
+from wsgiwrapper.admission import AdmissionControl, Overloaded
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.001)
+
+class Queued(object):
+    """Requests from several clients, queued one at a time, in order."""
+
+    def __init__(self, control):
+        self.control = control
+        self.admitted = []
+        self.errors = []
+        self.threads = []
+
+    def add(self, client):
+        def run():
+            try:
+                self.control.acquire(client)
+                self.admitted.append(client)
+            except Overloaded as err:
+                self.errors.append((client, err.reason))
+        waiting = self.control.waiting
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        wait_for(lambda: self.control.waiting > waiting)
+
+    def next(self):
+        count = len(self.admitted)
+        self.control.release()
+        wait_for(lambda: len(self.admitted) > count)
+        return self.admitted[-1]
+
+def test_runs_at_once():
+    control = AdmissionControl(max_running=2)
+    control.acquire('a')
+    control.acquire('a')
+    assert control.running == 2 and control.waiting == 0
+    assert not control.full('a')
+    control.release()
+    control.release()
+    assert control.running == 0
+
+def test_round_robin():
+    control = AdmissionControl(max_running=1)
+    control.acquire('busy')
+    queued = Queued(control)
+    for client in ['a', 'a', 'a', 'b', 'c', 'c']:
+        queued.add(client)
+    assert [queued.next() for _ in range(6)] == ['a', 'b', 'c', 'a', 'c', 'a']
+    assert control.waiting == 0 and not control.turns and not control.queues
+    assert control.running == 1
+    control.release()
+    assert control.running == 0
+
+def test_new_client_goes_to_the_back():
+    control = AdmissionControl(max_running=1)
+    control.acquire('busy')
+    queued = Queued(control)
+    queued.add('a')
+    queued.add('a')
+    assert queued.next() == 'a'
+    queued.add('b')  # arrives after 'a' has had a turn
+    assert [queued.next(), queued.next()] == ['a', 'b']
+
+def test_waiters_dont_let_newcomers_jump_the_queue():
+    control = AdmissionControl(max_running=1)
+    control.acquire('busy')
+    queued = Queued(control)
+    queued.add('a')
+    assert control.full('b') is False  # it may wait, but not run at once
+    assert queued.next() == 'a'
+    assert control.running == 1
+
+def test_full():
+    control = AdmissionControl(max_running=1, max_waiting=2)
+    control.acquire('busy')
+    queued = Queued(control)
+    queued.add('a')
+    queued.add('b')
+    assert control.full('c')
+    with pytest.raises(Overloaded) as info:
+        control.acquire('c')
+    assert info.value.reason == 'full'
+    assert [queued.next(), queued.next()] == ['a', 'b']
+
+def test_max_per_client():
+    control = AdmissionControl(max_running=1, max_per_client=2)
+    control.acquire('busy')
+    queued = Queued(control)
+    queued.add('a')
+    queued.add('a')
+    assert control.full('a') and not control.full('b')
+    with pytest.raises(Overloaded) as info:
+        control.acquire('a')
+    assert info.value.reason == 'full'
+    queued.add('b')
+    assert [queued.next() for _ in range(3)] == ['a', 'b', 'a']
+
+def test_timeout():
+    control = AdmissionControl(max_running=1, max_wait=0.05)
+    control.acquire('busy')
+    with pytest.raises(Overloaded) as info:
+        control.acquire('a')
+    assert info.value.reason == 'timeout'
+    assert control.waiting == 0 and not control.turns and not control.queues
+    control.release()
+    assert control.running == 0
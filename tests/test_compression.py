@@ -0,0 +1,94 @@
+"""Tests for wsgiwrapper.compression."""
+
+import gzip
+import zlib
+
+import pytest
+
+from wsgiwrapper.compression import Compression, choose_coding
+
+HTML = [('Content-Type', 'text/html; charset=utf-8')]
+
+@pytest.mark.parametrize('headers, allowed', [
+    (HTML, True),
+    (HTML + [('Content-Length', '1024')], True),
+    (HTML + [('Content-Length', '1023')], False),
+    (HTML + [('Content-Length', 'lots')], False),
+    ([('Content-Type', 'text/plain')], True),
+    ([('Content-Type', 'application/json')], True),
+    ([('Content-Type', 'image/svg+xml')], True),
+    ([('Content-Type', 'image/png')], False),
+    ([('Content-Type', 'application/octet-stream')], False),
+    ([], False),
+    (HTML + [('Content-Encoding', 'gzip')], False),
+    (HTML + [('Content-Range', 'bytes 0-9/100')], False),
+    (HTML + [('Content-Disposition', 'attachment; filename="out.html"')], False),
+    (HTML + [('Accept-Ranges', 'bytes')], False),
+    ([('content-type', 'TEXT/HTML'), ('CONTENT-LENGTH', '5000')], True),
+    ])
+def test_allows(headers, allowed):
+    assert Compression().allows(headers) is allowed
+
+def test_types_and_min_size():
+    compression = Compression(types=['image/'], min_size=10)
+    assert compression.allows([('Content-Type', 'image/png'), ('Content-Length', '10')])
+    assert not compression.allows(HTML)
+
+def test_apply():
+    headers = HTML + [('Content-Length', '5000'), ('ETag', '"abc"')]
+    new_headers, compressor = Compression().apply('200 OK', headers, 'gzip')
+    assert compressor is not None
+    assert new_headers == HTML + [
+        ('ETag', 'W/"abc"'),
+        ('Vary', 'Accept-Encoding'),
+        ('Content-Encoding', 'gzip'),
+        ]
+    data = b'hello, world\n' * 1000
+    assert gzip.decompress(b''.join(compressor.wrap([data[:10], data[10:]]))) == data
+
+def test_apply_deflate():
+    new_headers, compressor = Compression().apply('200 OK', HTML, 'deflate')
+    assert ('Content-Encoding', 'deflate') in new_headers
+    data = b'x' * 5000
+    assert zlib.decompress(b''.join(compressor.wrap([data]))) == data
+
+def test_apply_weak_etag_unchanged():
+    headers = HTML + [('ETag', 'W/"abc"')]
+    new_headers, compressor = Compression().apply('200 OK', headers, 'gzip')
+    assert ('ETag', 'W/"abc"') in new_headers
+
+def test_apply_identity():
+    # no coding chosen, but the response could have been compressed
+    headers = HTML + [('Content-Length', '5000'), ('ETag', '"abc"')]
+    new_headers, compressor = Compression().apply('200 OK', headers, None)
+    assert compressor is None
+    assert new_headers == headers + [('Vary', 'Accept-Encoding')]
+
+@pytest.mark.parametrize('vary', ['Accept-Encoding', 'Cookie, accept-encoding', '*'])
+def test_apply_existing_vary(vary):
+    new_headers, compressor = Compression().apply('200 OK', HTML + [('Vary', vary)], 'gzip')
+    assert [value for key, value in new_headers if key.lower() == 'vary'] == [vary]
+
+@pytest.mark.parametrize('status, headers', [
+    ('206 Partial Content', HTML + [('Content-Range', 'bytes 0-9/5000')]),
+    ('304 Not Modified', HTML),
+    ('404 Not Found', HTML),
+    ('200 OK', HTML + [('Content-Length', '100')]),
+    ('200 OK', HTML + [('Content-Disposition', 'attachment'), ('Accept-Ranges', 'bytes')]),
+    ('200 OK', [('Content-Type', 'image/png')]),
+    ])
+def test_apply_skipped(status, headers):
+    assert Compression().apply(status, headers, 'gzip') == (headers, None)
+
+@pytest.mark.parametrize('accept_encoding, coding', [
+    (None, None),
+    ('', None),
+    ('gzip', 'gzip'),
+    ('deflate', 'deflate'),
+    ('gzip;q=0, deflate', 'deflate'),
+    ('br', None),
+    ('*', 'gzip'),
+    ('identity', None),
+    ])
+def test_choose_coding(accept_encoding, coding):
+    assert choose_coding(accept_encoding) == coding
@@ -0,0 +1,64 @@
+"""Tests for wsgiwrapper.executors."""
+
+import argparse
+
+import pytest
+
+import example
+from wsgiwrapper.executors import namespace_argv
+
+def round_trip(parser, namespace):
+    return parser.parse_args(namespace_argv(parser, namespace))
+
+@pytest.mark.parametrize('argv', [
+    [],
+    ['--none', '-3', '--optional', 'o', '--nargs-2', 'x', 'y'],
+    ['--b', 'fish', '--d', 'fish', 'birds', '--c', 'tom', 'dick'],
+    ['--zero-or-more', '--f', '--e', 'harry'],
+    ['--one-or-more', 'a', 'b', '--nargs-3', '1', '2', '3', '--a', 'tom'],
+    ])
+def test_example_round_trip(argv):
+    parser = example.mk_parser()
+    namespace = parser.parse_args(argv)
+    assert round_trip(parser, namespace) == namespace
+
+def test_example_form_defaults():
+    # what the form gives for an untouched example.py form
+    parser = example.mk_parser()
+    namespace = argparse.Namespace(
+        none=None, optional=[None], zero_or_more=[None], one_or_more=[None],
+        nargs_1=[None], nargs_2=[None], nargs_3=[None], a=None,
+        b=['mammals', 'birds'], c=[None], d=[['mammals', 'birds']],
+        e=[None], f=[['mammals', 'birds']])
+    assert namespace_argv(parser, namespace) == []
+    assert round_trip(parser, namespace) == parser.parse_args([])
+
+def mk_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('name')
+    parser.add_argument('rest', nargs='*', type=int)
+    parser.add_argument('-n', '--num', type=int, default=3)
+    parser.add_argument('--flag', action='store_true')
+    parser.add_argument('--off', action='store_false')
+    parser.add_argument('-v', action='count', default=0)
+    parser.add_argument('--tag', action='append', default=['base'])
+    parser.add_argument('--pair', nargs=2)
+    parser.add_argument('--const', action='append_const', const=1)
+    return parser
+
+@pytest.mark.parametrize('argv', [
+    ['x'],
+    ['x', '1', '-2', '--num', '-5', '--flag', '--off', '-vvv'],
+    ['--', '-dash'],
+    ['y', '--tag', 'a', '--tag', 'b c', '--pair', 'p', 'q', '--const', '--const'],
+    ])
+def test_round_trip(argv):
+    parser = mk_parser()
+    namespace = parser.parse_args(argv)
+    assert round_trip(parser, namespace) == namespace
+
+def test_form_shaped_values():
+    parser = mk_parser()
+    namespace = argparse.Namespace(name='joe', rest=[None], num=7, flag=False, off=True,
+                                   v=['2'], tag='x', pair=[None], const=None)
+    assert namespace_argv(parser, namespace) == ['--num', '7', '-v', '-v', '--tag', 'x', 'joe']
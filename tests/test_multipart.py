@@ -0,0 +1,117 @@
+"""Tests for wsgiwrapper.multipart."""
+
+import io
+
+import pytest
+
+from wsgiwrapper.multipart import (FormParser, MalformedRequest, RequestTooLarge,
+                                   body_length, parse_form)
+
+BOUNDARY = 'xYzZY'
+CONTENT_TYPE = 'multipart/form-data; boundary=' + BOUNDARY
+UPLOAD = bytes(range(256)) * 4 + b'\r\n--xYzZ not quite a boundary\r\n'
+
+def multipart_body(boundary=BOUNDARY):
+    return b''.join([
+        b'preamble\r\n',
+        b'--', boundary.encode(), b'\r\n',
+        b'Content-Disposition: form-data; name="name"\r\n\r\n',
+        b'caf\xc3\xa9\r\n',
+        b'--', boundary.encode(), b'\r\n',
+        b'Content-Disposition: form-data; name="tags"\r\n\r\n',
+        b'a\r\n',
+        b'--', boundary.encode(), b'\r\n',
+        b'Content-Disposition: form-data; name="tags"\r\n\r\n',
+        b'\r\n',
+        b'--', boundary.encode(), b'\r\n',
+        b'Content-Disposition: form-data; name="upload"; filename="data.bin"\r\n',
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        UPLOAD, b'\r\n',
+        b'--', boundary.encode(), b'--\r\n',
+        b'epilogue',
+        ])
+
+def feed(body, chunk_size, **kwargs):
+    parser = FormParser(CONTENT_TYPE, len(body), **kwargs)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i:i + chunk_size])
+    return parser.close()
+
+def check(form):
+    assert sorted(form.keys()) == ['name', 'tags', 'upload']
+    assert form.getfirst('name') == u'caf\xe9'
+    assert form.getlist('tags') == ['a', '']
+    assert form['upload'].filename == 'data.bin'
+    assert form['upload'].headers['content-type'] == 'application/octet-stream'
+    assert form['upload'].value == UPLOAD
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 8, 13, 64, 1000, 1 << 20])
+def test_chunk_boundaries(chunk_size):
+    form = feed(multipart_body(), chunk_size)
+    try:
+        check(form)
+    finally:
+        form.close()
+
+def test_every_split():
+    # every place the body can be cut in two, e.g. inside a delimiter
+    body = multipart_body()
+    for i in range(len(body) + 1):
+        parser = FormParser(CONTENT_TYPE, len(body))
+        parser.feed(body[:i])
+        parser.feed(body[i:])
+        form = parser.close()
+        check(form)
+        form.close()
+
+def test_spooled_upload():
+    form = feed(multipart_body(), 100, spool_size=64)
+    try:
+        check(form)
+        assert form['upload'].file.path
+    finally:
+        form.close()
+
+def test_urlencoded():
+    body = b'a=1&b=caf%C3%A9&b=&c=x+y'
+    parser = FormParser('application/x-www-form-urlencoded', len(body))
+    for i in range(0, len(body), 3):
+        parser.feed(body[i:i + 3])
+    form = parser.close()
+    assert form.getfirst('a') == '1'
+    assert form.getlist('b') == [u'caf\xe9', '']
+    assert form.getfirst('c') == 'x y'
+
+def test_body_too_large():
+    body = multipart_body()
+    with pytest.raises(RequestTooLarge):
+        FormParser(CONTENT_TYPE, len(body), max_body_size=len(body) - 1)
+    with pytest.raises(RequestTooLarge):
+        feed(body, 10, max_body_size=len(body) - 1)  # when the length isn't known
+    with pytest.raises(RequestTooLarge):
+        feed(body, 10, max_part_size=len(UPLOAD) - 1)
+
+def test_malformed():
+    with pytest.raises(MalformedRequest):
+        FormParser('multipart/form-data')
+    with pytest.raises(MalformedRequest):
+        feed(multipart_body()[:-30], 10)  # no closing delimiter
+
+def test_parse_form():
+    body = multipart_body()
+    environ = {
+        'CONTENT_TYPE': CONTENT_TYPE,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body + b'trailing garbage'),
+        }
+    form = parse_form(environ, chunk_size=7)
+    try:
+        check(form)
+    finally:
+        form.close()
+
+def test_body_length():
+    assert body_length({'CONTENT_LENGTH': '12'}) == 12
+    assert body_length({}) == 0
+    assert body_length({'CONTENT_LENGTH': ''}) == 0
+    assert body_length({'wsgi.input_terminated': True}) == -1
@@ -0,0 +1,91 @@
+"""Tests for byte ranges: outputs.requested_range and wsgiwrapper.send_range."""
+
+import pytest
+
+import example
+from wsgiwrapper import RequestContext, wsgiwrapper
+from wsgiwrapper.outputs import UNSATISFIABLE, SpooledOutput, requested_range
+
+ETAG = '"abc"'
+DATE = 'Sat, 17 Oct 2026 00:00:00 GMT'
+
+@pytest.mark.parametrize('header, expected', [
+    ('', None),
+    ('bytes=0-9', (0, 10)),
+    ('bytes=10-', (10, 100)),
+    ('bytes=-10', (90, 100)),
+    ('bytes=-1000', (0, 100)),
+    ('bytes=90-1000', (90, 100)),
+    ('bytes=99-99', (99, 100)),
+    (' Bytes = 5-6', (5, 7)),
+    ('bytes=100-', UNSATISFIABLE),
+    ('bytes=200-300', UNSATISFIABLE),
+    ('bytes=9-1', None),
+    ('bytes=0-1,5-6', None),
+    ('bytes=x-y', None),
+    ('items=0-9', None),
+    ])
+def test_requested_range(header, expected):
+    assert requested_range({'HTTP_RANGE': header}, 100) == expected
+
+@pytest.mark.parametrize('if_range, expected', [
+    (ETAG, (0, 10)),
+    ('"other"', None),
+    ('W/' + ETAG, None),  # If-Range needs a strong match
+    (DATE, (0, 10)),
+    ('Fri, 16 Oct 2026 00:00:00 GMT', None),
+    ])
+def test_if_range(if_range, expected):
+    environ = {'HTTP_RANGE': 'bytes=0-9', 'HTTP_IF_RANGE': if_range}
+    assert requested_range(environ, 100, ETAG, DATE) == expected
+
+def send(environ, spool_size=1024):
+    app = wsgiwrapper(example.mk_parser(), example.main)
+    output = SpooledOutput(spool_size)
+    data = bytes(bytearray(i % 251 for i in range(5000)))
+    output.write(data)
+    response = []
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, dict(headers)]
+    environ = dict({'REQUEST_METHOD': 'GET'}, **environ)
+    request = RequestContext(environ, start_response)
+    headers = [('Content-Type', 'application/octet-stream')]
+    body = app.send_range(request, headers, output.size, output.etag, output.reader)
+    try:
+        content = b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+        output.discard()
+    return response[0], response[1], content, data
+
+@pytest.mark.parametrize('spool_size', [1 << 20, 1024])  # in memory, and spooled
+def test_send_range(spool_size):
+    status, headers, content, data = send({}, spool_size)
+    assert status == '200 OK'
+    assert headers['Content-Length'] == '5000'
+    assert 'Content-Range' not in headers
+    assert content == data
+
+    status, headers, content, data = send({'HTTP_RANGE': 'bytes=100-4199'}, spool_size)
+    assert status == '206 Partial Content'
+    assert headers['Content-Range'] == 'bytes 100-4199/5000'
+    assert headers['Content-Length'] == '4100'
+    assert content == data[100:4200]
+
+    status, headers, content, data = send({'HTTP_RANGE': 'bytes=-10'}, spool_size)
+    assert headers['Content-Range'] == 'bytes 4990-4999/5000'
+    assert content == data[-10:]
+
+def test_send_range_unsatisfiable():
+    status, headers, content, data = send({'HTTP_RANGE': 'bytes=5000-'})
+    assert status == '416 Range Not Satisfiable'
+    assert headers['Content-Range'] == 'bytes */5000'
+    assert content == b''
+
+def test_send_range_head():
+    status, headers, content, data = send(
+        {'REQUEST_METHOD': 'HEAD', 'HTTP_RANGE': 'bytes=0-99'})
+    assert status == '206 Partial Content'
+    assert headers['Content-Length'] == '100'
+    assert content == b''
@@ -0,0 +1,63 @@
+"""Tests for wsgiwrapper.utils."""
+
+import pytest
+
+from wsgiwrapper.utils import TicketRegistry
+
+def test_distinct_strings_are_their_own_tickets():
+    registry = TicketRegistry()
+    values = ['mammals', 'birds', 'fish']
+    assert registry.register('b', values) == values
+    assert [registry.redeem('b', value) for value in values] == values
+
+@pytest.mark.parametrize('values', [
+    [1, 2.5, None],
+    [['a', 'b'], {'k': 'v'}],  # unhashable
+    ['same', 'same'],
+    [b'bytes', 'text'],
+    ])
+def test_round_trip(values):
+    registry = TicketRegistry()
+    tickets = registry.register('x', values)
+    assert tickets == ['#%d' % i for i in range(len(values))]
+    assert [registry.redeem('x', ticket) for ticket in tickets] == values
+    assert all(isinstance(ticket, str) for ticket in tickets)
+
+def test_tickets_only_depend_on_the_values():
+    values = [object, len, ('a', 1)]
+    first, second = TicketRegistry(), TicketRegistry()
+    assert first.register('x', values) == second.register('x', values)
+
+def test_more_values_for_a_name():
+    registry = TicketRegistry()
+    assert registry.register('d', ['a', 'b']) == ['a', 'b']
+    assert registry.register('d', ['b', 'c']) == ['#2', '#3']  # 'b' is taken
+    assert registry.register('d', [1]) == ['#4']
+    assert registry.table('d') == {'a': 'a', 'b': 'b', '#2': 'b', '#3': 'c', '#4': 1}
+
+def test_names_are_separate():
+    registry = TicketRegistry()
+    registry.register('x', [1, 2])
+    registry.register('y', [3])
+    assert 'x' in registry and 'z' not in registry
+    assert registry.redeem('x', '#0') == 1
+    assert registry.redeem('y', '#0') == 3
+    assert registry.table('z') == {}
+
+def test_redeem_missing():
+    registry = TicketRegistry()
+    registry.register('x', [1])
+    with pytest.raises(KeyError):
+        registry.redeem('x', '#1')
+    with pytest.raises(KeyError):
+        registry.redeem('y', '#0')
+    assert registry.redeem('x', '#1', None) is None
+    assert registry.redeem('y', '#0', 'default') == 'default'
+
+def test_frozen():
+    registry = TicketRegistry()
+    tickets = registry.register('x', [1, 2])
+    registry.freeze()
+    with pytest.raises(RuntimeError):
+        registry.register('x', [3])
+    assert registry.redeem('x', tickets[1]) == 2
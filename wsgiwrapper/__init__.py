@@ -16,28 +16,50 @@ __copyright__ = "Copyright 2019 Samuel T. Denton, III"
 __version__ = '0.5'
 
 # Declutter our namespace
-__all__ = ['wsgiwrapper']
+__all__ = ['wsgiwrapper', 'InlineExecutor', 'ProcessExecutor', 'SubprocessExecutor',
+           'ResultCache', 'AdmissionControl']
 
 # Python standard libraries
 from functools import partial
+from hashlib import sha1
 from itertools import count
-from mimetypes import guess_type
 try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
 from wsgiref.handlers import format_date_time
 from wsgiref.headers import Headers
 #from wsgiref.validate import validator
-import argparse, cgi, copy, os, sys
+import argparse, json, os, sys, threading
 import re, time
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
 
 # Python site libraries
-from pystache.renderer import Renderer  # TODO: decouple pystache
+# pystache is imported when a page is first rendered; see load_template().
 
 # Python personal libraries
 from .htmltags import *
-from .utils import b64id, Backstop, print_where
+from .multipart import MalformedRequest, RequestTooLarge, SPOOL_SIZE, parse_form
+from .outputs import UNSATISFIABLE, open_output, output_spool, requested_range
+from .streaming import DONE, QueueWriter, StreamingResponse
+from .streaming import CHUNK_SIZE as STREAM_CHUNK_SIZE, QUEUE_SIZE as STREAM_QUEUE_SIZE
+from .jobs import FINISHED, Job, JobQueueFull, JobStore
+from .admission import AdmissionControl, Overloaded
+from .resultcache import ResultCache, namespace_key
+from .choices import ChoiceIndex
+from .executors import ExecutionTimeout, InlineExecutor, ProcessExecutor, SubprocessExecutor
+from .metrics import Metrics, timer
+from .compression import COMPRESS_TYPES, Compression, choose_coding, compress
+from . import assets, snapshot
+from .assets import ASSETS_PATH
+from .utils import Backstop, Lazy, TicketRegistry, etag_matches, print_where
 
 NL = '\n'
 QUESTION_MARK = u'u\2753'
@@ -49,16 +71,25 @@ MinusButton = partial(Input, type='button', value="&#x2796;", style='background-
 
 # common HTTP status codes
 status200 = '200 OK'
+status304 = '304 Not Modified'
 status404 = '404 Not Found'
 status500 = '500 Internal Server Error'
 
 # MIME types of common types of content
-IMAGE_ICON = [
-    ('Content-Type', 'image/x-icon'),
-    ('Cache-Control', 'public, max-age=31536000'),
-    ]
-TEXT_HTML = [('Content-Type', 'text/html')]
-TEXT_PLAIN = [('Content-Type', 'text/plain')]
+TEXT_HTML = [('Content-Type', 'text/html; charset=utf-8')]
+TEXT_PLAIN = [('Content-Type', 'text/plain; charset=utf-8')]
+APPLICATION_JSON = [('Content-Type', 'application/json')]
+
+JOBS_PATH = '/jobs/'  # background jobs live under here
+CHOICES_PATH = '/choices/'  # searches of large sets of choices live under here
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'wsgiwrapper.mustache')
+
+_templates = {}  # parsed templates, shared by every wsgiwrapper in the process
+_templates_lock = threading.Lock()
+
+FORM_MARK = '\0form\0'  # stands in for the form while a page template is rendered
+ERROR_HTML = '<div style="background-color:#c00000;"><pre>%s</pre></div>'
 
 js_library = {
     ##### ----- ##### ----- ##### ----- #####
@@ -110,6 +141,33 @@ function hide_li(node) {
 function show_li(name) {
     var li = document.getElementById(name+'.add');
     li.style.display = '';
+}''',
+    ##### ----- ##### ----- ##### ----- #####
+    'typeahead': r'''
+function typeahead(input, url) {
+    var list = document.getElementById(input.getAttribute('list'));
+    if (!list) {
+        list = document.createElement('datalist');
+        list.id = input.getAttribute('list');
+        document.body.appendChild(list);
+    }
+    var request = new XMLHttpRequest();
+    request.open('GET', url + '?limit=50&q=' + encodeURIComponent(input.value));
+    request.onload = function() {
+        if (request.status != 200) {
+            return;
+        }
+        list.innerHTML = '';
+        JSON.parse(request.responseText).choices.forEach(function(choice) {
+            var option = document.createElement('option');
+            option.value = choice.value;
+            if (choice.label != choice.value) {
+                option.textContent = choice.label;
+            }
+            list.appendChild(option);
+        });
+    };
+    request.send();
 }''',
     ##### ----- ##### ----- ##### ----- #####
     }
@@ -147,26 +205,160 @@ def isrange(choices):
         return None
 
 @print_where.tracing
-def mk_select(action):
-    """Create an HTML <select> element."""
+def mk_select(action, tickets):
+    """Create an HTML <select> element; tickets are the option values."""
     selct = Select()
     if action.nargs in (argparse.ZERO_OR_MORE, argparse.ONE_OR_MORE):
         selct.setAttribute('multiple', None)
     if action.required:
         selct.setAttribute('required', None)
     defaults = action.default if isinstance(action.default, (list, tuple)) else [action.default]
-    for option in action.choices:
+    for option, ticket in zip(action.choices, tickets):
         if isinstance(action.choices, dict):
             option_str = str(action.choices[option])
         else:
             option_str = str(option).title()
-        ticket = cgi.escape(str(option)) if isinstance(option, basestring) else self.registry.register(option)
-        opt = Option(cgi.escape(option_str), value=ticket)
+        opt = Option(escape(option_str), value=escape(ticket))
         if option in defaults:
             opt.setAttribute('selected', None)
         selct += opt
     return selct
 
+def load_template(path=TEMPLATE_PATH):
+    """Return the parsed template in a file; each file is only parsed once."""
+    with _templates_lock:
+        template = _templates.get(path)
+        if template is None:
+            from pystache import parse as parse_template  # TODO: decouple pystache
+            with open(path) as f:
+                template = _templates[path] = parse_template(f.read())  # TODO: decouple pystache
+    return template
+
+@print_where.tracing
+def mk_typeahead(action, url):
+    """Create a text <input> that offers the choices found by searching url."""
+    input = Input(type='text', autocomplete='off', list=action.dest+'.choices')
+    input.setAttribute('oninput', "typeahead(this, '%s')" % url)
+    input.setAttribute('onfocus', "typeahead(this, '%s')" % url)
+    if action.default is not None and not isinstance(action.default, (list, tuple)):
+        input.setAttribute('value', escape(str(action.default)))
+    return input
+
+class CachedPage(object):
+    """A fully rendered response body, along with the headers (including
+Content-Length, ETag and Cache-Control) needed to serve it."""
+
+    __slots__ = ('body', 'etag', 'headers', 'validators', 'encodings')
+
+    def __init__(self, headers, body_iter, cache_control=None):
+        body = b''.join(
+            chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+            for chunk in body_iter)
+        self.body = body
+        self.etag = '"%s"' % sha1(body).hexdigest()
+        headers = Headers(list(headers))
+        headers['Content-Length'] = str(len(body))
+        headers['ETag'] = self.etag
+        if cache_control and 'Cache-Control' not in headers:
+            headers['Cache-Control'] = cache_control
+        self.headers = headers.items()
+        self.validators = [(key, value) for key, value in self.headers
+                           if key in ('ETag', 'Cache-Control', 'Vary')]
+        self.encodings = {}  # content-coding -> CachedPage, compressed
+
+    def encoded(self, coding, level=6):
+        """Return a CachedPage of our body compressed with a content-coding;
+the body is only compressed once for each."""
+        page = self.encodings.get(coding)
+        if page is None:
+            headers = [(key, value) for key, value in self.headers
+                       if key not in ('Content-Length', 'ETag', 'Vary')]
+            headers += [('Content-Encoding', coding), ('Vary', 'Accept-Encoding')]
+            page = self.encodings[coding] = CachedPage(headers, [compress(self.body, coding, level)])
+        return page
+
+def file_headers(filename):
+    """Return the headers used to send an output file as a download."""
+    headers = [
+        ('Content-Disposition', 'attachment; filename="'+filename+'"'),
+        ('Last-Modified', format_date_time(time.time())),
+        ]
+    from mimetypes import guess_type  # reads the system's MIME types when imported
+    content_type, encoding = guess_type(filename)
+    if content_type:
+         headers.append(('Content-Type', content_type))
+    if encoding:
+         headers.append(('Content-Encoding', encoding))
+    return headers
+
+class RequestContext(object):
+    """Everything that belongs to a single request.
+
+Keeping this off the wsgiwrapper instance lets one instance serve
+several requests at once, e.g. under a threaded server."""
+
+    def __init__(self, environ, start_response):
+        self.environ = environ
+        self.server_start_response = start_response
+        self.output_files = {}  # dest -> output file, for FileType('w')
+        self.stdout = StringIO()  # captures both stdout and stderr
+        self.form = None  # the submitted form, once it has been parsed
+        self.parser = None  # the ArgumentParser it was made from, e.g. for SubprocessExecutor
+        self.detached = False  # True if the program outlives __call__
+        self.cache_key = None  # set if the response may be cached
+        self.response_headers = None  # (status, headers) when captured
+        self.status = None  # the status of our response, once it has started
+        self.timings = None  # [(phase, seconds)], if they are being measured
+        self.server_timing = False  # send the timings as a Server-Timing header?
+        self.exit_code = None  # the wrapped program's, once it has finished
+        self.compression = None  # a Compression, if our response may be compressed
+        self.coding = None  # the content-coding the client prefers, if it accepts one
+        self.compressor = None  # a Compressor, if our response is being compressed
+        self.release = None  # gives up our turn to run the program, once we have one
+        self.download = None  # the SpooledOutput of an output file being sent
+        self.keep_download = False  # leave it for someone else (e.g. a Job) to discard?
+
+    def time(self, phase, started):
+        """Note how long a phase took, if we are measuring them."""
+        if self.timings is not None:
+            self.timings.append((phase, timer() - started))
+
+    def start_response(self, status, headers, exc_info=None):
+        # Servers may add to the list of headers they are given (wsgiref
+        # adds Content-Length), so never hand them one of our shared lists.
+        self.status = status
+        headers = list(headers)
+        if self.server_timing and self.timings:
+            headers.append(('Server-Timing', ', '.join(
+                '%s;dur=%.3f' % (phase, seconds * 1000) for phase, seconds in self.timings)))
+        if self.compression is not None:
+            headers, self.compressor = self.compression.apply(status, headers, self.coding)
+            if self.compressor is not None:
+                return self.compressor.writer(self.server_start_response(status, headers, exc_info))
+        return self.server_start_response(status, headers, exc_info)
+
+    def finish(self, body):
+        """Return our response iterable, compressed if it is to be."""
+        if self.compressor is None or self.environ['REQUEST_METHOD'] == 'HEAD':
+            return body
+        return self.compressor.wrap(body)
+
+    def close(self):
+        """Release anything held for the request, e.g. uploaded files."""
+        if self.release is not None:
+            release, self.release = self.release, None
+            release()
+        if self.form is not None:
+            self.form.close()
+        spools = [getattr(outfile, 'buffer', outfile) for outfile in self.output_files.values()]
+        if self.download is not None and self.download not in spools:
+            spools.append(self.download)  # a copy, e.g. of a ProcessExecutor's output
+        for spool in spools:
+            if spool is self.download and self.keep_download:
+                continue
+            if hasattr(spool, 'discard'):
+                spool.discard()
+
 class wsgiwrapper(object):
     """\
 Creates a WSGI application from a CLI program that uses ArgumentParser.
@@ -181,8 +373,6 @@ to create an argparse.Namespace object.  That object will be passed to
 the 'process()' function of the CLI program.
 """
 
-    registry = b64id()
-
     defaults = {
         'form_name': '',
         'prefix': None,
@@ -193,8 +383,42 @@ the 'process()' function of the CLI program.
             argparse._VersionAction,
             },
         'use_tables': False,
+        'cache_control': 'no-cache',
+        'executor': None,
+        'spool_size': SPOOL_SIZE,
+        'max_body_size': None,
+        'max_part_size': None,
+        'stream_output': False,
+        'stream_chunk_size': STREAM_CHUNK_SIZE,
+        'stream_queue_size': STREAM_QUEUE_SIZE,
+        'async_jobs': False,
+        'max_running_jobs': 4,
+        'max_queued_jobs': 100,
+        'job_ttl': 3600,
+        'max_finished_jobs': 1000,
+        'retry_after': 5,
+        'admission': None,
+        'result_cache': None,
+        'cacheable': True,
+        'max_select_choices': 1000,
+        'metrics': None,
+        'metrics_path': '/metrics',
+        'server_timing': False,
+        'snapshot_dir': None,
+        'compress_responses': True,
+        'compress_min_size': 1024,
+        'compress_types': COMPRESS_TYPES,
+        'compress_level': 6,
         }
 
+    # The options that change the form; see the snapshot module.
+    form_options = ('hooks', 'skip_groups', 'submit_actions', 'use_tables',
+                    'cache_control', 'max_select_choices')
+
+    # The environ keys used by our template; a rendered form page is
+    # cached for each distinct combination of their values.
+    template_keys = ('SCRIPT_NAME', 'PATH_INFO')
+
     type_lookup = {
         basestring: 'text',
         int: 'number',
@@ -203,15 +427,49 @@ the 'process()' function of the CLI program.
 
     @print_where.tracing
     def __init__(self, parser, runapp, **kwargs):
-        from collections import Counter
-
         self.parser = parser  # The argparse object to turn into an HTML form.
         self.runapp = runapp  # The app to run when the form is POSTed.
-        self.renderer = Renderer()  # TODO: decouple pystache
+        self.renderer = None  # created when a page is first rendered
+        self.template = None  # likewise
+        self.assets = None  # the names of our stylesheet and scripts, once registered
+        self.pages = {}  # rendered form pages, keyed by template_keys
+        self.page_templates = {}  # compiled form pages, keyed the same way
         self.script = set()
         self.toolbox = []
+        self.choice_indexes = {}  # dest -> ChoiceIndex, for large sets of choices
+        self.registry = TicketRegistry()  # tickets for choices and consts, by dest
+        self.select_actions = set()  # actions whose values are tickets
+        self.buttons = []
         for name, default in self.defaults.items():
             setattr(self, name, kwargs.get(name, default))
+        if self.executor is None:
+            self.executor = InlineExecutor()
+        self.compression = None
+        if self.compress_responses:
+            self.compression = Compression(self.compress_types, self.compress_min_size,
+                                           self.compress_level)
+        self.jobs = None
+        if self.async_jobs:
+            self.jobs = JobStore(self.max_running_jobs, self.max_queued_jobs, self.job_ttl,
+                                 self.max_finished_jobs)
+        self.snapshot_key = None
+        if self.snapshot_dir is not None:
+            self.snapshot_key = snapshot.parser_key(
+                parser,
+                dict((name, getattr(self, name)) for name in self.form_options),
+                __version__, snapshot.FORMAT, snapshot.package_digest(), js_library,
+                TEMPLATE_PATH, os.path.getmtime(TEMPLATE_PATH),
+                assets.STYLESHEET_PATH, os.path.getmtime(assets.STYLESHEET_PATH))
+        if not self.load_snapshot():
+            self.build_form(parser)
+            self.save_snapshot()
+        self.decoders = [(action.dest, self.mk_decoder(action))
+                         for action in parser._actions if action not in self.buttons]
+
+    @print_where.tracing
+    def build_form(self, parser):
+        """Walk the parser, building our form and everything needed to decode it."""
+        from collections import Counter
         input_files, output_files = {}, {}
         cntr = Counter()
 
@@ -219,7 +477,6 @@ the 'process()' function of the CLI program.
         if parser.description:
             form += P(parser.description, Class="description")
         button_bar = Div(Class="button_bar")
-        self.buttons = []
         templates = Div(Style="display:none")
 
         for action_group in parser._action_groups:
@@ -242,19 +499,25 @@ the 'process()' function of the CLI program.
                     if isinstance(action, tuple(self.submit_actions)):
                         print_where('action in submit_actions')
                         button_bar += Input(type="submit", name=dest,
-                                value=cgi.escape(dest.title()),
+                                value=escape(dest.title()),
                                 formnovalidate=None)
                         self.buttons.append(action)
                         continue
                     triplet = isrange(action.choices) if action.choices else False
-                    print_where('triplet = %r' % (triplet,))
-                    if action.choices is not None and not triplet:
+                    print_where('triplet =', print_where.repr(triplet))
+                    if action.choices is not None and not triplet and self.use_typeahead(action):
+                        print_where('action has too many choices for a <select>')
+                        self.choice_indexes[dest] = ChoiceIndex(action.choices)
+                        input = mk_typeahead(action, CHOICES_PATH[1:] + dest)
+                        self.script.add('typeahead')
+                    elif action.choices is not None and not triplet:
                         print_where('action requires <select>')
-                        input = mk_select(action)
+                        input = mk_select(action, self.registry.register(dest, action.choices))
+                        self.select_actions.add(action)
                     elif isinstance(action, argparse._StoreConstAction):
-                        ticket = self.registry.register(action.const)
+                        ticket, = self.registry.register(dest, [action.const])
                         input = Input(type='checkbox',
-                                      value=cgi.escape(ticket),
+                                      value=escape(ticket),
                                       style="justify-self:left")
                     elif isinstance(action, argparse._StoreAction):
                         print_where('action is a _StoreAction')
@@ -269,7 +532,7 @@ the 'process()' function of the CLI program.
                         else:
                             input = Input(type=self.type_lookup.get(action.type, 'text'))
                             if action.default:
-                                input.setAttribute('value', cgi.escape(str(action.default)))
+                                input.setAttribute('value', escape(str(action.default)))
                             if triplet:
                                 input.setAttribute('min', triplet[0])
                                 input.setAttribute('max', triplet[1])
@@ -286,7 +549,7 @@ the 'process()' function of the CLI program.
                         print_where('action is a _CountAction')
                         input = Input(type='number', min=0)
                         if action.default:
-                            input.setAttribute('value', cgi.escape(str(action.default)))
+                            input.setAttribute('value', escape(str(action.default)))
                     else:
                         print_where('should never be here')
                         continue  # TODO: can we ever get here?
@@ -323,7 +586,7 @@ the 'process()' function of the CLI program.
                     self.script.add('add_li')
                     self.script.add('rm_li')
                 elif nargs == argparse.ONE_OR_MORE:
-                    first = copy.deepcopy(input)
+                    first = input.clone()
                     first.setAttribute('required', None)
                     item = Ul(id=dest_id+'.ul', Class='input-ul')
                     item += Li(PlusButton(onclick='add_li("'+dest_id+'")'), first)
@@ -337,7 +600,7 @@ the 'process()' function of the CLI program.
                 else:
                     item = Ul(id=dest_id+'.ul', Class='input-ul')
                     for _ in range(nargs):
-                        item += Li(copy.deepcopy(input))
+                        item += Li(input.clone())
 
                 if self.use_tables:
                     my_row = Tr()
@@ -362,7 +625,7 @@ the 'process()' function of the CLI program.
                         if value == argparse.SUPPRESS:
                             del params[key]
                         elif hasattr(value, '__name__'):
-                            params[name] = value.__name__
+                            params[key] = value.__name__
                         else:
                             pass
                     if params.get('choices') is not None:
@@ -394,7 +657,181 @@ the 'process()' function of the CLI program.
         form += button_bar
         if parser.epilog:
             form += P(parser.epilog, Class="epilog")
-        self.form = form
+        self.form = form.freeze()  # the form won't change, so make it compact
+        self.registry.freeze()
+
+    @print_where.tracing
+    def freeze(self, *environs):
+        """\
+Get ready to be shared by the workers of a pre-forking server: render
+our page for each environ given (by default, the one for '/'), and
+replace what __init__ built with immutable containers, so nothing on
+the instance changes as requests are handled.  Everything belonging to
+a request lives in its RequestContext.  Returns self."""
+        for environ in environs or ({'SCRIPT_NAME': '', 'PATH_INFO': '/'},):
+            page = self.form_page(environ)
+            if self.compression is not None and self.compression.allows(page.headers):
+                for coding in ('gzip', 'deflate'):
+                    page.encoded(coding, self.compress_level)
+        self.asset_urls({})
+        import email.parser, email.utils  # every POST needs them; share one copy
+        self.script = frozenset(self.script)
+        self.toolbox = tuple(item.freeze() if hasattr(item, 'freeze') else item
+                             for item in self.toolbox)
+        self.buttons = tuple(self.buttons)
+        self.select_actions = frozenset(self.select_actions)
+        self.decoders = tuple(self.decoders)
+        return self
+
+    def snapshot_state(self):
+        """Return everything build_form() and the page renderers made, to be pickled."""
+        index = dict((id(action), i) for i, action in enumerate(self.parser._actions))
+        return dict(
+            form=self.form,
+            script=sorted(self.script),
+            toolbox=self.toolbox,
+            # a ChoiceIndex is quicker to rebuild than to unpickle
+            choice_indexes=sorted(self.choice_indexes),
+            registry=self.registry,
+            buttons=[index[id(action)] for action in self.buttons],
+            select_actions=sorted(index[id(action)] for action in self.select_actions),
+            page_templates=dict(self.page_templates),
+            pages=dict(self.pages),
+            )
+
+    @print_where.tracing
+    def load_snapshot(self):
+        """Load the state saved by another process, if there is one; return True if it was."""
+        if self.snapshot_key is None:
+            return False
+        state = snapshot.load(self.snapshot_dir, self.snapshot_key)
+        if state is None:
+            return False
+        actions = self.parser._actions
+        self.form = state['form']
+        self.script = set(state['script'])
+        self.toolbox = state['toolbox']
+        self.choice_indexes = dict((action.dest, ChoiceIndex(action.choices)) for action in actions
+                                   if action.dest in state['choice_indexes'] and action.choices)
+        self.registry = state['registry']
+        self.buttons = [actions[i] for i in state['buttons']]
+        self.select_actions = set(actions[i] for i in state['select_actions'])
+        self.page_templates = state['page_templates']
+        self.pages = state['pages']
+        return True
+
+    def save_snapshot(self):
+        """Save our state for other processes, if we have somewhere to put it."""
+        if self.snapshot_key is not None:
+            snapshot.save(self.snapshot_dir, self.snapshot_key, self.snapshot_state())
+
+    def use_typeahead(self, action):
+        """\
+Should an action's choices be searched as the user types, instead of
+listed in a <select>?  A '.typeahead' hook decides; otherwise, yes if
+there are more than max_select_choices of them."""
+        hook = action.dest + '.typeahead'
+        if hook in self.hooks:
+            return bool(self.hooks[hook])
+        return len(action.choices) > self.max_select_choices
+
+    def mk_decoder(self, action):
+        """\
+Return a function that takes a request, its form, and a list to add
+invalid choices to, and returns the value of an action.  Everything that
+depends only on the action is decided here, once, so that building a
+Namespace for a POST is just a call for each action."""
+        dest, default, convert = action.dest, action.default, action.type
+
+        if isinstance(convert, argparse.FileType):
+            mode = convert._mode
+            if 'r' in mode:
+                encoding = getattr(convert, '_encoding', None)
+                errors = getattr(convert, '_errors', None)
+                def decode(request, form, invalid):
+                    # uploads are opened, never read into memory
+                    field = form[dest]
+                    if not field.filename:
+                        return None
+                    return field.open(mode, encoding, errors)
+            else:
+                encoding = getattr(convert, '_encoding', None)
+                errors = getattr(convert, '_errors', None)
+                def decode(request, form, invalid):
+                    # create a file-like object from our text input
+                    filename = form[dest].value
+                    if not filename:
+                        return None
+                    outfile = request.output_files[dest] = open_output(
+                        filename, mode, encoding, errors, self.spool_size)
+                    return outfile
+            return decode
+
+        if isinstance(action, argparse._StoreConstAction):
+            # this is a checkbox, so ignore nargs
+            consts = self.registry.table(dest)
+            def decode(request, form, invalid):
+                ticket = form.getfirst(dest)
+                return default if ticket is None else consts.get(ticket, default)
+            return decode
+
+        if action in self.select_actions or dest in self.choice_indexes:
+            # choices were converted by argparse's caller, so don't convert them again
+            index = self.choice_indexes.get(dest)
+            choices = index.choices if index is not None else self.registry.table(dest)
+            def redeem(value, invalid):
+                if value == '' or value is default:
+                    return default
+                try:
+                    return choices[value]
+                except KeyError:
+                    invalid.append((action, value))
+                    return value
+            if action.nargs is None:
+                def decode(request, form, invalid):
+                    return redeem(form.getfirst(dest, default), invalid)
+            else:
+                def decode(request, form, invalid):
+                    values = [value for value in form.getlist(dest) if value != '']
+                    if not values:
+                        return [default]
+                    return [redeem(value, invalid) for value in values]
+            return decode
+
+        if convert is None:
+            convert = lambda value: value
+        else:
+            type_func = convert
+            def convert(value):
+                if not isinstance(value, basestring):
+                    return value  # a default, which argparse wouldn't convert
+                try:
+                    return type_func(value)
+                except:
+                    return type_func()
+
+        if action.nargs is None:
+            # no nargs means there can be only one
+            def decode(request, form, invalid):
+                return convert(form.getfirst(dest, default))
+        else:
+            split = dest+'.split' in self.hooks
+            def decode(request, form, invalid):
+                values = form.getlist(dest)
+                if not values:
+                    return [default]
+                if split:
+                    values = values[0].split()
+                return [convert(value) for value in values]
+        return decode
+
+    def mk_namespace(self, request, invalid):
+        """Build a Namespace from request.form, with our decoders."""
+        namespace = argparse.Namespace()
+        form = request.form
+        for dest, decode in self.decoders:
+            setattr(namespace, dest, decode(request, form, invalid))
+        return namespace
 
     @print_where.tracing
     def mk_form(self, *context, **kwargs):
@@ -402,17 +839,117 @@ the 'process()' function of the CLI program.
 
 Returns a list of headers and a generator for the actual form data,
 which we can discard if we are processing, e.g., a HEAD request."""
+        if self.renderer is None:
+            from pystache.renderer import Renderer  # TODO: decouple pystache
+            self.template = load_template()
+            self.renderer = Renderer()
         return TEXT_HTML, [ str(
-            self.renderer.render_path(  # TODO: decouple pystache
-                'wsgiwrapper/wsgiwrapper.mustache',
-                *context, **kwargs) ) ]
+            self.renderer.render(  # TODO: decouple pystache
+                self.template,
+                *context, **kwargs) ).encode('utf-8') ]
+
+    @print_where.tracing
+    def page_template(self, environ):
+        """Return the headers and CompiledTemplate for our form's page.
+
+The page is rendered once for each set of environ values it uses, with
+a marker in place of the form; the form's Element tree is compiled in
+its place, after an 'error' Slot, so that a page reporting an error is
+just a join of a few byte strings."""
+        key = tuple(environ.get(name, '') for name in self.template_keys)
+        result = self.page_templates.get(key)
+        if result is None:
+            headers, form_iter = self.mk_form(
+                dict(zip(self.template_keys, key)),
+                toolbox=self.toolbox,
+                form=FORM_MARK,
+                **self.asset_urls(environ))
+            page = b''.join(form_iter).decode('utf-8')
+            if FORM_MARK in page:
+                head, tail = page.split(FORM_MARK, 1)
+                template = compile_tree(head, Slot('error'), self.form, tail)
+            else:
+                template = compile_tree(page)  # mk_form has been overridden
+            result = self.page_templates[key] = headers, template
+        return result
+
+    def asset_urls(self, environ):
+        """\
+Return the URLs of our stylesheet and of the scripts our form uses, as
+the 'stylesheet' and 'script_src' values of our page template.  The
+scripts are bundled, and both are registered as assets, the first time
+this is called."""
+        if self.assets is None:
+            scripts = [assets.bundle(js_library[func] for func in sorted(self.script))] if self.script else []
+            self.assets = [assets.stylesheet()], scripts
+        base = environ.get('SCRIPT_NAME', '') + ASSETS_PATH
+        stylesheets, scripts = self.assets
+        return dict(stylesheet=[base + name for name in stylesheets],
+                    script_src=[base + name for name in scripts])
+
+    @print_where.tracing
+    def form_page(self, environ):
+        """Return the CachedPage for our form, rendering it if needed.
+
+The form doesn't change once __init__ has finished, so the page only
+needs to be rendered once for each set of environ values it uses."""
+        key = tuple(environ.get(name, '') for name in self.template_keys)
+        page = self.pages.get(key)
+        if page is None:
+            headers, template = self.page_template(environ)
+            page = self.pages[key] = CachedPage(
+                headers, [template.render()], self.cache_control)
+            self.save_snapshot()
+        return page
 
     @print_where.tracing
     def __call__(self, environ, start_response):
         """Display (GET) or processs (POST) our form."""
-        self.environ = environ
-        self.start_response = start_response
-        parser = self.parser
+        request = self.new_request(environ, start_response)
+        if not self.measuring:
+            return request.finish(self.route(request))
+        return request.finish(self.measure(request))
+
+    def new_request(self, environ, start_response):
+        """Return the RequestContext for a request, with its response's compression chosen."""
+        request = RequestContext(environ, start_response)
+        if self.compression is not None:
+            request.compression = self.compression
+            request.coding = choose_coding(environ.get('HTTP_ACCEPT_ENCODING'))
+        return request
+
+    @property
+    def measuring(self):
+        """Are requests' phases timed?"""
+        return self.metrics is not None or self.server_timing
+
+    def measure(self, request):
+        """Route a request, timing its phases and recording its metrics."""
+        started = self.begin(request)
+        body = None
+        try:
+            body = self.route(request)
+            return body
+        finally:
+            self.end(request, started, body)
+
+    def begin(self, request):
+        """Start timing a request's phases, counting it as in flight; return when it started."""
+        request.timings = []
+        request.server_timing = self.server_timing
+        if self.metrics is not None:
+            self.metrics.started(self.form_name)
+        return timer()
+
+    def end(self, request, started, body):
+        """Record the metrics of a request that begin() was called for."""
+        if self.metrics is not None:
+            self.metrics.finished(self.form_name, request, timer() - started, body)
+
+    @print_where.tracing
+    def route(self, request):
+        """Send a request to the method that handles it."""
+        environ = request.environ
 
         # Did we receive a GET or HEAD reques?
         # Display our form.
@@ -420,183 +957,477 @@ which we can discard if we are processing, e.g., a HEAD request."""
         req_method = environ['REQUEST_METHOD']
         if req_method in {'GET', 'HEAD'}:
             path_info = environ['PATH_INFO']
-            if path_info == '/favicon.ico':
-                try:
-                    with open(path_info[1:], 'rb') as favicon:
-                        self.start_response(status200, IMAGE_ICON,)
-                        return [favicon.read()]
-                except:
-                    pass
+            if path_info == '/favicon.ico' and assets.favicon() is not None:
+                return assets.send(environ, request.start_response, assets.favicon())
+            if path_info.startswith(ASSETS_PATH):
+                return self.do_asset(request, path_info[len(ASSETS_PATH):])
+            if self.jobs is not None and path_info.startswith(JOBS_PATH):
+                body = self.do_job(request, path_info[len(JOBS_PATH):])
+                return [] if req_method == 'HEAD' else body
+            if path_info.startswith(CHOICES_PATH):
+                body = self.do_choices(request, path_info[len(CHOICES_PATH):])
+                return [] if req_method == 'HEAD' else body
+            if path_info == self.metrics_path and self.metrics is not None:
+                body = self.do_metrics(request)
+                return [] if req_method == 'HEAD' else body
             if path_info != '/':
-                self.start_response(status404, TEXT_PLAIN,)
-                return ['Not found']
-            headers, form_iter = self.mk_form(
-                self.environ,
-                script=[js_library[func] for func in self.script],
-                toolbox=self.toolbox,
-                form=self.form,
-                )
-            self.start_response(status200, headers)
-            return [] if req_method == 'HEAD' else form_iter
+                request.start_response(status404, TEXT_PLAIN,)
+                return [b'Not found']
+            page = self.form_page(environ)
+            if request.coding is not None and self.compression.allows(page.headers):
+                page = page.encoded(request.coding, self.compress_level)
+            if etag_matches(environ.get('HTTP_IF_NONE_MATCH'), page.etag):
+                request.start_response(status304, page.validators)
+                return []
+            request.start_response(status200, page.headers)
+            return [] if req_method == 'HEAD' else [page.body]
 
         # The only other acceptable request is a POST.
         if req_method != 'POST':
-            self.start_response('405 Method Not Allowed', TEXT_PLAIN)
+            request.start_response('405 Method Not Allowed', TEXT_PLAIN)
             return []
 
-        # Guard against errors while working...
-        with Backstop(environ, self.start_response):
+        if print_where.active and print_where.capturing() is None:
+            return self.traced_post(request)
+        try:
+            return self.do_post(request)
+        finally:
+            if not request.detached:
+                request.close()
 
-            # Parse the submitted data.
-            print_where('Parse the submitted data.')
+    def traced_post(self, request):
+        """\
+Process a POST while tracing, keeping its messages together instead of
+mixing them with those of other requests."""
+        with print_where.capture() as trace:
             try:
-                fieldstorage = cgi.FieldStorage(
-                    fp=environ['wsgi.input'],
-                    environ=environ,
-                    keep_blank_values=True)
-            except Exception:
-                # The only error I've seen generated is when
-                # wsgiref.validate is being used. See
-                # http://python.6.x6.nabble.com/Revising-environ-wsgi-input-readline-in-the-WSGI-specification-td2211999.html#a2212023
-                from traceback import format_exc
-                print_where(format_exc())
-                return []
+                return self.do_post(request)
+            finally:
+                if not request.detached:
+                    request.close()
+                errors = request.environ.get('wsgi.errors', sys.stderr)
+                errors.write(''.join(message + '\n' for message in trace))
+
+    @print_where.tracing
+    def do_post(self, request):
+        """Process a submitted form."""
+        response = self.screen_post(request)
+        if response is not None:
+            return response
+
+        # Parse the submitted data.
+        print_where('Parse the submitted data.')
+        started = timer()
+        try:
+            request.form = parse_form(
+                request.environ,
+                spool_size=self.spool_size,
+                max_body_size=self.max_body_size,
+                max_part_size=self.max_part_size)
+        except (RequestTooLarge, MalformedRequest) as err:
+            return self.do_bad_request(request, err)
+        request.time('parse', started)
+        return self.do_form(request)
+
+    def screen_post(self, request):
+        """\
+Return a response turning a POST away before its body is read, or None
+if the body should be read and the form processed."""
+        if self.admission is not None and self.jobs is None and \
+                self.admission.full(self.client_id(request)):
+            # don't bother reading a body we'd only turn away
+            if self.metrics is not None:
+                self.metrics.rejected(self.form_name, 'full', waited=False)
+            return self.do_overloaded(request, Overloaded('full'))
+        return None
+
+    @print_where.tracing
+    def do_bad_request(self, request, err):
+        """Overridable method to reject a body that couldn't be parsed."""
+        if isinstance(err, RequestTooLarge):
+            request.start_response('413 Request Entity Too Large', TEXT_PLAIN)
+        else:
+            request.start_response('400 Bad Request', TEXT_PLAIN)
+        return [ str(err).encode('utf-8') ]
+
+    @print_where.tracing
+    def do_form(self, request):
+        """Respond to a parsed form, in request.form."""
+        environ = request.environ
+        start_response = request.start_response
+        fieldstorage = request.form
+        parser = request.parser = self.parser
+        new_args = None
+
+        # Guard against errors while working...
+        with Backstop(environ, start_response):
 
             # Did the user click on a button?
             print_where('Did the user click on a button?')
             for action in self.buttons:
                 if action.dest in fieldstorage:
                     if isinstance(action, argparse._HelpAction):
-                        self.start_response(status200, TEXT_PLAIN)
+                        start_response(status200, TEXT_PLAIN)
                         return [ parser.format_help().encode() ]
                     elif isinstance(action, argparse._VersionAction):
                         formatter = parser.formatter_class(parser.prog)
                         formatter.add_text(action.version)
-                        self.start_response(status200, TEXT_PLAIN)
+                        start_response(status200, TEXT_PLAIN)
                         return [ formatter.format_help().encode() ]
                     else:
-                        self.start_response(status200, TEXT_PLAIN)
+                        start_response(status200, TEXT_PLAIN)
                         return [ str(action.__class__).encode() ]
                     return
 
             # Create an argparse.Namespace from the fieldstorage.
             print_where('Create an argparse.Namespace from the fieldstorage.')
-            new_args = argparse.Namespace()
-            self.output_files = {}
-            for action in parser._actions:
-                print_where('action =', action)
-                if action in self.buttons:
-                    continue
-                dest = action.dest
-                if isinstance(action, argparse._StoreConstAction):
-                    # this is a checkbox, so ignore nargs
-                    value = fieldstorage.getfirst(dest, action.default)
-                    value = self.registry.redeem(value)
-                elif action.nargs is None:
-                    # no nargs means there can be only one
-                    value = fieldstorage.getfirst(dest, action.default)
-                else:
-                    value = fieldstorage.getlist(dest) or [action.default]
-                    if dest+'.split' in self.hooks:
-                        value = value[0].split()
-                print_where('value =', repr(value)[:240])
-
-                if action.type:
-                    if isinstance(action.type, argparse.FileType):
-                        field = fieldstorage[dest]
-                        print_where('field =', repr(field)[:240])
-                        if 'r' in action.type._mode:
-                            # need to read from a file-like object
-                            filename = field.filename
-                            print_where('filename =', repr(filename)[:240])
-                            if filename:
-                                value = StringIO(field.value)
-                                value.name = filename
-                            else:
-                                value = None
-                            print_where('value =', repr(value)[:240])
-                        else:
-                            # create a file-like object from our text input
-                            value = self.output_files[dest] = StringIO()
-                            filename = field.value
-                            if filename:
-                                value.name = filename
-                            else:
-                                value = None
-                    else:
-                        try:
-                            value = action.type(value)
-                        except:
-                            value = action.type()
-                print_where('value =', repr(value)[:240])
+            invalid = []  # (action, value) for choices that don't exist
+            started = timer()
+            namespace = self.mk_namespace(request, invalid)
+            request.time('namespace', started)
 
-                # add this to our Namespace object
-                setattr(new_args, dest, value)
+            if invalid:
+                # no usage message: it would list every choice
+                for action, value in invalid:
+                    request.stdout.write('%s: error: argument %s: invalid choice: %r\n' % (
+                        parser.prog, '/'.join(action.option_strings) or action.dest, value))
+                return self.respond(request, SystemExit(2))
 
-            if self.prefix is not None:
+            if self.prefix is not None and self.executor.in_process:
                 # drop hints that we're a web app
-                setattr(new_args, self.prefix+'environ', environ)
-                setattr(new_args, self.prefix+'start_response', self.start_response)
-            newout = StringIO()
+                setattr(namespace, self.prefix+'environ', environ)
+                setattr(namespace, self.prefix+'start_response', start_response)
+            new_args = namespace
+
+        if new_args is None:
+            return []  # Backstop has already reported the problem
+
+        # have we already seen this form?
+        request.cache_key = self.cache_key(request, new_args)
+        if request.cache_key is not None:
+            result = self.result_cache.get(request.cache_key)
+            if result is not None:
+                print_where('result cache hit', request.cache_key)
+                start_response(result.status, result.headers)
+                return [result.body]
 
         # build the rest of the execution environment
+        if self.jobs is not None:
+            return self.do_submit(request, new_args)
+        if self.admission is not None:
+            response = self.admit(request)
+            if response is not None:
+                return response
+        if self.stream_output:
+            return self.do_stream(request, new_args)
+        return self.execute(request, new_args)
+
+    @print_where.tracing
+    def admit(self, request):
+        """\
+Wait for a turn to run the program, returning None once we have one
+(it is given up when the request is closed) or a response turning the
+request away."""
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.waiting(self.form_name)
+        started = timer()
+        try:
+            self.admission.acquire(self.client_id(request))
+        except Overloaded as err:
+            if metrics is not None:
+                metrics.rejected(self.form_name, err.reason)
+            return self.do_overloaded(request, err)
+        request.time('queue', started)
+        admission = self.admission
+        if metrics is None:
+            request.release = admission.release
+        else:
+            metrics.admitted(self.form_name, timer() - started)
+            def release():
+                admission.release()
+                metrics.released(self.form_name)
+            request.release = release
+        return None
+
+    def client_id(self, request):
+        """\
+Overridable method to say who sent a request, so that clients take
+turns to run the program.  Behind a proxy, override this to use e.g. the
+X-Forwarded-For header."""
+        return request.environ.get('REMOTE_ADDR')
+
+    @print_where.tracing
+    def do_overloaded(self, request, err):
+        """Overridable method to turn away a request that wasn't admitted."""
+        request.start_response('503 Service Unavailable',
+                               TEXT_PLAIN + [('Retry-After', str(self.retry_after))])
+        if err.reason == 'timeout':
+            return [b'The server is busy, and the request waited too long to run; please try again later.\n']
+        return [b'Too many requests are waiting to run; please try again later.\n']
+
+    @print_where.tracing
+    def execute(self, request, new_args):
+        """Run the program and build a response from however it ended."""
+        if request.cache_key is not None:
+            start_response = request.start_response
+            def capture(status, headers, exc_info=None):
+                request.response_headers = status, headers
+                return start_response(status, headers, exc_info)
+            request.start_response = capture
+        started = timer()
         try:
+            self.executor.run(self.runapp, request, new_args)
+        except (SystemExit, Exception) as err:
+            ended = err
+        else:
+            ended = SystemExit(None)  # an executor that returns, rather than raising SystemExit
+        request.time('run', started)
+        started = timer()
+        response = self.respond(request, ended)
+        request.time('respond', started)
+        if request.cache_key is None or request.response_headers is None:
+            return response
+        status, headers = request.response_headers
+        if status != status200 or not isinstance(response, list):
+            return response  # e.g. a spooled output file, to be sent from disk
+        max_bytes = getattr(self.result_cache, 'max_bytes', None)
+        if max_bytes is not None and sum(len(chunk) for chunk in response) > max_bytes:
+            return response  # too big to cache, so don't copy it
+        body = b''.join(response)
+        self.result_cache.put(request.cache_key, status, headers, body)
+        return [body]
+
+    @print_where.tracing
+    def cache_key(self, request, new_args):
+        """\
+Return the key for the result cache, or None if the result shouldn't be
+cached.  The 'cacheable' option may be a callable that is passed the
+Namespace; arguments with a '.nocache' hook don't contribute to the key."""
+        if self.result_cache is None:
+            return None
+        if callable(self.cacheable):
+            if not self.cacheable(new_args):
+                return None
+        elif not self.cacheable:
+            return None
+        if self.prefix is not None and self.executor.in_process:
+            return None  # the program may answer the request itself
+        exclude = [dest for dest in vars(new_args) if dest+'.nocache' in self.hooks]
+        # Several tools may share a cache, so say whose result this is.
+        scope = '%s:%s.%s' % (self.form_name,
+                              getattr(self.runapp, '__module__', ''),
+                              getattr(self.runapp, '__name__', ''))
+        return namespace_key(new_args, exclude, request.output_files, scope)
+
+    @print_where.tracing
+    def do_submit(self, request, new_args):
+        """Queue the program to run in the background, and answer with
+a 202 pointing at the job's URL."""
+        start_response = request.start_response
+        job = Job(request, partial(self.execute, request, new_args))
+        try:
+            self.jobs.submit(job)
+        except JobQueueFull:
+            start_response('503 Service Unavailable',
+                           TEXT_PLAIN + [('Retry-After', str(self.retry_after))])
+            return [b'Too many jobs are waiting to run; please try again later.\n']
+        request.detached = True  # the job will close the request
+        location = request.environ.get('SCRIPT_NAME', '') + JOBS_PATH + job.id
+        start_response('202 Accepted', APPLICATION_JSON + [('Location', location)])
+        return [ json.dumps(dict(job.as_dict(), url=location)).encode('utf-8') ]
+
+    @print_where.tracing
+    def do_choices(self, request, dest):
+        """\
+Search the choices of an argument: ?q=PREFIX&offset=N&limit=N returns
+(as JSON) how many choices start with PREFIX, ignoring case, and a page
+of them."""
+        index = self.choice_indexes.get(dest)
+        if index is None:
+            request.start_response(status404, TEXT_PLAIN)
+            return [b'No such choices']
+        query = parse_qs(request.environ.get('QUERY_STRING', ''))
+        try:
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['20'])[0])
+        except ValueError:
+            request.start_response('400 Bad Request', TEXT_PLAIN)
+            return [b'offset and limit must be numbers']
+        found = index.as_dict(query.get('q', [''])[0], offset, limit)
+        request.start_response(status200, APPLICATION_JSON +
+                               [('Cache-Control', self.cache_control)])
+        return [ json.dumps(found).encode('utf-8') ]
+
+    @print_where.tracing
+    def do_job(self, request, job_id):
+        """\
+Report on a background job.  Until it finishes, the answer is a 202
+with the job's state and any new output (pass ?offset=N to skip the
+first N characters); after that, it is the program's own response."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            request.start_response(status404, TEXT_PLAIN)
+            return [b'No such job']
+        if job.state == FINISHED:
+            download = job.download
+            if download is not None:
+                # an output file, which may be downloaded a piece at a time
+                headers = [(key, value) for key, value in job.headers if key != 'Content-Length']
+                file_wrapper = request.environ.get('wsgi.file_wrapper')
+                return self.send_range(request, headers, download.size, download.etag,
+                                       lambda start, stop: download.reader(start, stop, file_wrapper))
+            request.start_response(job.status, job.headers)
+            return job.body
+        query = parse_qs(request.environ.get('QUERY_STRING', ''))
+        try:
+            offset = int(query.get('offset', ['0'])[0])
+        except ValueError:
+            offset = 0
+        request.start_response('202 Accepted', APPLICATION_JSON +
+                               [('Retry-After', '1'), ('Cache-Control', 'no-store')])
+        return [ json.dumps(job.as_dict(offset)).encode('utf-8') ]
+
+    @print_where.tracing
+    def do_asset(self, request, name):
+        """Serve one of the assets used by our pages."""
+        asset = assets.lookup(name)
+        if asset is None and self.assets is None:
+            self.asset_urls({})  # e.g. our page came from a snapshot
+            asset = assets.lookup(name)
+        if asset is None:
+            request.start_response(status404, TEXT_PLAIN)
+            return [b'Not found']
+        return assets.send(request.environ, request.start_response, asset)
+
+    @print_where.tracing
+    def do_metrics(self, request):
+        """Report our metrics, and those of any wsgiwrapper sharing them."""
+        request.start_response(status200, [
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Cache-Control', 'no-store'),
+            ])
+        return [ self.metrics.render().encode('utf-8') ]
+
+    @print_where.tracing
+    def respond(self, request, err):
+        """Build the response for a program that ended by raising err."""
+        if isinstance(err, SystemExit):
+            request.exit_code = err.code or 0
+            return self.do_sys_exit(request, err)
+        elif isinstance(err, ExecutionTimeout):
+            return self.do_timeout(request, err)
+        else:
+            return self.do_exception(request, err)
+
+    @print_where.tracing
+    def do_stream(self, request, new_args):
+        """\
+Run the program in another thread, streaming its output (or its output
+file, if it has one) to the client as it is written.  If the program
+finishes before writing a full chunk, it gets an ordinary response."""
+        writer = QueueWriter(self.stream_chunk_size, self.stream_queue_size)
+        if request.output_files:
+            (dest, outfile), = request.output_files.items()
+            writer.name = outfile.name
+            request.output_files[dest] = writer
+            setattr(new_args, dest, writer)
+            headers = file_headers(writer.name)
+        else:
+            request.stdout = writer
+            headers = TEXT_PLAIN
+        outcome = []
+
+        def produce():
             try:
-                _stdin, sys.stdin = sys.stdin, open(os.devnull, 'r')
-                _stdout, sys.stdout = sys.stdout, newout
-                _stderr, sys.stderr = sys.stderr, newout
-                ### THEN THE MAGIC HAPPENS ###
-                sys.exit(self.runapp(new_args))
+                self.executor.run(self.runapp, request, new_args)
+            except (SystemExit, Exception) as err:
+                outcome.append(err)
             finally:
-                sys.stdin = _stdin
-                sys.stdout = _stdout
-                sys.stderr = _stderr
-        except SystemExit as err:
-            return self.do_sys_exit(err, newout)
-        except Exception as err:
-            return self.do_exception(err)
+                writer.finish()
+                request.close()
+
+        request.detached = True  # produce() will close the request
+        thread = threading.Thread(target=produce, name='wsgiwrapper-stream')
+        thread.daemon = True
+        thread.start()
+        first = writer.queue.get()
+        if first is DONE:
+            response = self.respond(request, outcome[0])
+            request.close()  # again, for any output file copied to send it
+            return response
+        request.start_response(status200, headers)
+        return StreamingResponse(writer, first)
 
     @print_where.tracing
-    def do_sys_exit(self, err, newout):
-        with Backstop(self.environ, self.start_response):
-            buffer = newout.getvalue()
+    def do_sys_exit(self, request, err):
+        with Backstop(request.environ, request.start_response):
+            buffer = request.stdout.getvalue()
             if err.code:
                 status = '400 Bad Request'
-                headers, form_iter = self.mk_form(
-                    self.environ,
-                    script=[js_library[func] for func in self.script],
-                    form=self.form,
-                    errors=buffer
-                    )
-            elif self.output_files:
-                status = status200
-                assert len(self.output_files) == 1
-                for outfile in self.output_files.values():
-                    filename = outfile.name
-                    content = outfile.getvalue()
-                    content_length = len(content)
-                    headers = [
-                        ('Content-Length', str(content_length)),
-                        ('Content-Disposition', 'attachment; filename="'+filename+'"'),
-                        ('Last-Modified', format_date_time(time.time())),
-                        ]
-                    content_type, encoding = guess_type(filename)
-                    if content_type:
-                         headers.append(('Content-Type', content_type))
-                    if encoding:
-                         headers.append(('Content-Encoding', encoding))
-                    form_iter = [ content ]
+                error = ERROR_HTML % escape(buffer)
+                headers, template = self.page_template(request.environ)
+                if 'error' in template.slot_names():
+                    form_iter = [ template.render(error=error) ]
+                else:
+                    headers, form_iter = self.mk_form(
+                        request.environ,
+                        toolbox=self.toolbox,
+                        form=self.form,
+                        error=[error],
+                        **self.asset_urls(request.environ))
+            elif request.output_files:
+                assert len(request.output_files) == 1
+                for outfile in request.output_files.values():
+                    return self.do_download(request, outfile)
             else:
                 status = status200
-                headers = TEXT_PLAIN
-                form_iter = [ buffer ]
-        self.start_response(status, headers)
+                content = buffer.encode('utf-8')
+                headers = TEXT_PLAIN + [('Content-Length', str(len(content)))]
+                form_iter = [ content ]
+        request.start_response(status, headers)
         return form_iter
 
     @print_where.tracing
-    def do_exception(self, err):
+    def do_download(self, request, outfile):
+        """Send an output file, or the range of it that the client asked for."""
+        spool = request.download = output_spool(outfile)
+        headers = file_headers(spool.name) + [('Accept-Ranges', 'bytes'), ('ETag', spool.etag)]
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        return self.send_range(request, headers, spool.size, spool.etag,
+                               lambda start, stop: spool.reader(start, stop, file_wrapper))
+
+    def send_range(self, request, headers, size, etag, read):
+        """\
+Send a body of size bytes: all of it, or (as 206 Partial Content) the
+range the client asked for.  read(start, stop) returns a response
+iterable of that part of the body."""
+        byte_range = requested_range(request.environ, size, etag)
+        if byte_range is UNSATISFIABLE:
+            request.start_response('416 Range Not Satisfiable',
+                                   TEXT_PLAIN + [('Content-Range', 'bytes */%d' % size)])
+            return []
+        status, start, stop = status200, 0, size
+        if byte_range is not None:
+            start, stop = byte_range
+            status = '206 Partial Content'
+            headers = headers + [('Content-Range', 'bytes %d-%d/%d' % (start, stop - 1, size))]
+        request.start_response(status, headers + [('Content-Length', str(stop - start))])
+        if request.environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return read(start, stop)
+
+    @print_where.tracing
+    def do_timeout(self, request, err):
+        """Overridable method to handle programs that ran too long."""
+        request.start_response('504 Gateway Timeout', TEXT_PLAIN)
+        return [ request.stdout.getvalue().encode('utf-8'),
+                 ('\nTimed out after %s seconds.\n' % err).encode('utf-8') ]
+
+    @print_where.tracing
+    def do_exception(self, request, err):
         """Overridable method to handle miscellaeous exceptions."""
         from traceback import format_exc
-        self.start_response(status200, TEXT_PLAIN)
-        print_where(format_exc())
+        request.start_response(status200, TEXT_PLAIN)
+        print_where(Lazy(format_exc))
         return []
@@ -13,13 +13,17 @@ __version__ = '0.4'
 
 # Python standard libraries
 from importlib import import_module
-from wsgiref.simple_server import make_server
-import argparse, sys
+import argparse, shutil, sys, tempfile
 
 # Python site libraries
 
 # Python personal libraries
-from . import wsgiwrapper
+from . import wsgiwrapper, ProcessExecutor, SubprocessExecutor
+from .admission import AdmissionControl
+from .dispatcher import Dispatcher, Mount, read_config
+from .metrics import Metrics
+from .servers import BACKLOG, KEEP_ALIVE, MODES, PreforkServer, make_server
+from .utils import print_where
 
 def mk_parser():
     """Build an argument parser."""
@@ -28,9 +32,15 @@ def mk_parser():
                         version='%(prog)s '+__version__)
     options = parser.add_argument_group('Wrapper configuration',
             'Specify how to create the web application.')
-    options.add_argument('-m', '--module', dest='mod', required=True,
-            help='''The command line program to run as a WSGI app.
-This is required.''')
+    options.add_argument('-m', '--module', dest='mods', action='append', default=[],
+            metavar='[PREFIX=]MOD',
+            help='''The command line program to run as a WSGI app.  Repeat this to serve
+several programs, each under its own URL prefix (by default, the last part of the
+module name); an index page lists them all.  This or --config is required.''')
+    options.add_argument('-c', '--config', action='append', default=[], metavar='FILE',
+            help='''Read programs to serve from an INI-style file, with a section for
+each URL prefix naming its "module" and, optionally, its "parser", "run", "title",
+"description", "skip" and "use_tables" settings.''')
     options.add_argument('-p', '--parser', default='mk_parser',
             help='''A function that returns an argparser object; the default is "%(default)s".
 Yhis function will be called once during WSGI initialization.''')
@@ -44,33 +54,169 @@ groups are never displayed; also 'help' and 'version' actions generate submit bu
 are displayed separately from their group(s), which may cause their group(s) to become empty.''')
     options.add_argument('-u', '--use-tables', action='store_true',
             help='Generate HTML using tables instead of "display=grid".')
+    options.add_argument('--snapshot-dir', default=None, metavar='DIR',
+            help='''Save each built form in DIR, and load it from there instead of building it
+again, e.g. in the next run or in the other workers of a pre-forking server.''')
     options.add_argument('-x', '--prefix', default=None,
             help='''If set, adds prefixed "environ" and "start_response" to the wrapped
 application\'s arguments. This can provide a hint to the application that it is running inside
 WSGI; this allows the application to, for example, format it's output as HTML.''')
+    execution = parser.add_argument_group('Execution configuration',
+            'Specify where the command line program runs.')
+    execution.add_argument('-w', '--workers', type=int, default=0,
+            help='''Run the program in a pool of this many worker processes, instead of
+in the web server itself; the default, %(default)s, means don't use a pool.''')
+    execution.add_argument('--max-tasks-per-child', type=int, default=None, metavar='N',
+            help='Replace each worker process after it has run N requests.')
+    execution.add_argument('--subprocess', nargs='?', const='main', default=None, metavar='MAIN',
+            help='''Run the program in a new process for each request, calling the module's
+MAIN function (by default, "main") with a command line rebuilt from the form, so a
+misbehaving program can't harm the server.  Give "" to run the module as __main__.''')
+    execution.add_argument('-t', '--timeout', type=float, default=None,
+            help='''Kill worker processes that run longer than this many seconds.
+Only used with --workers or --subprocess.''')
+    execution.add_argument('--cpu-limit', type=int, default=None, metavar='SECONDS',
+            help='With --subprocess, limit the CPU time each run may use.')
+    execution.add_argument('--memory-limit', type=int, default=None, metavar='MB',
+            help='With --subprocess, limit the memory each run may use.')
+    execution.add_argument('--file-size-limit', type=int, default=None, metavar='MB',
+            help='With --subprocess, limit the size of the files each run may write.')
+    execution.add_argument('-a', '--async-jobs', action='store_true',
+            help='''Run the program in the background; a submitted form is answered at once
+with the URL of a job, which can be polled for progress and the final result.''')
+    execution.add_argument('--max-running-jobs', type=int, default=4, metavar='N',
+            help='With --async-jobs, run at most N jobs at once; default is %(default)s.')
+    execution.add_argument('--max-executions', type=int, default=None, metavar='N',
+            help='''Run the program at most N times at once; other submitted forms wait
+their turn, taken round-robin by client.  The default is no limit.''')
+    execution.add_argument('--max-waiting', type=int, default=100, metavar='N',
+            help='''With --max-executions, let at most N forms wait; more are answered
+with 503 Service Unavailable.  The default is %(default)s.''')
+    execution.add_argument('--max-waiting-per-client', type=int, default=None, metavar='N',
+            help='With --max-executions, let at most N forms from any one client wait.')
+    execution.add_argument('--max-wait', type=float, default=None, metavar='SECONDS',
+            help='With --max-executions, answer forms that wait longer than this with a 503.')
     server = parser.add_argument_group('Server configuration',
             'Specify web server characteristics.')
     server.add_argument('-H', '--host', default='0.0.0.0',
             help='The IP address to bind to the socket; default is %(default)s.')
     server.add_argument('-P', '--port', type=int, default=8080,
             help='The port number to bind to the socket; default is %(default)s.')
+    server.add_argument('-S', '--server', choices=MODES, default='single',
+            help='''How to handle concurrent requests: one at a time ("single", the
+default), with a thread per connection ("threaded"), or with several pre-forked worker
+processes ("prefork").''')
+    server.add_argument('-f', '--forks', type=int, default=None, metavar='N',
+            help='''The number of worker processes in prefork mode; the default is the
+number of CPUs.  Send SIGHUP to the server to replace them gracefully.''')
+    server.add_argument('--threaded-forks', action='store_true',
+            help='In prefork mode, use a thread per connection within each worker.')
+    server.add_argument('-b', '--backlog', type=int, default=BACKLOG,
+            help='The listen backlog for the socket; default is %(default)s.')
+    server.add_argument('-k', '--keep-alive', type=float, default=None, metavar='SECONDS',
+            help='''How long to keep idle HTTP/1.1 connections open.  The default is
+%d seconds with threads, and zero (no keep-alive) without.''' % KEEP_ALIVE)
+    server.add_argument('--no-compress', dest='compress_responses', action='store_false',
+            help='''Don't gzip (or deflate) text responses, even for clients that accept
+them, e.g. if a proxy in front of the server compresses them.''')
+    monitoring = parser.add_argument_group('Monitoring')
+    monitoring.add_argument('--metrics', nargs='?', const='/metrics', default=None, metavar='PATH',
+            help='''Count requests and time each phase of them, and report the results at
+PATH (by default, /metrics) in the Prometheus text format.''')
+    monitoring.add_argument('--server-timing', action='store_true',
+            help='Send the time taken by each phase of a POST as a Server-Timing header.')
+    debugging = parser.add_argument_group('Debugging')
+    debugging.add_argument('--trace', action='append', default=[], metavar='NAME',
+            help='''Trace a module, class or function, e.g. 'wsgiwrapper.multipart' or
+'wsgiwrapper.wsgiwrapper.do_form'; give 'wsgiwrapper' to trace everything.  Each POST's
+messages are written together when it is done.''')
     return parser
 
+def parse_mount(spec):
+    """Split a '[PREFIX=]MOD' spec into a prefix and a module name."""
+    prefix, _, mod = spec.rpartition('=')
+    return prefix or '/' + mod.rpartition('.')[2], mod
+
 def real_process(args):
     """Process the arguments."""
-    mod = import_module(args.mod)
-    the_parser = getattr(mod, args.parser)()
-    the_process = getattr(mod, args.process)
-    the_app = wsgiwrapper(
-        the_parser, the_process,
-        form_name=args.mod,
+    if args.trace:
+        print_where.enable(*args.trace)
+    single = len(args.mods) == 1 and not args.config and '=' not in args.mods[0]
+    executor = None
+    if args.subprocess is not None:
+        megabytes = lambda mb: mb * 1024 * 1024 if mb is not None else None
+        executor = SubprocessExecutor(
+            module=args.mods[0] if single else None,
+            main=args.subprocess or None,
+            timeout=args.timeout,
+            cpu_time=args.cpu_limit,
+            memory=megabytes(args.memory_limit),
+            file_size=megabytes(args.file_size_limit),
+            )
+    elif args.workers:
+        executor = ProcessExecutor(
+            # with several programs, each job names its own
+            module=args.mods[0] if single else None,
+            process=args.process if single else None,
+            processes=args.workers,
+            maxtasksperchild=args.max_tasks_per_child,
+            timeout=args.timeout,
+            )
+    options = dict(
         prefix=args.prefix,
         skip_groups=args.skip_groups,
         use_tables=args.use_tables,
+        executor=executor,
+        async_jobs=args.async_jobs,
+        max_running_jobs=args.max_running_jobs,
+        server_timing=args.server_timing,
+        snapshot_dir=args.snapshot_dir,
+        compress_responses=args.compress_responses,
         )
-    srv = make_server(args.host, args.port, the_app)
+    if args.max_executions:
+        # shared by every program, so together they run at most N at once
+        options.update(admission=AdmissionControl(
+            args.max_executions, args.max_waiting, args.max_waiting_per_client, args.max_wait))
+    metrics_dir = None
+    if args.metrics:
+        if args.server == 'prefork':
+            # each worker counts its own requests; a scrape adds them up
+            metrics_dir = tempfile.mkdtemp(prefix='wsgiwrapper-metrics-')
+        options.update(metrics=Metrics(metrics_dir), metrics_path=args.metrics)
+    if single:
+        mod = import_module(args.mods[0])
+        the_app = wsgiwrapper(
+            getattr(mod, args.parser)(),
+            getattr(mod, args.process),
+            form_name=args.mods[0],
+            **options)
+        if args.server == 'prefork':
+            the_app.freeze()  # so the workers share the rendered page
+    else:
+        the_app = Dispatcher(**options)
+        for spec in args.mods:
+            prefix, mod = parse_mount(spec)
+            the_app.mount(prefix, mod, parser=args.parser, process=args.process)
+        for filename in args.config:
+            for mount in read_config(filename):
+                the_app.add(mount)
+        if args.server == 'prefork':
+            the_app.freeze()  # so the workers share the modules and pages
+    mode = args.server
+    if mode == 'prefork':
+        mode = 'threaded' if args.threaded_forks else 'single'
+    srv = make_server(args.host, args.port, the_app, mode,
+                      backlog=args.backlog, keep_alive=args.keep_alive)
+    if args.server == 'prefork':
+        srv = PreforkServer(srv, args.forks)
     print('listening on %s:%d...' % srv.server_address)
-    srv.serve_forever()
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
 
 def process(args):
     print("""This is the result of using a fake 'process' function.
@@ -85,6 +231,8 @@ def main(argv=None):
         argv = sys.argv[1:]
     parser = mk_parser()
     args = parser.parse_args(argv)
+    if not args.mods and not args.config:
+        parser.error('at least one of --module or --config is required')
     return real_process(args)
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+
+"""\
+Admission control: limit how many runs of the wrapped program happen at
+once, so a burst of submitted forms queues up instead of overloading the
+host and slowing every run down together.
+
+Requests wait for a turn in a bounded queue, served round-robin by
+client, so one client submitting many forms can't keep everyone else
+waiting; a request that would overfill the queue (or has waited too
+long) is turned away at once, to be answered with a 503.  Only runs of
+the program are admitted this way: GETs for the form, static assets,
+jobs and metrics never wait behind them.  The limits are per process,
+so with a pre-forking server each worker has its own."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from collections import deque
+import threading
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+__all__ = ['AdmissionControl', 'Overloaded']
+
+class Overloaded(Exception):
+    """A request can't be admitted; reason is 'full' or 'timeout'."""
+
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+class Waiter(object):
+    """One request waiting for its turn."""
+
+    __slots__ = ('event', 'admitted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.admitted = False
+
+class AdmissionControl(object):
+    """\
+Lets at most max_running requests run at once.  Up to max_waiting more
+may wait their turn, at most max_per_client of them from any one client
+(if that is given), and for at most max_wait seconds (if that is
+given).  Share one between wsgiwrappers (e.g. as a Dispatcher option)
+to limit them together."""
+
+    def __init__(self, max_running=4, max_waiting=100, max_per_client=None, max_wait=None):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.max_per_client = max_per_client
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.queues = {}  # client -> deque of Waiters
+        self.turns = deque()  # clients with waiters, in the order they'll be served
+
+    def full(self, client=None):
+        """Return True if a request from client would be turned away right now."""
+        if self.running < self.max_running and not self.waiting:
+            return False
+        if self.waiting >= self.max_waiting:
+            return True
+        return (self.max_per_client is not None and
+                len(self.queues.get(client, ())) >= self.max_per_client)
+
+    def acquire(self, client=None):
+        """\
+Wait until a request from client may run, raising Overloaded if it
+can't.  Call release() once it has finished."""
+        with self.lock:
+            if self.running < self.max_running and not self.waiting:
+                self.running += 1
+                return
+            if self.full(client):
+                raise Overloaded('full')
+            waiter = Waiter()
+            queue = self.queues.get(client)
+            if queue is None:
+                queue = self.queues[client] = deque()
+                self.turns.append(client)
+            queue.append(waiter)
+            self.waiting += 1
+        print_where('waiting to run:', client)
+        waiter.event.wait(self.max_wait)
+        with self.lock:
+            if waiter.admitted:  # perhaps just as we timed out
+                return
+            queue = self.queues[client]
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[client]
+                self.turns.remove(client)
+        raise Overloaded('timeout')
+
+    def release(self):
+        """Give up a turn to run, handing it to the next client in line."""
+        with self.lock:
+            if not self.turns:
+                self.running -= 1
+                return
+            client = self.turns.popleft()
+            queue = self.queues[client]
+            waiter = queue.popleft()
+            if queue:
+                self.turns.append(client)  # back of the line for its next request
+            else:
+                del self.queues[client]
+            self.waiting -= 1
+            waiter.admitted = True
+            waiter.event.set()
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+
+"""\
+Turns a command-line program into an ASGI application.
+
+The form and the Namespace are built by a wsgiwrapper, exactly as they
+are for WSGI.  The request body is read without blocking the event
+loop, and the wrapped program runs (and its output is read) in a thread
+pool, so one event loop can serve many slow clients while the real work
+happens elsewhere.  Pass executor=ProcessExecutor(...) to run the
+program itself in worker processes.
+
+This module needs Python 3.5 or later."""
+
+# Python standard libraries
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, io, sys
+
+# Python site libraries
+
+# Python personal libraries
+from . import wsgiwrapper
+from .metrics import timer
+from .multipart import FormParser, MalformedRequest, RequestTooLarge, content_length
+from .utils import print_where
+
+__all__ = ['asgiwrapper']
+
+_END = object()  # returned by next() when a response iterable is exhausted
+
+def make_environ(scope):
+    """Build a WSGI environ from an ASGI HTTP connection scope."""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.input': io.BytesIO(),  # the body is read through receive()
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'asgi.scope': scope,
+        }
+    server = scope.get('server')
+    if server:
+        environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1])
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            # cookies are separated by semicolons; other headers, by commas
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    return environ
+
+class ResponseStart(object):
+    """A start_response callable that remembers what it was told."""
+
+    def __init__(self):
+        self.status = None
+        self.headers = []
+
+    def __call__(self, status, headers, exc_info=None):
+        self.status = int(status.split(None, 1)[0])
+        self.headers = [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                        for key, value in headers]
+
+class asgiwrapper(object):
+    """\
+Creates an ASGI application from a CLI program that uses ArgumentParser.
+The arguments are those of wsgiwrapper, plus 'threads', the size of the
+thread pool used to run the program; the wsgiwrapper itself is
+available as the 'app' attribute.
+
+Everything but a POST is answered, and responses are read, in a pool of
+their own, so the form and its assets are served, and a streamed
+response can be sent (and its program finish, giving up its turn to
+run), even while every thread that runs programs is waiting for a turn."""
+
+    def __init__(self, parser, runapp, threads=None, **kwargs):
+        self.app = wsgiwrapper(parser, runapp, **kwargs)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='wsgiwrapper')
+        self.responses = ThreadPoolExecutor(threads, thread_name_prefix='wsgiwrapper-response')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('unsupported scope type %r' % scope['type'])
+        environ = make_environ(scope)
+        start = ResponseStart()
+        if scope['method'] != 'POST':
+            # Everything but a POST is quickly answered, but not on the event loop.
+            loop = asyncio.get_event_loop()
+            body = await loop.run_in_executor(self.responses, self.app, environ, start)
+            return await self.send_response(send, start, body)
+        app = self.app
+        request = app.new_request(environ, start)
+        try:
+            if not app.measuring:
+                body = await self.post(request, receive)
+            else:
+                started = app.begin(request)
+                body = None
+                try:
+                    body = await self.post(request, receive)
+                finally:
+                    app.end(request, started, body)
+            await self.send_response(send, start, request.finish(body))
+        finally:
+            if not request.detached:
+                request.close()
+
+    async def post(self, request, receive):
+        """Process a POST as wsgiwrapper.do_post() does, but reading the
+body without blocking, and running the program in the pool."""
+        app = self.app
+        body = app.screen_post(request)
+        if body is not None:
+            return body
+        started = timer()
+        try:
+            request.form = await self.read_form(request.environ, receive)
+        except (RequestTooLarge, MalformedRequest) as err:
+            return app.do_bad_request(request, err)
+        request.time('parse', started)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool, app.do_form, request)
+
+    async def read_form(self, environ, receive):
+        """Read and parse the request body as it arrives."""
+        app = self.app
+        parser = FormParser(
+            environ.get('CONTENT_TYPE'),
+            content_length(environ.get('CONTENT_LENGTH')),
+            app.spool_size, app.max_body_size, app.max_part_size)
+        try:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    raise MalformedRequest('client disconnected')
+                parser.feed(message.get('body', b''))
+                more_body = message.get('more_body', False)
+            return parser.close()
+        except Exception:
+            parser.form.close()
+            raise
+
+    async def send_response(self, send, start, body):
+        """Send a WSGI response iterable.  Lists are sent directly; other
+iterables (which may block, e.g. while streaming) are read in the pool."""
+        await send({
+            'type': 'http.response.start',
+            'status': start.status,
+            'headers': start.headers,
+            })
+        try:
+            if isinstance(body, (list, tuple)):
+                for chunk in body:
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            else:
+                loop = asyncio.get_event_loop()
+                chunks = iter(body)
+                while True:
+                    chunk = await loop.run_in_executor(self.responses, next, chunks, _END)
+                    if chunk is _END:
+                        break
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                print_where('shutting down')
+                self.app.executor.close()
+                self.pool.shutdown(wait=False)
+                self.responses.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+if __name__ == '__main__':
+    pass
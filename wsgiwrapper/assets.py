@@ -0,0 +1,152 @@
+#! /usr/bin/env python
+
+"""\
+Static assets: the stylesheet and scripts used by our pages, and the
+favicon.
+
+Instead of being inlined into every page, the stylesheet and the
+scripts a form uses are each served from a URL containing a digest of
+their content, so a browser can cache them forever and never has to ask
+again; a changed asset gets a new URL.  Assets are registered once per
+process and shared by every wsgiwrapper in it, and each keeps a
+gzipped copy (if that is smaller) for clients that accept one.  The
+favicon is sent with the server's wsgi.file_wrapper, if it has one."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from hashlib import sha1
+from wsgiref.handlers import format_date_time
+import gzip, io, os, threading
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import accepts_encoding, etag_matches, print_where
+
+__all__ = ['ASSETS_PATH', 'Asset', 'bundle', 'favicon', 'lookup', 'send', 'stylesheet']
+
+ASSETS_PATH = '/static/'  # content-hashed assets live under here
+STYLESHEET_PATH = os.path.join(os.path.dirname(__file__), 'wsgiwrapper.css')
+FAVICON_PATH = os.path.join(os.path.dirname(__file__), 'favicon.ico')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+MIN_SAVING = 0.1  # keep a gzipped copy only if it saves at least this fraction
+
+_assets = {}  # name -> Asset, shared by every wsgiwrapper in the process
+_assets_lock = threading.Lock()
+_favicon = []  # the favicon's Asset, once it has been read
+
+def gzip_bytes(body):
+    """Return body gzipped, reproducibly (no timestamp or file name)."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=buffer, mtime=0) as f:
+        f.write(body)
+    return buffer.getvalue()
+
+class Asset(object):
+    """\
+An asset's body, a gzipped copy of it (or None, if that wouldn't save
+much), and the headers needed to serve each.  If path is given, the
+body was read from that file, and can be sent from it."""
+
+    __slots__ = ('body', 'gzipped', 'etag', 'gzip_etag', 'headers', 'gzip_headers', 'validators',
+                 'last_modified', 'path')
+
+    def __init__(self, content_type, body, cache_control=IMMUTABLE, path=None, last_modified=None):
+        self.body = body
+        self.path = path
+        self.last_modified = last_modified
+        gzipped = gzip_bytes(body)
+        self.gzipped = gzipped if len(gzipped) <= len(body) * (1 - MIN_SAVING) else None
+        digest = sha1(body).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzip_etag = '"%s-gzip"' % digest  # a different representation needs its own
+        common = [('Content-Type', content_type), ('Cache-Control', cache_control)]
+        if last_modified is not None:
+            common.append(('Last-Modified', format_date_time(last_modified)))
+        if self.gzipped is not None:
+            common.append(('Vary', 'Accept-Encoding'))
+        self.validators = [(key, value) for key, value in common
+                           if key in ('Cache-Control', 'Vary')]
+        self.headers = common + [('Content-Length', str(len(body))), ('ETag', self.etag)]
+        self.gzip_headers = None
+        if self.gzipped is not None:
+            self.gzip_headers = common + [
+                ('Content-Encoding', 'gzip'),
+                ('Content-Length', str(len(self.gzipped))),
+                ('ETag', self.gzip_etag),
+                ]
+
+    def not_modified(self, environ, etag):
+        """Return True if the client's copy, as described by environ, is current."""
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and self.last_modified is not None:
+            from email.utils import mktime_tz, parsedate_tz
+            parsed = parsedate_tz(if_modified_since)
+            return parsed is not None and mktime_tz(parsed) >= int(self.last_modified)
+        return False
+
+def register(stem, extension, content_type, body):
+    """Register body as an asset, and return the name it is served under."""
+    name = '%s.%s%s' % (stem, sha1(body).hexdigest()[:16], extension)
+    with _assets_lock:
+        if name not in _assets:
+            _assets[name] = Asset(content_type, body)
+    return name
+
+def lookup(name):
+    """Return the Asset registered under name, or None."""
+    return _assets.get(name)
+
+def stylesheet(path=STYLESHEET_PATH):
+    """Return the name of the stylesheet served for our pages."""
+    with open(path, 'rb') as f:
+        css = f.read()
+    return register('wsgiwrapper', '.css', 'text/css; charset=utf-8', css)
+
+def bundle(sources):
+    """Return the name of a script made of the JavaScript sources given."""
+    body = '\n'.join(sources).encode('utf-8')
+    return register('scripts', '.js', 'application/javascript; charset=utf-8', body)
+
+def favicon(path=FAVICON_PATH):
+    """Return the favicon's Asset, or None if there isn't one."""
+    with _assets_lock:
+        if not _favicon:
+            asset = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    asset = Asset('image/x-icon', f.read(), 'public, max-age=86400',
+                                  path, os.path.getmtime(path))
+            _favicon.append(asset)
+    return _favicon[0]
+
+@print_where.tracing
+def send(environ, start_response, asset):
+    """Serve an Asset, answering conditional requests with 304 Not Modified."""
+    headers, body, etag = asset.headers, asset.body, asset.etag
+    if asset.gzipped is not None and accepts_encoding(environ.get('HTTP_ACCEPT_ENCODING'), 'gzip'):
+        headers, body, etag = asset.gzip_headers, asset.gzipped, asset.gzip_etag
+    if asset.not_modified(environ, etag):
+        start_response('304 Not Modified', asset.validators + [('ETag', etag)])
+        return []
+    start_response('200 OK', list(headers))
+    if environ['REQUEST_METHOD'] == 'HEAD':
+        return []
+    if body is asset.gzipped:
+        return [body]
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if asset.path is not None and file_wrapper is not None:
+        try:
+            return file_wrapper(open(asset.path, 'rb'))  # sendfile(), where the server can
+        except (IOError, OSError):
+            pass
+    return [body]
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+
+"""\
+Large sets of choices, served a page at a time instead of as a <select>.
+
+A ChoiceIndex keeps the choices of one argument sorted (ignoring case),
+so finding those that start with a prefix is a binary search, and in a
+dict keyed by the string sent by the browser, so checking a submitted
+value is a single lookup."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from bisect import bisect_left
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+# Python site libraries
+
+# Python personal libraries
+
+MAX_LIMIT = 100  # most choices returned by one search
+
+def prefix_end(prefix):
+    """Return the smallest string that sorts after everything starting with prefix."""
+    return prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+class ChoiceIndex(object):
+    """\
+The choices of an argparse action.  If choices is a dict, its values
+are used as labels; otherwise each choice is its own label."""
+
+    def __init__(self, choices):
+        labels = choices if isinstance(choices, dict) else {}
+        self.choices = {}  # the string the browser sends -> the choice
+        entries = []
+        for choice in choices:
+            value = str(choice)
+            self.choices[value] = choice
+            entries.append((value.lower(), value, str(labels.get(choice, value))))
+        entries.sort()
+        self.keys = [key for key, value, label in entries]
+        self.entries = [(value, label) for key, value, label in entries]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, value):
+        return value in self.choices
+
+    def redeem(self, value):
+        """Return the choice that was sent as value; raise KeyError if there isn't one."""
+        return self.choices[value]
+
+    def search(self, prefix='', offset=0, limit=20):
+        """\
+Return the number of choices that start with prefix (ignoring case),
+and a list of up to limit of them, skipping the first offset."""
+        prefix = prefix.lower()
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix_end(prefix)) if prefix else len(self.keys)
+        offset = max(offset, 0)
+        limit = min(max(limit, 0), MAX_LIMIT)
+        found = self.entries[start + offset:min(start + offset + limit, end)]
+        return end - start, found
+
+    def as_dict(self, prefix='', offset=0, limit=20):
+        """Describe the result of a search, e.g. for a JSON response."""
+        total, found = self.search(prefix, offset, limit)
+        return {
+            'q': prefix,
+            'total': total,
+            'offset': offset,
+            'choices': [{'value': value, 'label': label} for value, label in found],
+            }
+
+if __name__ == '__main__':
+    pass
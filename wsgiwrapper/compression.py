@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+
+"""\
+Compress responses with gzip or deflate, for clients that accept them.
+
+A response is compressed if it is a 200 OK whose Content-Type is one of
+ours, that isn't already encoded (e.g. an output file named '.gz'),
+that isn't known to be smaller than a minimum size, and that isn't a
+download: a download may be resumed with Range requests, whose byte
+offsets are into the uncompressed file, and is best sent from disk by
+the server's wsgi.file_wrapper.  Its body is
+compressed as it is sent, a chunk at a time, each chunk flushed so that
+a streamed response still reaches the client as it is written."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+import zlib
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import accepted_encodings
+
+__all__ = ['COMPRESS_TYPES', 'Compression', 'Compressor', 'choose_coding', 'compress']
+
+# Compressible media types; those ending in '/' match every subtype.
+COMPRESS_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+    )
+MIN_SIZE = 1024  # bytes; smaller responses aren't worth compressing
+LEVEL = 6
+
+CODINGS = ('gzip', 'deflate')  # in order of preference
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,  # a gzip header and trailer
+    'deflate': zlib.MAX_WBITS,  # a zlib header and trailer, as HTTP's "deflate" means
+    }
+
+def choose_coding(accept_encoding):
+    """Return the content-coding to use for a client sending an
+Accept-Encoding header value, or None if it doesn't accept one of ours."""
+    accepted = accepted_encodings(accept_encoding)
+    best, best_quality = None, 0.0
+    for coding in CODINGS:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+def compress(data, coding, level=LEVEL):
+    """Return data compressed with a content-coding, all at once."""
+    obj = zlib.compressobj(level, zlib.DEFLATED, WBITS[coding])
+    return obj.compress(data) + obj.flush()
+
+class Compressor(object):
+    """Compresses the body of one response."""
+
+    def __init__(self, coding, level=LEVEL):
+        self.coding = coding
+        self.obj = zlib.compressobj(level, zlib.DEFLATED, WBITS[coding])
+
+    def compress(self, data):
+        """\
+Return the compressed form of the next chunk of the body, flushed so
+the client can decompress everything it has been sent."""
+        return self.obj.compress(data) + self.obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.obj.flush()
+
+    def writer(self, write):
+        """Wrap the write() callable returned by a server's start_response."""
+        return lambda data: write(self.compress(data))
+
+    def wrap(self, body):
+        """Return a response iterable yielding body, compressed."""
+        if isinstance(body, list):
+            # we have all of it, so compress it in one go
+            return [self.obj.compress(b''.join(body)) + self.obj.flush()]
+        return CompressedResponse(body, self)
+
+class CompressedResponse(object):
+    """A WSGI response iterable that compresses another one as it is sent."""
+
+    def __init__(self, body, compressor):
+        self.body = body
+        self.compressor = compressor
+
+    def __iter__(self):
+        for chunk in self.body:
+            if chunk:
+                yield self.compressor.compress(chunk)
+        yield self.compressor.finish()
+
+    def close(self):
+        close = getattr(self.body, 'close', None)
+        if close is not None:
+            close()
+
+class Compression(object):
+    """Which responses to compress, and how hard."""
+
+    def __init__(self, types=COMPRESS_TYPES, min_size=MIN_SIZE, level=LEVEL):
+        self.types = tuple(types)
+        self.min_size = min_size
+        self.level = level
+
+    def allows(self, headers):
+        """Return True if a response with these headers may be compressed."""
+        content_type = None
+        for key, value in headers:
+            key = key.lower()
+            if key in ('content-encoding', 'content-range'):
+                return False  # already encoded, or only part of the body
+            if key in ('content-disposition', 'accept-ranges'):
+                return False  # a download, which may be resumed a range at a time
+            if key == 'content-length':
+                try:
+                    if int(value) < self.min_size:
+                        return False
+                except ValueError:
+                    return False
+            elif key == 'content-type':
+                content_type = value
+        if content_type is None:
+            return False
+        media = content_type.split(';', 1)[0].strip().lower()
+        return any(media.startswith(t) if t.endswith('/') else media == t
+                   for t in self.types)
+
+    def apply(self, status, headers, coding):
+        """\
+Return the headers to send for a response, and the Compressor to pass
+its body through (or None), given the client's choice of coding."""
+        if not status.startswith('200') or not self.allows(headers):
+            return headers, None
+        vary = [value for key, value in headers if key.lower() == 'vary']
+        if not any('accept-encoding' in value.lower() or '*' in value for value in vary):
+            headers = headers + [('Vary', 'Accept-Encoding')]
+        if coding is None:
+            return headers, None
+        new_headers = []
+        for key, value in headers:
+            lower = key.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                value = 'W/' + value  # not the same bytes as the uncompressed body
+            new_headers.append((key, value))
+        new_headers.append(('Content-Encoding', coding))
+        return new_headers, Compressor(coding, self.level)
+
+if __name__ == '__main__':
+    pass
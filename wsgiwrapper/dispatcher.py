@@ -0,0 +1,261 @@
+#! /usr/bin/env python
+
+"""\
+Serve many wrapped programs from one WSGI application.
+
+Each program is mounted under a path prefix, e.g. '/grep', and its
+module isn't imported until the first request for it arrives.  The
+mounted wsgiwrappers share the parsed page template, the static assets, and
+whatever options are given to the Dispatcher itself, so a single
+executor (e.g. one ProcessExecutor pool), ResultCache or Metrics can
+serve them all.  A request for '/' gets an index page linking to every
+program, and one for the metrics path reports on all of them."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from importlib import import_module
+try:
+    from configparser import RawConfigParser
+except ImportError:
+    from ConfigParser import RawConfigParser
+import threading
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+# Python site libraries
+
+# Python personal libraries
+from . import assets, wsgiwrapper, CachedPage, load_template
+from . import TEXT_HTML, TEXT_PLAIN, status200, status304, status404
+from .assets import ASSETS_PATH
+from .htmltags import A, Li, P, Ul
+from .utils import etag_matches, print_where
+
+__all__ = ['Dispatcher', 'Mount', 'read_config']
+
+def normalize_prefix(prefix):
+    """Return a prefix as '/name' (or '' for the root), without a trailing slash."""
+    prefix = prefix.strip('/')
+    return '/' + prefix if prefix else ''
+
+class Mount(object):
+    """\
+One program mounted under a path prefix.  module is imported, and the
+wsgiwrapper built, on the first call; parser and process name the
+functions in it, as for 'python -m wsgiwrapper'.  Other keyword
+arguments are passed to the wsgiwrapper."""
+
+    def __init__(self, prefix, module, parser='mk_parser', process='process',
+                 title=None, description=None, **kwargs):
+        self.prefix = normalize_prefix(prefix)
+        self.module = module
+        self.parser = parser
+        self.process = process
+        self.title = title or module
+        self.description = description
+        self.kwargs = kwargs
+        self.kwargs.setdefault('form_name', module)
+        self.app = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Mount %s at %r>' % (self.module, self.prefix or '/')
+
+    @print_where.tracing
+    def load(self):
+        """Import the module and build the wsgiwrapper, if that hasn't
+already been done, and return the wsgiwrapper."""
+        with self.lock:
+            if self.app is None:
+                mod = import_module(self.module)
+                self.app = wsgiwrapper(
+                    getattr(mod, self.parser)(),
+                    getattr(mod, self.process),
+                    **self.kwargs)
+        return self.app
+
+    def matches(self, path_info):
+        prefix = self.prefix
+        return path_info == prefix or path_info.startswith(prefix + '/')
+
+    def __call__(self, environ, start_response):
+        app = self.app or self.load()
+        return app(environ, start_response)
+
+class Dispatcher(object):
+    """\
+A WSGI application that routes each request to the Mount whose prefix
+matches the start of PATH_INFO, moving the prefix to SCRIPT_NAME as it
+does.  Keyword arguments are wsgiwrapper options shared by every Mount;
+those given to mount() override them."""
+
+    def __init__(self, mounts=(), title='Tools', **kwargs):
+        self.title = title
+        self.shared = kwargs
+        self.mounts = []
+        self.pages = {}  # rendered index pages, keyed by SCRIPT_NAME
+        for mount in mounts:
+            self.add(mount)
+
+    def mount(self, prefix, module, **kwargs):
+        """Mount a program's module under a prefix, and return the Mount."""
+        return self.add(Mount(prefix, module, **kwargs))
+
+    def add(self, mount):
+        """Add a Mount, giving it any shared options it doesn't override."""
+        if any(m.prefix == mount.prefix for m in self.mounts):
+            raise ValueError('%r is already mounted' % (mount.prefix or '/'))
+        for name, value in self.shared.items():
+            mount.kwargs.setdefault(name, value)
+        self.mounts.append(mount)
+        # Try longer prefixes first, so '/a/b' wins over '/a'.
+        self.mounts.sort(key=lambda m: len(m.prefix), reverse=True)
+        self.pages.clear()
+        return mount
+
+    def preload(self):
+        """\
+Import every module now, e.g. before a pre-forking server forks, so the
+workers share one copy of everything instead of importing their own."""
+        for mount in self.mounts:
+            mount.load()
+
+    def freeze(self, script_name=''):
+        """\
+Import every module and freeze every wsgiwrapper, rendering the pages
+they will serve under script_name, before a pre-forking server forks."""
+        self.preload()
+        for mount in self.mounts:
+            mount.app.freeze({'SCRIPT_NAME': script_name + mount.prefix, 'PATH_INFO': '/'})
+        self.index_page({'SCRIPT_NAME': script_name})
+        return self
+
+    def find(self, path_info):
+        for mount in self.mounts:
+            if mount.matches(path_info):
+                return mount
+        return None
+
+    @print_where.tracing
+    def __call__(self, environ, start_response):
+        path_info = environ.get('PATH_INFO', '') or '/'
+        req_method = environ['REQUEST_METHOD']
+        if path_info == '/favicon.ico' and assets.favicon() is not None:
+            return assets.send(environ, start_response, assets.favicon())
+        mount = self.find(path_info)
+        if mount is None:
+            if path_info == '/':
+                if req_method not in {'GET', 'HEAD'}:
+                    start_response('405 Method Not Allowed',
+                                   TEXT_PLAIN + [('Allow', 'GET, HEAD')])
+                    return []
+                return self.send_page(environ, start_response, self.index_page(environ))
+            if path_info.startswith(ASSETS_PATH) and req_method in {'GET', 'HEAD'}:
+                name = path_info[len(ASSETS_PATH):]
+                asset = assets.lookup(name)
+                if asset is None:
+                    assets.stylesheet()  # e.g. the index page was rendered by another worker
+                    asset = assets.lookup(name)
+                if asset is not None:
+                    return assets.send(environ, start_response, asset)
+            metrics = self.shared.get('metrics')
+            if metrics is not None and path_info == self.shared.get('metrics_path', '/metrics'):
+                start_response(status200, [
+                    ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+                    ('Cache-Control', 'no-store'),
+                    ])
+                return [] if req_method == 'HEAD' else [metrics.render().encode('utf-8')]
+            start_response(status404, list(TEXT_PLAIN))
+            return [b'Not found']
+        script_name = environ.get('SCRIPT_NAME', '') + mount.prefix
+        path_info = path_info[len(mount.prefix):]
+        if not path_info:
+            # Our forms are served at '/', and post back to where they came from.
+            if req_method in {'GET', 'HEAD'}:
+                location = script_name + '/'
+                if environ.get('QUERY_STRING'):
+                    location += '?' + environ['QUERY_STRING']
+                start_response('301 Moved Permanently',
+                               TEXT_PLAIN + [('Location', location)])
+                return []
+            path_info = '/'
+        environ = dict(environ, SCRIPT_NAME=script_name, PATH_INFO=path_info)
+        return mount(environ, start_response)
+
+    def send_page(self, environ, start_response, page):
+        if etag_matches(environ.get('HTTP_IF_NONE_MATCH'), page.etag):
+            start_response(status304, list(page.validators))
+            return []
+        start_response(status200, list(page.headers))
+        return [] if environ['REQUEST_METHOD'] == 'HEAD' else [page.body]
+
+    @print_where.tracing
+    def index_page(self, environ):
+        """Return the CachedPage listing our Mounts, rendering it if needed."""
+        script_name = environ.get('SCRIPT_NAME', '')
+        page = self.pages.get(script_name)
+        if page is None:
+            from pystache.renderer import Renderer  # TODO: decouple pystache
+            listing = Ul()
+            for mount in sorted(self.mounts, key=lambda m: m.prefix):
+                item = Li(A(escape(mount.title), href=script_name + mount.prefix + '/'))
+                if mount.description:
+                    item += P(escape(mount.description))
+                listing += item
+            body = Renderer().render(  # TODO: decouple pystache
+                load_template(),
+                SCRIPT_NAME=script_name, PATH_INFO='/',
+                stylesheet=[script_name + ASSETS_PATH + assets.stylesheet()],
+                prologue=[escape(self.title)],
+                form=listing,
+                )
+            page = self.pages[script_name] = CachedPage(
+                TEXT_HTML, [body], self.shared.get('cache_control', 'no-cache'))
+        return page
+
+def read_config(filename):
+    """\
+Read mounts from an INI-style file, one section per prefix:
+
+    [/grep]
+    module = mygrep
+    parser = mk_parser
+    run = process
+    title = Search files
+    skip = Debugging, Advanced
+    use_tables = no
+
+Only 'module' is required.  Returns a list of Mounts, to be added to a
+Dispatcher."""
+    config = RawConfigParser()
+    if not config.read(filename):
+        raise IOError('cannot read %r' % filename)
+    mounts = []
+    for prefix in config.sections():
+        def get(option, default=None):
+            if config.has_option(prefix, option):
+                return config.get(prefix, option)
+            return default
+        if not get('module'):
+            raise ValueError('no module given for %r in %s' % (prefix, filename))
+        options = dict(
+            parser=get('parser', 'mk_parser'),
+            process=get('run', 'process'),
+            title=get('title'),
+            description=get('description'),
+            )
+        if get('skip'):
+            options['skip_groups'] = [group.strip() for group in get('skip').split(',')]
+        if get('use_tables'):
+            options['use_tables'] = config.getboolean(prefix, 'use_tables')
+        if get('prefix'):
+            options['prefix'] = get('prefix')
+        mounts.append(Mount(prefix, get('module'), **options))
+    return mounts
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,477 @@
+#! /usr/bin/env python
+
+"""Ways to run the wrapped program once its arguments have been parsed."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from importlib import import_module
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from uuid import uuid4
+import argparse, json, os, signal, sys, threading
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import Lazy, print_where, redirect_streams
+
+class ExecutionTimeout(Exception):
+    """The wrapped program ran for longer than it was allowed to."""
+
+class RemoteError(Exception):
+    """The wrapped program raised an exception in another process.
+The only argument is the formatted traceback."""
+
+class InlineExecutor(object):
+    """\
+Run the wrapped program in the current thread, which is what
+wsgiwrapper has always done.  Output is captured by redirecting
+stdout and stderr for the current thread only, so a threaded server
+can run several requests at once."""
+
+    in_process = True  # the program can be handed environ, etc.
+
+    def run(self, runapp, request, namespace):
+        """Run the program, raising SystemExit with its exit status."""
+        with redirect_streams(StringIO(), request.stdout, request.stdout):
+            ### THEN THE MAGIC HAPPENS ###
+            sys.exit(runapp(namespace))
+
+    def close(self):
+        pass
+
+class _JobTimeout(BaseException):
+    """Raised inside a worker process when its job runs too long.
+It isn't an Exception, so the wrapped program won't catch it by accident."""
+
+# These live in the worker processes.
+_processes = {}
+_started = []  # the queue on which a worker says it has started a job
+
+def _init_worker(modules, started=None):
+    """Import the wrapped modules once, when a worker process starts."""
+    if started is not None:
+        _started.append(started)
+    for name in modules:
+        import_module(name)
+
+def _soft_timeout(signum, frame):
+    # Give the program one chance to unwind; if it is stuck somewhere
+    # that can't be interrupted, the next alarm kills the process.
+    signal.signal(signal.SIGALRM, signal.SIG_DFL)
+    signal.setitimer(signal.ITIMER_REAL, ProcessExecutor.grace)
+    raise _JobTimeout()
+
+def _run_job(modname, funcname, namespace, output_dests, timeout, token=None):
+    """Run one job in a worker process, and return a tuple of
+(kind, code, captured output, {dest: output file contents})."""
+    key = (modname, funcname)
+    if key not in _processes:
+        _processes[key] = getattr(import_module(modname), funcname)
+    process = _processes[key]
+    if token is not None and _started:
+        _started[0].put(token)  # the job's time starts now, not when it was queued
+    stdout = StringIO()
+    if timeout and hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _soft_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with redirect_streams(StringIO(), stdout, stdout):
+            try:
+                code = process(namespace)
+            except SystemExit as err:
+                code = err.code
+    except _JobTimeout:
+        return 'timeout', None, stdout.getvalue(), {}
+    except Exception:
+        from traceback import format_exc
+        return 'exception', None, format_exc(), {}
+    finally:
+        if timeout and hasattr(signal, 'setitimer'):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+    outputs = {}
+    for dest in output_dests:
+        outfile = getattr(namespace, dest, None)
+        if outfile is not None:
+            outputs[dest] = outfile.getvalue()
+    return 'exit', code, stdout.getvalue(), outputs
+
+class ProcessExecutor(object):
+    """\
+Run the wrapped program in a pool of worker processes, so CPU-bound
+programs aren't all stuck behind one GIL.
+
+module and process name the module and function to run, just like the
+-m and -r options of 'python -m wsgiwrapper'; by default they are
+taken from the runapp passed to run().  Each worker imports the module
+once.  processes is the pool size (default: the number of CPUs),
+maxtasksperchild retires workers after that many jobs to contain
+leaks, and timeout is the number of seconds a job may run before it is
+interrupted and, if need be, killed.  The timeout counts from when a
+worker starts the job, not from when it was queued waiting for one.
+
+The pool isn't started until the first job arrives, so it is safe to
+create one of these before a pre-forking server forks.  The Namespace
+must be picklable, so prefixed hints like 'environ' are never added."""
+
+    in_process = False
+    grace = 5  # seconds between interrupting a job and killing it
+
+    def __init__(self, module=None, process=None, processes=None,
+                 maxtasksperchild=None, timeout=None):
+        self.module = module
+        self.process = process
+        self.processes = processes
+        self.maxtasksperchild = maxtasksperchild
+        self.timeout = timeout
+        self.pool = None
+        self.started = None  # a queue of the tokens of jobs that have started
+        self.starting = {}  # token -> threading.Event, set when its job starts
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        import multiprocessing  # not needed until the first job
+        with self.lock:
+            if self.pool is None:
+                self.started = multiprocessing.SimpleQueue()
+                self.pool = multiprocessing.Pool(
+                    self.processes,
+                    initializer=_init_worker,
+                    initargs=([self.module] if self.module else [], self.started),
+                    maxtasksperchild=self.maxtasksperchild)
+                watcher = threading.Thread(target=self.watch_starts, args=(self.started,),
+                                           name='wsgiwrapper-starts')
+                watcher.daemon = True
+                watcher.start()
+            return self.pool
+
+    def watch_starts(self, started):
+        """Note when each job starts, until the pool is closed."""
+        while True:
+            token = started.get()
+            if token is None:
+                return
+            with self.lock:
+                event = self.starting.pop(token, None)
+            if event is not None:
+                event.set()
+
+    def run(self, runapp, request, namespace):
+        """Run the program in a worker, raising SystemExit with its exit
+status once the captured output has been copied into the request."""
+        modname = self.module or runapp.__module__
+        funcname = self.process or runapp.__name__
+        pool = self.get_pool()
+        token = uuid4().hex
+        started = threading.Event()
+        with self.lock:
+            self.starting[token] = started
+        try:
+            job = pool.apply_async(_run_job, (
+                modname, funcname, namespace, list(request.output_files), self.timeout, token))
+            from multiprocessing import TimeoutError
+            try:
+                wait = None
+                if self.timeout:
+                    # however long it waits for a worker, it may then run for timeout
+                    while not started.wait(1) and not job.ready():
+                        pass
+                    wait = self.timeout + 2 * self.grace
+                kind, code, output, outputs = job.get(wait)
+            except TimeoutError:
+                kind, code, output, outputs = 'timeout', None, '', {}
+        finally:
+            with self.lock:
+                self.starting.pop(token, None)
+        print_where('job finished:', kind, code)
+        if kind == 'exception':
+            raise RemoteError(output)
+        request.stdout.write(output)
+        if kind == 'timeout':
+            raise ExecutionTimeout(self.timeout)
+        for dest, content in outputs.items():
+            request.output_files[dest].write(content)
+        sys.exit(code)
+
+    def close(self):
+        """Shut down the worker processes."""
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+                self.started.put(None)  # stop watch_starts()
+                self.started = None
+
+# Run in a SubprocessExecutor's child: set its resource limits, then run
+# the program as if from the command line.  Its arguments are the limits
+# (as JSON), the module, the function to call (or '' to run the module
+# as __main__, like 'python -m') and the program's command line.
+BOOTSTRAP = """\
+import json, sys
+limits, module, function = json.loads(sys.argv[1]), sys.argv[2], sys.argv[3]
+if limits:
+    import resource
+    for name, value in limits.items():
+        resource.setrlimit(getattr(resource, name), (value, value))
+sys.argv = [module] + sys.argv[4:]
+if function:
+    from importlib import import_module
+    sys.exit(getattr(import_module(module), function)())
+import runpy
+runpy.run_module(module, run_name='__main__', alter_sys=True)
+"""
+
+def option_string(action, negative=False):
+    """Return the option string to use for an action, preferring a long one."""
+    strings = [s for s in action.option_strings if s.startswith('--no-') == negative] or action.option_strings
+    return next((s for s in strings if s.startswith('--')), strings[0])
+
+def items(value):
+    """Return a value as a list, leaving out Nones (e.g. empty form fields)."""
+    return [item for item in (value if isinstance(value, (list, tuple)) else [value])
+            if item is not None]
+
+def flat(value):
+    """\
+Return the values in value, however deeply the form nested them in
+lists (e.g. [default] for nargs='+'), leaving out Nones."""
+    if isinstance(value, (list, tuple)):
+        return [item for element in value for item in flat(element)]
+    return [] if value is None else [value]
+
+def scalar(value):
+    """Return a single value, even if the form made a list of it."""
+    if isinstance(value, (list, tuple)):
+        return next(iter(flat(value)), None)
+    return value
+
+def namespace_argv(parser, namespace):
+    """\
+Return a command line that parser would turn back into namespace, as
+nearly as that can be done: values are given as str() of themselves,
+and those equal to their defaults are left out.  Subcommands aren't
+supported."""
+    optionals, positionals = [], []
+    boolean_optional = getattr(argparse, 'BooleanOptionalAction', ())
+    for action in parser._actions:
+        if (action.dest == argparse.SUPPRESS or
+                isinstance(action, (argparse._HelpAction, argparse._VersionAction))):
+            continue
+        value = getattr(namespace, action.dest, action.default)
+        default = action.default
+        if not action.option_strings:
+            values = flat(value)
+            if action.nargs in (argparse.OPTIONAL, argparse.ZERO_OR_MORE) and values == flat(default):
+                continue
+            positionals.extend(str(item) for item in values)
+        elif isinstance(action, argparse._StoreConstAction):  # store_true, store_false too
+            if scalar(value) == action.const and scalar(value) != default:
+                optionals.append(option_string(action))
+        elif boolean_optional and isinstance(action, boolean_optional):
+            value = scalar(value)
+            if value is not None and value != default:
+                optionals.append(option_string(action, negative=not value))
+        elif isinstance(action, argparse._CountAction):
+            count = int(scalar(value) or 0) - (default or 0)
+            optionals.extend([option_string(action)] * count)
+        elif isinstance(action, argparse._AppendConstAction):
+            optionals.extend([option_string(action)] * (len(items(value)) - len(default or [])))
+        elif isinstance(action, argparse._AppendAction):
+            values = items(value)
+            if default and values[:len(default)] == list(default):
+                values = values[len(default):]  # argparse appends to the default
+            for item in values:
+                optionals.append(option_string(action))
+                optionals.extend(str(v) for v in items(item))
+        else:
+            opt = option_string(action)
+            values = flat(value)
+            if not values:
+                if action.nargs == argparse.ZERO_OR_MORE and value == [] and default != []:
+                    optionals.append(opt)  # given, but with no values
+                continue
+            if values == flat(default):
+                continue  # e.g. a default of ['a', 'b'], which the form gives as [['a', 'b']]
+            if action.nargs in (None, argparse.OPTIONAL):
+                value = values[0]
+                if str(value).startswith('-'):
+                    # don't let a value like '-1' be taken for an option
+                    optionals.append(opt + ('=' if opt.startswith('--') else '') + str(value))
+                else:
+                    optionals.extend((opt, str(value)))
+            else:
+                optionals.append(opt)
+                optionals.extend(str(v) for v in values)
+    if any(arg.startswith('-') for arg in positionals):
+        positionals.insert(0, '--')
+    return optionals + positionals
+
+class SubprocessExecutor(object):
+    """\
+Run the wrapped program in a new Python process for each request, as
+if from the command line, so a program that leaks memory, starts
+threads or changes directory can't harm the server.
+
+The command line is rebuilt from the Namespace and the parser's option
+strings (see namespace_argv), with uploads and output files replaced by
+the names of temporary files, and module.main() is called with it in
+sys.argv; main=None runs the module as __main__, like 'python -m'.  By
+default, module is the one runapp comes from.  Output (stdout and stderr
+together) is copied to the request as it arrives, so it can be
+streamed.  The program's exit status is passed on as SystemExit; if
+it is killed by a signal, the status is 128 plus the signal number.
+
+timeout is the most seconds a run may take (the program is then
+terminated, and killed grace seconds later if need be); cpu_time,
+memory and file_size set the child's RLIMIT_CPU (seconds), RLIMIT_AS and
+RLIMIT_FSIZE (bytes).  The limits need the resource module, i.e. a
+POSIX system."""
+
+    in_process = False
+    grace = 5  # seconds between terminating a program and killing it
+    chunk_size = 64 * 1024  # bytes of output read at a time
+
+    def __init__(self, module=None, main='main', timeout=None, cpu_time=None,
+                 memory=None, file_size=None, cwd=None, python=sys.executable):
+        self.module = module
+        self.main = main
+        self.timeout = timeout
+        self.limits = dict((name, int(value)) for name, value in (
+            ('RLIMIT_CPU', cpu_time), ('RLIMIT_AS', memory), ('RLIMIT_FSIZE', file_size),
+            ) if value is not None)
+        self.cwd = cwd
+        self.python = python
+        self.running = set()  # our children
+        self.lock = threading.Lock()
+
+    def command(self, runapp, argv):
+        """Return the command that runs the program with argv."""
+        modname = self.module or runapp.__module__
+        return [self.python, '-c', BOOTSTRAP, json.dumps(self.limits),
+                modname, self.main or ''] + argv
+
+    def environment(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+        env['PYTHONUNBUFFERED'] = '1'  # so output can be streamed
+        env['PYTHONIOENCODING'] = 'utf-8'
+        return env
+
+    def file_arguments(self, request, namespace, directory):
+        """\
+Return a copy of namespace with each file replaced by the name of a
+file the child can open, and a dict of the outputs: dest -> name."""
+        args = argparse.Namespace(**vars(namespace))
+        outputs = {}
+        for action in request.parser._actions:
+            if not isinstance(action.type, argparse.FileType):
+                continue
+            f = getattr(namespace, action.dest, None)
+            if f is None or isinstance(f, str):
+                continue
+            name = os.path.join(directory, '%s-%s' % (
+                action.dest, os.path.basename(f.name or 'file')))
+            if action.dest in request.output_files:
+                outputs[action.dest] = name
+            else:
+                raw = getattr(f, 'buffer', f)
+                path = getattr(raw, 'path', None)  # a spooled upload is already a file
+                if path is None:
+                    with open(name, 'wb') as copy:
+                        copy.write(raw.getvalue())
+                    path = name
+                name = path
+            setattr(args, action.dest, name)
+        return args, outputs
+
+    def run(self, runapp, request, namespace):
+        """Run the program in a child process, raising SystemExit with its
+exit status once its output has been copied into the request."""
+        import subprocess
+        from codecs import getincrementaldecoder
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        directory = mkdtemp(prefix='wsgiwrapper-')
+        try:
+            args, outputs = self.file_arguments(request, namespace, directory)
+            argv = namespace_argv(request.parser, args)
+            print_where('running', Lazy(' '.join, argv))
+            with open(os.devnull, 'rb') as devnull:
+                child = subprocess.Popen(
+                    self.command(runapp, argv), stdin=devnull, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, cwd=self.cwd, env=self.environment(),
+                    close_fds=True)
+            with self.lock:
+                self.running.add(child)
+            finished, expired = threading.Event(), []
+            if self.timeout:
+                watchdog = threading.Thread(target=self.watch, args=(child, finished, expired),
+                                            name='wsgiwrapper-watchdog')
+                watchdog.daemon = True
+                watchdog.start()
+            decode = getincrementaldecoder('utf-8')('replace').decode
+            try:
+                while True:
+                    data = os.read(child.stdout.fileno(), self.chunk_size)
+                    if not data:
+                        break
+                    request.stdout.write(decode(data))
+                request.stdout.write(decode(b'', True))
+                code = child.wait()
+            finally:
+                finished.set()
+                if child.poll() is None:
+                    child.kill()  # e.g. the client went away while we streamed
+                    child.wait()
+                child.stdout.close()
+                with self.lock:
+                    self.running.discard(child)
+            print_where('child finished:', code)
+            if expired:
+                raise ExecutionTimeout(self.timeout)
+            if code < 0:
+                request.stdout.write('\nKilled by signal %d.\n' % -code)
+                sys.exit(128 - code)
+            if code == 0:
+                for dest, name in outputs.items():
+                    self.copy_output(name, request.output_files[dest])
+            sys.exit(code)
+        finally:
+            rmtree(directory, ignore_errors=True)
+
+    def watch(self, child, finished, expired):
+        """Stop a child that runs for too long."""
+        if finished.wait(self.timeout):
+            return
+        expired.append(True)
+        print_where('terminating child', child.pid)
+        child.terminate()
+        if not finished.wait(self.grace):
+            child.kill()
+
+    def copy_output(self, name, outfile):
+        """Copy what the program wrote to a file into its output file."""
+        if not os.path.exists(name):
+            return
+        spool = getattr(outfile, 'buffer', outfile)
+        with open(name, 'rb') as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                spool.write(data)
+
+    def close(self):
+        """Kill any children that are still running."""
+        with self.lock:
+            for child in self.running:
+                child.kill()
+
+if __name__ == '__main__':
+    pass
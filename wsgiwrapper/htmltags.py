@@ -48,22 +48,44 @@ def import_all(cls, globals=globals()):
     return cls
 
 
+_tag_names = {}  # interned upper-case tag names
+
+def _tag_name(tagName):
+    try:
+        return _tag_names[tagName]
+    except KeyError:
+        return _tag_names.setdefault(tagName, tagName.upper())
+
+_NO_ATTRIBUTES = ()
+
+def _items(attributes):
+    '''Return the (name, value) pairs of a node's attributes, which are a dict or,
+once the node is frozen, a tuple of pairs.'''
+    return attributes if isinstance(attributes, tuple) else attributes.items()
+
+
 @import_all
 class EmptyElement(object):
-    '''An HTML element that does not have a closing element and thus cannot contain sub-elements.'''
+    '''An HTML element that does not have a closing element and thus cannot contain sub-elements.
+
+Nodes have no __dict__.  Once a tree is built, freeze() stores its attributes
+(and children) in tuples, which is much smaller for large forms; changing a
+frozen node quietly thaws it again.'''
+
+    __slots__ = ('tagName', 'attributes')
 
     __all__ = [
         'Area', 'Base', 'BaseFont', 'Br', 'Col', 'Frame', 'HR', 'Img',
         'Input', 'IsIndex', 'Link', 'Meta', 'Param']
 
     def __init__(self, tagName, **attributes):
-        self.tagName = tagName.upper()
+        self.tagName = _tag_name(tagName)
         self.attributes = attributes
         super(EmptyElement, self).__init__()
 
     def __iter__(self):
         yield '<' + self.tagName.lower()
-        for key, value in self.attributes.items():
+        for key, value in _items(self.attributes):
             yield ' ' + key.lower()
             if value is not None:
                 yield '=' + repr(value)
@@ -75,26 +97,51 @@ class EmptyElement(object):
     def __bytes__(self):
         return str(self).encode()
 
+    def _mutable_attributes(self):
+        if isinstance(self.attributes, tuple):
+            self.attributes = dict(self.attributes)
+        return self.attributes
+
     def getAttribute(self, name):
-        return self.attributes.get(name.lower())
+        return dict(_items(self.attributes)).get(name.lower())
 
     def hasAttribute(self, name):
-        return name.lower() in self.attributes
+        name = name.lower()
+        return any(key == name for key, value in _items(self.attributes))
 
     def removeAttribute(self, name):
         try:
-            del self.attributes[name.lower()]
+            del self._mutable_attributes()[name.lower()]
         except:
             pass
 
     def setAttribute(self, name, value):
-        self.attributes[name.lower()] = value
+        self._mutable_attributes()[name.lower()] = value
+
+    def clone(self):
+        '''Return a copy of this node (and its children), sharing the strings.'''
+        node = object.__new__(type(self))
+        node.tagName = self.tagName
+        attributes = self.attributes
+        node.attributes = attributes if isinstance(attributes, tuple) else dict(attributes)
+        return node
+
+    def __deepcopy__(self, memo):
+        return self.clone()
+
+    def freeze(self):
+        '''Store this node's attributes in a tuple; returns the node.'''
+        if not isinstance(self.attributes, tuple):
+            self.attributes = tuple(self.attributes.items()) or _NO_ATTRIBUTES
+        return self
 
 
 @import_all
 class Element(EmptyElement):
     '''An HTML element that can contain sub-elements.'''
 
+    __slots__ = ('childNodes',)
+
     __all__ = [
         'A', 'Abbr', 'Acronym', 'Address', 'Applet', 'B', 'Bdo', 'Big',
         'Blockquote', 'Body', 'Button', 'Caption', 'Center', 'Cite',
@@ -113,6 +160,8 @@ class Element(EmptyElement):
         super(Element, self).__init__(tagName, **attributes)
         
     def __iadd__(self, item):
+        if isinstance(self.childNodes, tuple):
+            self.childNodes = list(self.childNodes)
         if isinstance(item, tuple):
             self.childNodes.extend(item)
         else:
@@ -121,7 +170,7 @@ class Element(EmptyElement):
     
     def __iter__(self):
         yield '<' + self.tagName.lower()
-        for key, value in self.attributes.items():
+        for key, value in _items(self.attributes):
             yield ' ' + key.lower()
             if value is not None:
                 yield '=' + repr(value)
@@ -133,6 +182,127 @@ class Element(EmptyElement):
                 yield str(item)
             yield '</' + self.tagName.lower()+'>'
 
+    def clone(self):
+        node = super(Element, self).clone()
+        node.childNodes = [item.clone() if isinstance(item, EmptyElement) else item
+                           for item in self.childNodes]
+        return node
+
+    def freeze(self):
+        '''Store the attributes and children of this node, and of all the nodes
+under it, in tuples; returns the node.'''
+        super(Element, self).freeze()
+        for item in self.childNodes:
+            if isinstance(item, EmptyElement):
+                item.freeze()
+        if not isinstance(self.childNodes, tuple):
+            self.childNodes = tuple(self.childNodes)
+        return self
+
+
+class Slot(object):
+    '''A named placeholder in an Element tree, filled in each time a CompiledTemplate
+is rendered.  It may be a child or an attribute value; anywhere else (e.g. in str()
+of the tree) it stands for its default.'''
+
+    __slots__ = ('name', 'default')
+
+    def __init__(self, name, default=''):
+        self.name = name
+        self.default = default
+
+    def __repr__(self):
+        # attribute values are serialized with repr()
+        return repr(self.default)
+
+    def __str__(self):
+        return str(self.default)
+
+
+def _serialize(node, parts):
+    '''Append the text of a node to parts, exactly as iterating over it would
+produce it, but with (slot, in_attribute) tuples wherever a Slot appears.'''
+    if isinstance(node, Slot):
+        parts.append((node, False))
+    elif not isinstance(node, EmptyElement) or type(node).__iter__ not in _plain_iters:
+        parts.append(node if isinstance(node, str) else str(node))
+    else:
+        tag = node.tagName.lower()
+        parts.append('<' + tag)
+        for key, value in _items(node.attributes):
+            parts.append(' ' + key.lower())
+            if isinstance(value, Slot):
+                parts.append((value, True))
+            elif value is not None:
+                parts.append('=' + repr(value))
+        if not isinstance(node, Element):
+            parts.append('>')
+        elif not node.childNodes:
+            parts.append(' />')
+        else:
+            parts.append('>')
+            for item in node.childNodes:
+                _serialize(item, parts)
+            parts.append('</' + tag + '>')
+
+_plain_iters = (EmptyElement.__iter__, Element.__iter__)
+
+
+class CompiledTemplate(object):
+    '''Some nodes (Elements, strings and Slots), serialized once into static byte
+strings, so that rendering is just filling in the Slots and joining a few buffers.'''
+
+    __slots__ = ('parts', 'slots', 'encoding')
+
+    def __init__(self, nodes, encoding='utf-8'):
+        raw = []
+        for node in nodes:
+            _serialize(node, raw)
+        self.parts, self.slots, self.encoding = [], [], encoding
+        text = []
+        for item in raw + [None]:
+            if isinstance(item, tuple) or item is None:
+                if text:
+                    self.parts.append(''.join(text).encode(encoding))
+                    text = []
+                if item is not None:
+                    self.slots.append((len(self.parts),) + item)
+                    self.parts.append(b'')
+            else:
+                text.append(item)
+
+    def slot_names(self):
+        return [slot.name for index, slot, in_attribute in self.slots]
+
+    def render(self, **values):
+        '''Return the bytes of the template, with Slots replaced by the values given
+for them, or by their defaults.  Values are inserted as they are, not escaped.'''
+        if not self.slots:
+            return b''.join(self.parts)
+        parts = list(self.parts)
+        for index, slot, in_attribute in self.slots:
+            value = values.get(slot.name, slot.default)
+            if in_attribute:
+                value = '' if value is None else '=' + repr(value)
+            elif isinstance(value, bytes):
+                parts[index] = value
+                continue
+            parts[index] = str(value).encode(self.encoding)
+        return b''.join(parts)
+
+    def __bytes__(self):
+        return self.render()
+
+    def __str__(self):
+        return self.render().decode(self.encoding)
+
+
+def compile_tree(*nodes):
+    '''Compile an Element tree (or several nodes) into a CompiledTemplate.'''
+    return CompiledTemplate(nodes)
+
+__all__.extend(['Slot', 'CompiledTemplate', 'compile_tree'])
+
 if __name__ == '__main__':
     xyzzy = Element('xyzzy', foo='bar')
     xyzzy += 'this'
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+"""\
+Run the wrapped program in the background.
+
+A submitted form becomes a Job, which waits in a bounded queue for one
+of a fixed number of runner threads.  Finished jobs keep their response
+until they are evicted, result_ttl seconds later, or sooner if too many
+jobs have finished since."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from collections import deque
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+from uuid import uuid4
+import threading, time
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+QUEUED, RUNNING, FINISHED = 'queued', 'running', 'finished'
+
+class JobQueueFull(Exception):
+    """Too many jobs are already waiting to run."""
+
+class Job(object):
+    """\
+One run of the wrapped program.  target is called with no arguments and
+returns a WSGI response iterable, after calling request.start_response;
+both are captured so the response can be replayed later.  An output file
+isn't read into memory: the job keeps its SpooledOutput (as download)
+until it is evicted."""
+
+    def __init__(self, request, target):
+        self.id = uuid4().hex
+        self.request = request
+        self.target = target
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = self.finished = None
+        self.status = self.headers = None
+        self.body = []
+        self.download = None  # the output file's SpooledOutput, if it was sent
+        request.start_response = self.start_response
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status, self.headers = status, list(headers)
+        return self.body.append
+
+    def run(self):
+        self.state, self.started = RUNNING, time.time()
+        try:
+            result = self.target()
+            try:
+                download = self.request.download
+                if download is not None and self.status == '200 OK':
+                    self.request.keep_download = True
+                    self.download = download
+                else:
+                    self.body.extend(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception:
+            from traceback import format_exc
+            self.status = '500 Internal Server Error'
+            self.headers = [('Content-Type', 'text/plain; charset=utf-8')]
+            self.body = [format_exc().encode('utf-8')]
+        finally:
+            self.request.close()
+            self.state, self.finished = FINISHED, time.time()
+            print_where('job', self.id, 'finished:', self.status)
+
+    def discard(self):
+        """Throw away the job's output file, if it kept one."""
+        if self.download is not None:
+            self.download.discard()
+
+    def output(self, offset=0):
+        """Return what the program has written to stdout from offset on."""
+        return self.request.stdout.getvalue()[offset:]
+
+    def as_dict(self, offset=0):
+        """Describe the job, e.g. for a JSON status response."""
+        output = self.output(offset)
+        return {
+            'id': self.id,
+            'state': self.state,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'status': self.status,
+            'output': output,
+            'offset': offset + len(output),
+            }
+
+class JobStore(object):
+    """\
+An in-process home for jobs.  At most max_running jobs run at once and
+at most max_queued wait their turn; submit() raises JobQueueFull beyond
+that.  At most max_finished finished jobs are kept, the oldest being
+evicted first, so a burst of submissions can't hold on to unlimited
+memory and disk until result_ttl runs out.  The runner threads aren't started until the first job arrives,
+so it is safe to create one of these before a pre-forking server forks."""
+
+    def __init__(self, max_running=4, max_queued=100, result_ttl=3600, max_finished=1000):
+        self.max_running = max_running
+        self.max_finished = max_finished
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.finished = deque()  # in the order they finished
+        self.pending = Queue(max_queued)
+        self.runners = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def submit(self, job):
+        self.sweep()
+        try:
+            self.pending.put_nowait(job)
+        except Full:
+            raise JobQueueFull()
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.runners) < self.max_running:
+                runner = threading.Thread(target=self.run_jobs, name='wsgiwrapper-job')
+                runner.daemon = True
+                runner.start()
+                self.runners.append(runner)
+        return job
+
+    def get(self, job_id):
+        self.sweep()
+        return self.jobs.get(job_id)
+
+    def run_jobs(self):
+        while True:
+            job = self.pending.get()
+            job.run()
+            with self.lock:
+                self.finished.append(job)
+                while len(self.finished) > self.max_finished:
+                    self.evict()
+
+    def sweep(self):
+        """Forget jobs that finished more than result_ttl seconds ago."""
+        expired = time.time() - self.result_ttl
+        with self.lock:
+            while self.finished and self.finished[0].finished < expired:
+                self.evict()
+
+    def evict(self):
+        """Forget the job that finished first; call with self.lock held."""
+        job = self.finished.popleft()
+        self.jobs.pop(job.id, None)
+        job.discard()
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,247 @@
+#! /usr/bin/env python
+
+"""\
+Counts and timings of the requests a wsgiwrapper handles, served as text
+in the Prometheus exposition format.
+
+Each request keeps its own list of phase timings, which are added to
+the shared histograms once, when the request is done, so a request
+takes the lock one time however many phases it has.  Pre-forked
+workers each have their own Metrics; given a directory, each writes
+what it has seen there (at most once per interval) and a scrape adds
+up all of them."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from bisect import bisect_left
+import os, pickle, threading, time
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+__all__ = ['Metrics', 'timer']
+
+timer = getattr(time, 'perf_counter', time.time)
+
+INF = float('inf')
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1.0, 2.5, 5.0, 10.0, 30.0, 60.0, INF)  # seconds
+SIZE_BUCKETS = tuple(1024 * 4 ** n for n in range(11)) + (INF,)  # 1KB to 1GB
+
+METRICS = {  # name -> (type, buckets, help)
+    'requests_total': ('counter', None, 'Requests handled.'),
+    'request_seconds': ('histogram', TIME_BUCKETS,
+                        'Time until the response started (the whole response, if it was a list).'),
+    'phase_seconds': ('histogram', TIME_BUCKETS, 'Time spent in each phase of a POST.'),
+    'request_bytes': ('histogram', SIZE_BUCKETS, 'Sizes of POSTed bodies.'),
+    'response_bytes': ('histogram', SIZE_BUCKETS, 'Sizes of responses (not counting streamed ones).'),
+    'upload_bytes_total': ('counter', None, 'Bytes of uploaded files.'),
+    'exit_codes_total': ('counter', None, 'Exit codes of the wrapped program.'),
+    'in_flight': ('gauge', None, 'Requests being handled right now.'),
+    'executions_running': ('gauge', None, 'Runs of the program admitted and not yet finished.'),
+    'executions_waiting': ('gauge', None, 'Runs of the program waiting to be admitted.'),
+    'execution_wait_seconds': ('histogram', TIME_BUCKETS, 'Time runs waited to be admitted.'),
+    'executions_rejected_total': ('counter', None,
+                                  'Runs turned away because too many were waiting, or waited too long.'),
+    }
+PREFIX = 'wsgiwrapper_'
+
+class Histogram(object):
+    """Counts of observations no bigger than each bucket, and their sum."""
+
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+
+    def add(self, counts, total):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.sum += total
+
+def format_labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                             for key, value in labels) if labels else ''
+
+class Metrics(object):
+    """\
+A thread-safe collection of counters, gauges and histograms.  Pass the
+same Metrics to several wsgiwrappers (e.g. as a Dispatcher option) to
+serve them all from one metrics page; each is labelled by its form_name.
+If directory is given, the Metrics of several processes are combined."""
+
+    def __init__(self, directory=None, interval=1.0):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> number; gauges too
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.saved = 0  # when we last wrote to directory
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def started(self, app):
+        """Count a request as in flight."""
+        key = ('in_flight', (('app', app),))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def finished(self, app, request, seconds, body):
+        """Record everything about a request that started() was called for."""
+        app_label = ('app', app)
+        environ = request.environ
+        counts = [
+            ('in_flight', (app_label,), -1),
+            ('requests_total', (app_label, ('method', environ.get('REQUEST_METHOD', '')),
+                                ('status', (request.status or '').split(' ', 1)[0])), 1),
+            ]
+        observations = [('request_seconds', (app_label,), seconds)]
+        for phase, elapsed in request.timings or ():
+            observations.append(('phase_seconds', (app_label, ('phase', phase)), elapsed))
+        if environ.get('REQUEST_METHOD') == 'POST':
+            try:
+                observations.append(('request_bytes', (app_label,), int(environ.get('CONTENT_LENGTH') or 0)))
+            except ValueError:
+                pass
+        if isinstance(body, list):
+            observations.append(('response_bytes', (app_label,), sum(len(chunk) for chunk in body)))
+        fields = getattr(request.form, 'fields', {})
+        uploaded = sum(part.size for parts in fields.values()
+                       for part in parts if part.filename is not None)
+        if uploaded:
+            counts.append(('upload_bytes_total', (app_label,), uploaded))
+        code = request.exit_code
+        if code is not None:
+            if not isinstance(code, int):
+                code = 1  # e.g. sys.exit('message'), as the interpreter would report it
+            counts.append(('exit_codes_total', (app_label, ('code', int(code))), 1))
+        self.record(counts, observations)
+
+    def waiting(self, app):
+        """Count a run of the program as waiting to be admitted."""
+        self.record([('executions_waiting', (('app', app),), 1)])
+
+    def admitted(self, app, seconds):
+        """Record that a run was admitted after waiting for seconds."""
+        app_label = ('app', app)
+        self.record([('executions_waiting', (app_label,), -1),
+                     ('executions_running', (app_label,), 1)],
+                    [('execution_wait_seconds', (app_label,), seconds)])
+
+    def rejected(self, app, reason, waited=True):
+        """Record that a run wasn't admitted, and why; waited is False if
+it was turned away without waiting() being called for it."""
+        app_label = ('app', app)
+        counts = [('executions_rejected_total', (app_label, ('reason', reason)), 1)]
+        if waited:
+            counts.append(('executions_waiting', (app_label,), -1))
+        self.record(counts)
+
+    def released(self, app):
+        """Record that an admitted run has finished."""
+        self.record([('executions_running', (('app', app),), -1)])
+
+    def record(self, counts, observations=()):
+        """Add (name, labels, amount) to counters and (name, labels, value) to histograms."""
+        with self.lock:
+            for name, labels, amount in counts:
+                key = name, labels
+                self.counters[key] = self.counters.get(key, 0) + amount
+            for name, labels, value in observations:
+                buckets = METRICS[name][1]
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[name, labels] = Histogram(buckets)
+                histogram.counts[bisect_left(buckets, value)] += 1
+                histogram.sum += value
+            save = self.directory and time.time() - self.saved >= self.interval
+            if save:
+                self.saved = time.time()
+                snapshot = self.snapshot()
+        if save:
+            self.save(snapshot)
+
+    def snapshot(self):
+        """Return a copy of everything we've counted; call with self.lock held."""
+        return (dict(self.counters),
+                dict((key, (list(h.counts), h.sum)) for key, h in self.histograms.items()))
+
+    def path(self, pid):
+        return os.path.join(self.directory, '%d.metrics' % pid)
+
+    def save(self, snapshot):
+        # write then rename, so readers never see a partial file
+        from tempfile import mkstemp
+        fd, temp = mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, self.path(os.getpid()))
+        except (IOError, OSError):
+            print_where('could not save metrics', self.directory)
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+
+    def snapshots(self):
+        """Yield (snapshot, alive) for this process and any others sharing our directory."""
+        with self.lock:
+            yield self.snapshot(), True
+        if not self.directory:
+            return
+        for name in os.listdir(self.directory):
+            pid, ext = os.path.splitext(name)
+            if ext != '.metrics' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    snapshot = pickle.load(f)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                continue
+            try:
+                os.kill(int(pid), 0)
+                alive = True
+            except OSError:
+                alive = False
+            yield snapshot, alive
+
+    def render(self):
+        """Return all of our metrics, in the Prometheus text format."""
+        counters, histograms = {}, {}
+        for (counts, hists), alive in self.snapshots():
+            for key, value in counts.items():
+                if alive or METRICS[key[0]][0] != 'gauge':
+                    counters[key] = counters.get(key, 0) + value
+            for key, (buckets, total) in hists.items():
+                if key not in histograms:
+                    histograms[key] = Histogram(buckets)
+                histograms[key].add(buckets, total)
+        lines = []
+        for name in sorted(METRICS):
+            kind, buckets, help = METRICS[name]
+            lines.append('# HELP %s%s %s' % (PREFIX, name, help))
+            lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+            if kind != 'histogram':
+                for key in sorted(k for k in counters if k[0] == name):
+                    lines.append('%s%s%s %s' % (PREFIX, name, format_labels(key[1]), counters[key]))
+                continue
+            for key in sorted(k for k in histograms if k[0] == name):
+                labels, histogram = key[1], histograms[key]
+                cumulative = 0
+                for bucket, count in zip(buckets, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bucket == INF else repr(bucket)
+                    lines.append('%s%s_bucket%s %d' % (
+                        PREFIX, name, format_labels(labels + (('le', le),)), cumulative))
+                lines.append('%s%s_sum%s %r' % (PREFIX, name, format_labels(labels), histogram.sum))
+                lines.append('%s%s_count%s %d' % (PREFIX, name, format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,329 @@
+#! /usr/bin/env python
+
+"""\
+A streaming replacement for cgi.FieldStorage.
+
+The request body is read in bounded chunks.  Uploaded files are kept in
+memory while they are small and spooled to temporary files once they
+grow past a threshold, so an upload is never held in memory in full."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+try:
+    from urllib.parse import parse_qsl
+except ImportError:
+    from urlparse import parse_qsl
+import io, os
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+CHUNK_SIZE = 64 * 1024  # bytes read from wsgi.input at a time
+SPOOL_SIZE = 1024 * 1024  # uploads larger than this go to disk
+MAX_HEADER_SIZE = 16 * 1024  # per part
+
+CRLF = b'\r\n'
+
+class RequestTooLarge(Exception):
+    """The request body, or one of its parts, exceeded a size limit."""
+
+class MalformedRequest(ValueError):
+    """The request body could not be parsed."""
+
+class UploadedBinaryFile(io.BufferedRandom):
+    """A temporary file holding an upload; unlike a plain file, its name
+can be set to the name the browser sent."""
+    name = None
+
+    def __reduce__(self):
+        return reopen_upload, (self.path, 'rb', None, None, self.name, self.tell())
+
+class UploadedBytes(io.BytesIO):
+    """An upload small enough to be kept in memory."""
+    name = None
+
+class UploadedTextFile(io.TextIOWrapper):
+    """A text view of an upload, for argparse.FileType('r')."""
+    name = None
+
+    def __reduce__(self):
+        # Lets the Namespace be pickled, e.g. by ProcessExecutor.
+        raw = self.buffer
+        source = raw.path if isinstance(raw, UploadedBinaryFile) else raw.getvalue()
+        return reopen_upload, (source, 'r', self.encoding, self.errors, self.name, raw.tell())
+
+def reopen_upload(source, mode, encoding, errors, name, position):
+    """Recreate an upload from a path or from its contents."""
+    if isinstance(source, bytes):
+        f = UploadedBytes(source)
+    else:
+        f = UploadedBinaryFile(io.FileIO(source, 'r+'))
+        f.path = source
+    f.seek(position)
+    if 'b' not in mode:
+        f = UploadedTextFile(f, encoding=encoding, errors=errors)
+    f.name = name
+    return f
+
+class Part(object):
+    """One field of a submitted form."""
+
+    def __init__(self, name, filename=None, headers=None,
+                 spool_size=SPOOL_SIZE, max_size=None):
+        self.name = name
+        self.filename = filename
+        self.headers = headers or {}
+        self.spool_size = spool_size
+        self.max_size = max_size
+        self.file = UploadedBytes()
+        self.size = 0
+
+    def __repr__(self):
+        return '%s(%r, %r, size=%d)' % (
+            self.__class__.__name__, self.name, self.filename, self.size)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestTooLarge('part %r is over %d bytes' % (self.name, self.max_size))
+        if (self.size > self.spool_size and
+                not isinstance(self.file, UploadedBinaryFile)):
+            from tempfile import mkstemp
+            fd, path = mkstemp(prefix='wsgiwrapper-')
+            spooled = UploadedBinaryFile(io.FileIO(fd, 'w+b'))
+            spooled.path = path
+            spooled.write(self.file.getvalue())
+            self.file = spooled
+            print_where('spooled', self.name, 'to', path)
+        self.file.write(data)
+
+    @property
+    def value(self):
+        """The field's contents; text for ordinary fields, bytes for files."""
+        self.file.seek(0)
+        data = self.file.read()
+        return data if self.filename is not None else data.decode('utf-8', 'replace')
+
+    def open(self, mode='r', encoding=None, errors=None):
+        """Return a seekable file object for an upload, with the given
+mode (as used by argparse.FileType), positioned at the start."""
+        f = self.file
+        f.flush()
+        f.seek(0)
+        if 'b' not in mode:
+            f = UploadedTextFile(f, encoding=encoding or 'utf-8', errors=errors)
+        f.name = self.filename
+        return f
+
+    def close(self):
+        self.file.close()
+        path = getattr(self.file, 'path', None)
+        if path:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+class FormData(object):
+    """\
+The parsed fields of a form, with enough of cgi.FieldStorage's
+interface that it can be used in its place."""
+
+    def __init__(self):
+        self.fields = {}
+
+    def add(self, part):
+        self.fields.setdefault(part.name, []).append(part)
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def __getitem__(self, name):
+        return self.fields[name][0]
+
+    def keys(self):
+        return self.fields.keys()
+
+    def getfirst(self, name, default=None):
+        parts = self.fields.get(name)
+        return parts[0].value if parts else default
+
+    def getlist(self, name):
+        return [part.value for part in self.fields.get(name, [])]
+
+    def close(self):
+        """Discard any uploaded files."""
+        for parts in self.fields.values():
+            for part in parts:
+                part.close()
+
+def read_chunks(environ, chunk_size=CHUNK_SIZE):
+    """Yield the request body in chunks of at most chunk_size bytes."""
+    stream = environ['wsgi.input']
+    remaining = body_length(environ)
+    while remaining:
+        size = chunk_size if remaining < 0 else min(chunk_size, remaining)
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        if remaining > 0:
+            remaining -= len(chunk)
+        yield chunk
+
+def content_length(value):
+    """Convert a Content-Length header value; -1 means unknown."""
+    try:
+        return int(value or -1)
+    except ValueError:
+        raise MalformedRequest('bad Content-Length')
+
+def body_length(environ):
+    """\
+Return the length of a WSGI request's body, or -1 if it is to be read
+until EOF.  As PEP 3333 says, a missing Content-Length means there is
+no body, unless the server has said wsgi.input ends with the body; a
+server that keeps the connection open would otherwise never let us
+see EOF."""
+    if environ.get('CONTENT_LENGTH'):
+        return content_length(environ['CONTENT_LENGTH'])
+    return -1 if environ.get('wsgi.input_terminated') else 0
+
+def parse_headers(block):
+    """Parse the headers of one part, returning (name, filename, headers)."""
+    from email.parser import HeaderParser  # slow to import; only needed for POSTs
+    from email.utils import collapse_rfc2231_value
+    message = HeaderParser().parsestr(block.decode('utf-8', 'replace'))
+    name = message.get_param('name', header='content-disposition')
+    if name is None:
+        raise MalformedRequest('part has no name')
+    filename = message.get_param('filename', header='content-disposition')
+    if filename is not None:
+        filename = collapse_rfc2231_value(filename)
+    headers = dict((key.lower(), value) for key, value in message.items())
+    return name, filename, headers
+
+class FormParser(object):
+    """\
+Parse a submitted form incrementally: feed() it the request body in
+chunks of any size, then call close() to get the FormData.  Handles
+multipart/form-data and application/x-www-form-urlencoded bodies.
+Raises RequestTooLarge if a size limit is exceeded, or MalformedRequest
+if the body can't be parsed."""
+
+    def __init__(self, content_type, length=-1, spool_size=SPOOL_SIZE,
+                 max_body_size=None, max_part_size=None):
+        if max_body_size is not None and length > max_body_size:
+            raise RequestTooLarge('request body is %d bytes' % length)
+        self.form = FormData()
+        self.spool_size = spool_size
+        self.max_body_size = max_body_size
+        self.max_part_size = max_part_size
+        self.received = 0
+        self.buf = bytearray(CRLF)  # so the first delimiter looks like the rest
+        self.part = None
+        from email.parser import HeaderParser
+        message = HeaderParser().parsestr('Content-Type: ' + (content_type or ''))
+        if message.get_content_type() == 'multipart/form-data':
+            boundary = message.get_param('boundary')
+            if not boundary:
+                raise MalformedRequest('multipart body without a boundary')
+            self.separator = CRLF + b'--' + boundary.encode('latin-1')
+            self.state = 'preamble'
+        else:
+            self.buf = bytearray()
+            self.state = 'urlencoded'
+
+    def feed(self, chunk):
+        self.received += len(chunk)
+        if self.max_body_size is not None and self.received > self.max_body_size:
+            raise RequestTooLarge('request body is over %d bytes' % self.max_body_size)
+        self.buf += chunk
+        if self.state != 'urlencoded':
+            self.parse()
+
+    def parse(self):
+        buf, separator = self.buf, self.separator
+        while True:
+            if self.state in ('preamble', 'body'):
+                i = buf.find(separator)
+                if i < 0:
+                    # keep enough to recognize a separator split across chunks
+                    keep = len(separator) - 1
+                    if len(buf) > keep:
+                        if self.part is not None:
+                            self.part.write(bytes(buf[:-keep]))
+                        del buf[:-keep]
+                    break
+                if self.part is not None:
+                    self.part.write(bytes(buf[:i]))
+                del buf[:i + len(separator)]
+                self.state = 'delimiter'
+            elif self.state == 'delimiter':
+                if len(buf) < 2:
+                    break
+                if buf[:2] == b'--':
+                    self.state = 'epilogue'
+                elif buf[:2] == CRLF:
+                    del buf[:2]
+                    self.state = 'headers'
+                else:
+                    raise MalformedRequest('bad multipart delimiter')
+            elif self.state == 'headers':
+                if buf[:2] == CRLF:
+                    block, end = b'', 2
+                else:
+                    i = buf.find(CRLF + CRLF)
+                    if i < 0:
+                        if len(buf) > MAX_HEADER_SIZE:
+                            raise MalformedRequest('multipart headers too long')
+                        break
+                    block, end = bytes(buf[:i]), i + 4
+                del buf[:end]
+                name, filename, headers = parse_headers(block)
+                self.part = Part(name, filename, headers,
+                                 self.spool_size, self.max_part_size)
+                self.form.add(self.part)
+                self.state = 'body'
+            else:  # epilogue
+                del buf[:]
+                break
+
+    def close(self):
+        """Finish parsing, and return the FormData."""
+        form = self.form
+        if self.state == 'urlencoded':
+            body = bytes(self.buf).decode('latin-1')
+            for name, value in parse_qsl(body, keep_blank_values=True):
+                part = Part(name, max_size=self.max_part_size)
+                part.write(value.encode('utf-8'))
+                form.add(part)
+        elif self.state != 'epilogue':
+            raise MalformedRequest('multipart body ended early')
+        for parts in form.fields.values():
+            for part in parts:
+                part.file.flush()
+        return form
+
+def parse_form(environ, chunk_size=CHUNK_SIZE, spool_size=SPOOL_SIZE,
+               max_body_size=None, max_part_size=None):
+    """\
+Parse the form submitted with a WSGI request, returning a FormData
+object.  Raises the same exceptions as FormParser."""
+    parser = FormParser(
+        environ.get('CONTENT_TYPE'),
+        body_length(environ),
+        spool_size, max_body_size, max_part_size)
+    try:
+        for chunk in read_chunks(environ, chunk_size):
+            parser.feed(chunk)
+        return parser.close()
+    except Exception:
+        parser.form.close()
+        raise
+
+if __name__ == '__main__':
+    pass
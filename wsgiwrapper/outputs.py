@@ -0,0 +1,209 @@
+#! /usr/bin/env python
+
+"""\
+Output files: what the wrapped program writes to a FileType('w')
+argument, sent back to the client as a download.
+
+The program's output is encoded as it is written (not at the end, as
+with a StringIO), kept in memory while it is small, and spooled to a
+temporary file once it grows past a threshold, so a large report is
+never held in memory in full.  A spooled file is sent with the server's
+wsgi.file_wrapper, if it has one, which can use sendfile().  A download
+may be asked for a piece at a time with Range (and If-Range) headers,
+e.g. to resume it."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from hashlib import sha1
+import io, os
+
+# Python site libraries
+
+# Python personal libraries
+from .multipart import CHUNK_SIZE, SPOOL_SIZE
+from .utils import print_where
+
+__all__ = ['OutputTextFile', 'SpooledOutput', 'UNSATISFIABLE', 'open_output',
+           'output_spool', 'requested_range']
+
+UNSATISFIABLE = object()  # a range that is entirely past the end of the body
+
+class StandInBytes(io.BytesIO):
+    """Stands in for a binary output file in another process; like a
+SpooledOutput, it keeps what was written when it is closed."""
+    def close(self):
+        pass
+
+class StandInText(io.StringIO):
+    """Stands in for a text output file in another process."""
+    def close(self):
+        pass
+
+def named_output(name, mode):
+    """Make a file to stand in for an output file in another process."""
+    f = StandInBytes() if 'b' in mode else StandInText()
+    f.name = name
+    return f
+
+class SpooledOutput(io.BufferedIOBase):
+    """\
+The bytes written to an output file.  Closing it (as a program may do
+when it is finished with the file) keeps what was written, so it can
+still be sent; discard() throws it away."""
+
+    name = None
+
+    def __init__(self, spool_size=SPOOL_SIZE):
+        self.spool_size = spool_size
+        self.file = io.BytesIO()
+        self.path = None  # the temporary file, once we have spooled to one
+        self.size = 0
+        self.digest = sha1()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed file')
+        size = len(data)
+        if self.path is None and self.size + size > self.spool_size:
+            from tempfile import mkstemp
+            fd, self.path = mkstemp(prefix='wsgiwrapper-')
+            spooled = io.open(fd, 'wb')
+            spooled.write(self.file.getvalue())
+            self.file = spooled
+            print_where('spooled', self.name, 'to', self.path)
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += size
+        return size
+
+    def flush(self):
+        if self.path is not None and not self.file.closed:
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        super(SpooledOutput, self).close()
+
+    @property
+    def etag(self):
+        return '"%s"' % self.digest.hexdigest()
+
+    def reader(self, start, stop, file_wrapper=None):
+        """\
+Return a response iterable of bytes start to stop of what was written.
+It doesn't depend on this object, which may be discarded before it is
+sent."""
+        if self.path is None:
+            return [self.file.getvalue()[start:stop]]
+        self.flush()
+        f = open(self.path, 'rb')  # still readable once discard() unlinks it
+        if start == 0 and stop == self.size and file_wrapper is not None:
+            return file_wrapper(f, CHUNK_SIZE)
+        f.seek(start)
+        return FileSlice(f, stop - start)
+
+    def discard(self):
+        """Throw away what was written, removing any temporary file."""
+        self.file.close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __reduce__(self):
+        # Lets the Namespace be pickled, e.g. by ProcessExecutor; what
+        # is written in the other process is copied back to us.
+        return named_output, (self.name, 'wb')
+
+class OutputTextFile(io.TextIOWrapper):
+    """A text view of a SpooledOutput, for argparse.FileType('w')."""
+
+    def __reduce__(self):
+        return named_output, (self.name, 'w')
+
+def open_output(filename, mode='w', encoding=None, errors=None, spool_size=SPOOL_SIZE):
+    """Return a new output file, with the given mode (as used by argparse.FileType)."""
+    spool = SpooledOutput(spool_size)
+    spool.name = filename
+    if 'b' in mode:
+        return spool
+    # no newline translation, as with the StringIO this replaces
+    return OutputTextFile(spool, encoding=encoding or 'utf-8', errors=errors, newline='\n')
+
+def output_spool(outfile):
+    """\
+Return the SpooledOutput holding what was written to an output file,
+copying it into one if it is some other kind of file (e.g. a
+QueueWriter that was never streamed)."""
+    if isinstance(outfile, SpooledOutput):
+        return outfile
+    if isinstance(outfile, OutputTextFile):
+        if not outfile.closed:
+            outfile.flush()
+        return outfile.buffer
+    content = outfile.getbytes() if hasattr(outfile, 'getbytes') else outfile.getvalue()
+    spool = SpooledOutput()
+    spool.name = outfile.name
+    spool.write(content if isinstance(content, bytes) else content.encode('utf-8'))
+    return spool
+
+class FileSlice(object):
+    """A WSGI response iterable that sends length bytes of a file, from
+wherever it has been positioned, and then closes it."""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.length = length
+
+    def __iter__(self):
+        remaining = self.length
+        while remaining > 0:
+            chunk = self.f.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.f.close()
+
+def requested_range(environ, size, etag=None, last_modified=None):
+    """\
+Return the (start, stop) of the byte range the client asked for in its
+Range header, None if it should be sent the whole body, or UNSATISFIABLE.
+A request for several ranges gets the whole body, as does one whose
+If-Range doesn't match our ETag (or Last-Modified date)."""
+    header = environ.get('HTTP_RANGE', '')
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range:
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            if etag is None or if_range != etag:  # a strong comparison
+                return None
+        elif if_range != last_modified:
+            return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            stop = min(int(last) + 1, size) if last else size
+        else:
+            start, stop = max(size - int(last), 0), size  # the last N bytes
+    except ValueError:
+        return None
+    if start < 0 or stop <= start:
+        return UNSATISFIABLE if start >= size else None
+    return start, stop
+
+if __name__ == '__main__':
+    pass
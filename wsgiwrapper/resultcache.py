@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+
+"""\
+Remember the responses of a wrapped program, so that submitting the same
+form twice only runs the program once.
+
+Results are keyed by a digest of the argparse.Namespace built from the
+form; uploaded files contribute a digest of their contents."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from collections import OrderedDict
+from hashlib import sha256
+import os, pickle, threading, time
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+def file_digest(f, chunk_size=1024 * 1024):
+    """Return a digest of an uploaded file, leaving it where it was."""
+    raw = getattr(f, 'buffer', f)  # hash the bytes under a text file
+    position = raw.tell()
+    raw.seek(0)
+    digest = sha256()
+    for chunk in iter(lambda: raw.read(chunk_size), b''):
+        digest.update(chunk)
+    raw.seek(position)
+    return digest.hexdigest()
+
+def canonical(value):
+    """Return a string that identifies a value for use in a key."""
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(canonical(item) for item in value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(sorted(
+            '%s: %s' % (canonical(k), canonical(v)) for k, v in value.items()))
+    if hasattr(value, 'read'):
+        return '<file %s>' % file_digest(value)
+    return '%s:%r' % (type(value).__name__, value)
+
+def namespace_key(namespace, exclude=(), output_dests=(), scope=''):
+    """\
+Return a key for a Namespace.  Arguments named in exclude are left out;
+for those in output_dests, only the file name (which the response
+depends on) is used.  scope names the program, so that programs sharing
+a cache don't share results."""
+    digest = sha256()
+    digest.update(('%s\n' % scope).encode('utf-8'))
+    for dest, value in sorted(vars(namespace).items()):
+        if dest in exclude:
+            continue
+        if dest in output_dests:
+            text = '<output %r>' % getattr(value, 'name', None)
+        else:
+            text = canonical(value)
+        digest.update(('%s=%s\n' % (dest, text)).encode('utf-8'))
+    return digest.hexdigest()
+
+class CachedResult(object):
+    """A response that can be replayed."""
+
+    __slots__ = ('status', 'headers', 'body', 'created')
+
+    def __init__(self, status, headers, body, created=None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.created = time.time() if created is None else created
+
+    def __getstate__(self):
+        return self.status, self.headers, self.body, self.created
+
+    def __setstate__(self, state):
+        self.status, self.headers, self.body, self.created = state
+
+class ResultCache(object):
+    """\
+A thread-safe LRU cache of CachedResults, holding at most max_entries
+results and max_bytes of response bodies in memory.  Results older than
+ttl seconds (if given) are discarded.  If directory is given, results
+are also written there, so they survive restarts and can be shared by
+several processes."""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024,
+                 ttl=None, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def expired(self, result):
+        return self.ttl is not None and result.created + self.ttl < time.time()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.result')
+
+    def get(self, key):
+        """Return the CachedResult for a key, or None."""
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                if self.expired(result):
+                    self.discard(key)
+                    result = None
+                else:
+                    self.entries.move_to_end(key)
+        if result is None and self.directory:
+            result = self.load(key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def put(self, key, status, headers, body):
+        """Remember a response; bodies too big for the cache are ignored."""
+        if len(body) > self.max_bytes:
+            return
+        result = CachedResult(status, list(headers), body)
+        self.remember(key, result)
+        if self.directory:
+            self.save(key, result)
+
+    def remember(self, key, result):
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = result
+            self.size += len(result.body)
+            while self.entries and (len(self.entries) > self.max_entries or
+                                    self.size > self.max_bytes):
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        # call with self.lock held
+        result = self.entries.pop(key, None)
+        if result is not None:
+            self.size -= len(result.body)
+
+    def load(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                result = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if self.expired(result):
+            try:
+                os.unlink(self.path(key))
+            except OSError:
+                pass
+            return None
+        self.remember(key, result)
+        return result
+
+    def save(self, key, result):
+        # write then rename, so readers never see a partial file
+        from tempfile import mkstemp
+        fd, temp = mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, self.path(key))
+        except (IOError, OSError):
+            print_where('could not save result', key)
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,309 @@
+#! /usr/bin/env python
+
+"""\
+Standard-library WSGI servers for 'python -m wsgiwrapper'.
+
+Three modes are offered:
+  single    one request at a time (wsgiref.simple_server, as before);
+  threaded  a thread per connection;
+  prefork   several worker processes, forked after the app is built,
+            all accepting on the same socket; each may also be threaded.
+
+All of them support HTTP/1.1 keep-alive and a configurable listen
+backlog; keep-alive is only on by default when connections have threads
+of their own, since an idle client would otherwise hold up everyone.
+
+In prefork mode, SIGHUP replaces the workers gracefully and SIGTERM (or
+SIGINT) lets them finish their requests before exiting."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler
+from wsgiref.simple_server import WSGIServer as _WSGIServer
+import gc, os, signal, socket, sys, time
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+MODES = ('single', 'threaded', 'prefork')
+BACKLOG = 128  # connections waiting to be accepted
+KEEP_ALIVE = 5  # seconds an idle connection is kept open
+DRAIN_LIMIT = 64 * 1024  # unread request bodies up to this size are skipped
+
+class BodyReader(object):
+    """\
+wsgi.input for one request on a persistent connection: it stops at the
+end of the body, so the application can't read into the next request."""
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def drain(self):
+        """Skip the rest of a small body; return False if it's too big."""
+        if self.remaining > DRAIN_LIMIT:
+            return False
+        while self.remaining:
+            if not self.read(min(self.remaining, 8192)):
+                return False
+        return True
+
+class KeepAliveServerHandler(ServerHandler):
+    """Speaks HTTP/1.1, and closes the connection when it must."""
+
+    http_version = '1.1'
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        handler = self.request_handler
+        if 'Content-Length' not in self.headers:
+            handler.close_connection = True  # the body ends when we close
+        if handler.close_connection:
+            self.headers['Connection'] = 'close'
+
+class RequestHandler(WSGIRequestHandler):
+    """Handles any number of requests on one connection."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.keep_alive or None
+        WSGIRequestHandler.setup(self)
+
+    def handle(self):
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+            while not self.close_connection and not self.server.stopping:
+                self.handle_one_request()
+        except (socket.timeout, ConnectionError):
+            pass  # the client went quiet, or went away
+
+    def handle_one_request(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = True
+            return
+        if not self.parse_request():  # an error code has been sent
+            self.close_connection = True
+            return
+        if not self.server.keep_alive or self.request_version != 'HTTP/1.1':
+            self.close_connection = True
+        environ = self.get_environ()
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+            # not supported; read to the end of the connection
+            stdin, self.close_connection = self.rfile, True
+        else:
+            stdin = BodyReader(self.rfile, length)
+        handler = KeepAliveServerHandler(
+            stdin, self.wfile, self.get_stderr(), environ,
+            multithread=self.server.multithread,
+            multiprocess=self.server.multiprocess,
+            )
+        handler.request_handler = self  # backpointer for logging
+        handler.run(self.server.get_app())
+        self.wfile.flush()
+        if isinstance(stdin, BodyReader) and not stdin.drain():
+            self.close_connection = True
+
+class WSGIServer(_WSGIServer):
+    """A single-threaded WSGI server with keep-alive."""
+
+    multithread = False
+    multiprocess = False
+    keep_alive = 0
+    stopping = False
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """A WSGI server that handles each connection in its own thread."""
+
+    multithread = True
+    daemon_threads = True
+
+def make_server(host, port, app, mode='single', backlog=BACKLOG, keep_alive=None):
+    """\
+Create a WSGI server listening on host:port.  In prefork mode, the
+server is the one each worker runs; pass it to PreforkServer.  If
+keep_alive isn't given, it is KEEP_ALIVE seconds for threaded servers
+and zero (no keep-alive) otherwise."""
+    if mode not in MODES:
+        raise ValueError('unknown server mode %r' % (mode,))
+    server_class = WSGIServer if mode == 'single' else ThreadingWSGIServer
+    server = server_class((host, port), RequestHandler, bind_and_activate=False)
+    server.request_queue_size = backlog
+    if keep_alive is None:
+        keep_alive = KEEP_ALIVE if server.multithread else 0
+    server.keep_alive = keep_alive
+    try:
+        server.server_bind()
+        server.server_activate()
+    except Exception:
+        server.server_close()
+        raise
+    server.set_app(app)
+    return server
+
+class PreforkServer(object):
+    """\
+Runs a bound server in several forked worker processes, replacing any
+that die.  SIGHUP starts a new set of workers and retires the old ones
+once they've finished their requests; SIGTERM and SIGINT stop them all
+the same way and then exit.
+
+Unless freeze is false, everything that exists when serving starts is
+moved out of the garbage collector's reach (Python 3.7 and later), so
+the workers share it instead of each getting copies of it."""
+
+    poll_interval = 0.5  # seconds between checks for dead workers
+
+    def __init__(self, server, workers=None, freeze=True):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('prefork mode needs os.fork()')
+        self.server = server
+        self.workers = workers or os.cpu_count() or 1
+        self.server.multiprocess = True
+        self.server.daemon_threads = False  # so workers wait for them
+        self.server.block_on_close = True
+        self.children = {}  # pid -> generation
+        self.generation = 0
+        self.running = False
+        self.freeze = freeze
+
+    @property
+    def server_address(self):
+        return self.server.server_address
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = self.generation
+            return
+        # in the worker
+        code = 0
+        try:
+            self.run_worker()
+        except Exception:
+            from traceback import print_exc
+            print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    def run_worker(self):
+        server = self.server
+
+        def stop(signum, frame):
+            server.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        server.timeout = self.poll_interval  # so handle_request() sees stopping
+        try:
+            while not server.stopping:
+                server.handle_request()
+        finally:
+            server.server_close()
+
+    def retire(self, generation):
+        """Ask the workers of a generation to finish up and exit."""
+        for pid, gen in list(self.children.items()):
+            if gen == generation:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+            if not pid:
+                break
+            generation = self.children.pop(pid, None)
+            if self.running and generation == self.generation:
+                print_where('worker', pid, 'died; replacing it')
+
+    def serve_forever(self):
+        def stop(signum, frame):
+            self.running = False
+
+        def restart(signum, frame):
+            self.generation += 1
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, restart)
+        if self.freeze and hasattr(gc, 'freeze'):
+            # Everything built so far lives as long as we do; keep the
+            # workers' collectors from touching it, and so from copying
+            # the pages it is on.
+            gc.collect()
+            gc.freeze()
+        self.running = True
+        generation = self.generation
+        try:
+            while self.running:
+                if generation != self.generation:
+                    self.retire(generation)
+                    generation = self.generation
+                current = sum(1 for gen in self.children.values() if gen == generation)
+                for _ in range(self.workers - current):
+                    self.spawn()
+                time.sleep(self.poll_interval)
+                self.reap()
+        finally:
+            self.running = False
+            for gen in set(self.children.values()):
+                self.retire(gen)
+            while self.children:
+                try:
+                    pid, status = os.wait()
+                except OSError:
+                    break
+                self.children.pop(pid, None)
+            self.server.server_close()
+
+if __name__ == '__main__':
+    pass
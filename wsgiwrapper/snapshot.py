@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+
+"""\
+Save a wsgiwrapper's fully built form, so that other processes (e.g.
+the workers of a pre-forking server, or the next run of the server) can
+load it instead of walking the parser again.
+
+A snapshot is keyed by a digest of everything the form is built from:
+the parser's actions and groups, the wsgiwrapper options that affect
+the form, and our own code and assets (the page template, stylesheet
+and scripts), so upgrading wsgiwrapper makes old snapshots stale even if
+its version number didn't change.  Snapshots are pickles,
+so only keep them in a directory no one else can write to."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+from hashlib import sha256
+import os, pickle, re
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+FORMAT = 2  # changed whenever what we save changes
+SIMPLE = {type(None), bool, int, float, str, bytes}  # their reprs never vary
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_EXTENSIONS = ('.py', '.css', '.mustache')
+
+_package_digest = []  # computed once per process
+
+def package_digest():
+    """Return a digest of our own source files, templates and stylesheet."""
+    if not _package_digest:
+        digest = sha256()
+        for name in sorted(os.listdir(PACKAGE_DIR)):
+            if os.path.splitext(name)[1] in SOURCE_EXTENSIONS:
+                digest.update(name.encode('utf-8') + b'\0')
+                with open(os.path.join(PACKAGE_DIR, name), 'rb') as f:
+                    digest.update(f.read())
+        _package_digest.append(digest.hexdigest())
+    return _package_digest[0]
+
+def describe(value):
+    """\
+Return a string that identifies a value the same way in every process,
+e.g. naming functions instead of showing their addresses."""
+    if type(value) in SIMPLE:
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        text = repr(list(value))
+        if '{' not in text and ' at 0x' not in text:
+            return text  # nothing in it whose repr varies, e.g. a long list of choices
+        return '[%s]' % ', '.join(describe(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return '{%s}' % ', '.join(sorted(describe(item) for item in value))
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(sorted(
+            '%s: %s' % (describe(k), describe(v)) for k, v in value.items()))
+    if callable(value) and hasattr(value, '__qualname__'):
+        return '%s.%s' % (getattr(value, '__module__', ''), value.__qualname__)
+    return ADDRESS.sub('', repr(value))
+
+def parser_key(parser, options=(), *extra):
+    """\
+Return the key of a form built from parser, with options (a dict of the
+wsgiwrapper options that affect the form) and any extra strings."""
+    digest = sha256()
+    def add(*values):
+        digest.update(('\n'.join(describe(value) for value in values) + '\n').encode('utf-8'))
+    add(parser.prog, parser.usage, parser.description, parser.epilog, *extra)
+    add(dict(options))
+    index = dict((id(action), i) for i, action in enumerate(parser._actions))
+    for action in parser._actions:
+        add(type(action), sorted((name, value) for name, value in vars(action).items()
+                                 if name != 'container'))
+    for group in parser._action_groups:
+        add(group.title, group.description, [index.get(id(action)) for action in group._group_actions])
+    return digest.hexdigest()
+
+def path(directory, key):
+    return os.path.join(directory, key + '.snapshot')
+
+def load(directory, key):
+    """Return the state saved under key, or None."""
+    try:
+        with open(path(directory, key), 'rb') as f:
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+
+def save(directory, key, state):
+    """Save state under key."""
+    # write then rename, so readers never see a partial file
+    from tempfile import mkstemp
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp = mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, path(directory, key))
+    except (IOError, OSError, pickle.PicklingError, TypeError, AttributeError):
+        print_where('could not save snapshot', key)
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+
+"""\
+Stream the output of the wrapped program to the client while it runs.
+
+The program writes to a QueueWriter, in its own thread.  Once a full
+chunk has been written, the chunks are handed to the WSGI server through
+a bounded queue; when the client reads slowly, the queue fills and the
+program blocks on its next write instead of piling up output in memory."""
+
+# Insure maximum compatibility between Python 2 and 3
+from __future__ import absolute_import, division, print_function
+
+# Python standard libraries
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+import io
+
+# Python site libraries
+
+# Python personal libraries
+from .utils import print_where
+
+CHUNK_SIZE = 64 * 1024  # bytes per chunk sent to the client
+QUEUE_SIZE = 16  # chunks that may wait for a slow client
+
+DONE = object()  # put on the queue once the program has finished
+
+def named_stringio(name):
+    """Make a StringIO to stand in for a QueueWriter in another process."""
+    f = StringIO()
+    f.name = name
+    return f
+
+class QueueWriter(io.TextIOBase):
+    """\
+A writable text file whose contents are sent, in chunks, through a
+bounded queue.  Nothing is queued until at least chunk_size bytes have
+been written, so a program that writes little and exits can still be
+answered with an ordinary response (see getvalue())."""
+
+    name = None
+
+    def __init__(self, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE, encoding='utf-8'):
+        self.queue = Queue(queue_size)
+        self.chunk_size = chunk_size
+        self._encoding = encoding
+        self.pending = []
+        self.pending_size = 0
+        self.started = False  # True once a chunk has been queued
+        self.cancelled = False  # True once the client has gone away
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if self.cancelled:
+            raise IOError('client disconnected')
+        data = s if isinstance(s, bytes) else s.encode(self._encoding)  # e.g. FileType('wb')
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.chunk_size:
+            self.send()
+        return len(s)
+
+    def flush(self):
+        # Before streaming starts, output is held so the response can
+        # still report an error; afterwards, flushing sends it at once.
+        if self.started and self.pending_size and not self.cancelled:
+            self.send()
+
+    def close(self):
+        # The program may close its output file, but the stream itself
+        # only ends once the program has finished; see finish().
+        pass
+
+    def send(self):
+        chunk = b''.join(self.pending)
+        self.pending, self.pending_size = [], 0
+        self.started = True
+        self.queue.put(chunk)  # blocks while the client catches up
+
+    def getvalue(self):
+        """Return the output written so far, if none of it has been sent."""
+        return self.getbytes().decode(self._encoding)
+
+    def getbytes(self):
+        """Return the output written so far, encoded, if none of it has been sent."""
+        assert not self.started
+        return b''.join(self.pending)
+
+    def finish(self):
+        """Called once the program has finished."""
+        if self.started and self.pending_size and not self.cancelled:
+            self.send()
+        if not self.cancelled:
+            self.queue.put(DONE)
+
+    def cancel(self):
+        """Called if the client goes away; the program's next write fails."""
+        self.cancelled = True
+        try:
+            while True:
+                self.queue.get_nowait()  # unblock the program
+        except Empty:
+            pass
+
+    def __reduce__(self):
+        return named_stringio, (self.name,)
+
+class StreamingResponse(object):
+    """A WSGI response iterable that yields the chunks of a QueueWriter."""
+
+    def __init__(self, writer, first):
+        self.writer = writer
+        self.first = first
+        self.finished = False
+
+    def __iter__(self):
+        chunk = self.first
+        while chunk is not DONE:
+            yield chunk
+            chunk = self.writer.queue.get()
+        self.finished = True
+
+    def close(self):
+        if not self.finished:
+            print_where('client went away while streaming')
+            self.writer.cancel()
+
+if __name__ == '__main__':
+    pass
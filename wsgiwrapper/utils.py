@@ -4,11 +4,20 @@
 
 # Insure maximum compatibility between Python 2 and 3
 from __future__ import absolute_import, division, print_function
+try:
+    basestring
+except NameError:
+    basestring = str
 
 # Python standard libraries
+from collections import deque
+from contextlib import contextmanager
 from functools import partial, wraps
-import os, sys
-import struct, base64
+import os, sys, threading
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
 
 # Python site libraries
 
@@ -26,82 +35,397 @@ global namespace.
         return f
     return setter
 
+class Lazy(object):
+    """\
+An argument to print_where that is only worked out if the message is
+actually traced, e.g. Lazy(format_exc) or Lazy(sorted, big_dict)."""
+
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+def short_repr(obj, limit=32):
+    """Return repr(obj), cut short after limit characters."""
+    s = repr(obj)
+    if len(s) > limit:
+        s = s[:limit] + '...'
+    return s
+
 class PrintWhere(object):
+    """\
+Tracing, for debugging wsgiwrapper and the programs it wraps.
+
+Call print_where like print() to trace a message, prefixed with where
+it came from; its arguments are only turned into strings if the message
+is traced, so pass values (or Lazy objects), not formatted strings.
+Decorate a function with print_where.tracing to trace its calls.
+
+Nothing is traced until enable() is called, naming the modules or
+functions to trace, e.g. 'wsgiwrapper.multipart' or
+'wsgiwrapper.wsgiwrapper.do_form'; this can be done at any time.  While
+tracing is off, a call to print_where costs a single attribute test, and
+a decorated function is the original, undecorated function.
+
+Messages go to stderr, unless capture() is collecting them, e.g. to keep
+the messages of each request together."""
+
     cwd=os.getcwd()
     home=os.path.expanduser('~')
     stderr=sys.stderr
-    tron = False
+    capacity = 1000  # messages kept by capture()
+
+    def __init__(self):
+        self.active = False  # True if anything at all is enabled
+        self.switches = {}  # name -> True (enabled) or False (disabled)
+        self.cache = {}  # (module, qualname) -> enabled
+        self.traced = []  # (function, wrapper) for each decorated function
+        self.local = threading.local()  # the indentation of each thread
+        if ContextVar is not None:
+            self.buffer = ContextVar('wsgiwrapper.print_where', default=None)
+
+    @property
+    def tron(self):
+        return self.enabled('', '')
+
+    @tron.setter
+    def tron(self, value):
+        if value:
+            self.enable()
+        else:
+            self.disable()
+
+    def enable(self, *names):
+        """\
+Trace the named modules, classes or functions (and everything in them);
+with no names, trace everything."""
+        for name in names or ('',):
+            self.switches[name] = True
+        self.refresh()
+
+    def disable(self, *names):
+        """\
+Stop tracing the named modules, classes or functions; with no names,
+stop tracing everything."""
+        if names:
+            for name in names:
+                self.switches[name] = False
+        else:
+            self.switches.clear()
+        self.refresh()
+
+    def enabled(self, module, qualname):
+        """Return True if tracing is enabled for a function."""
+        key = (module, qualname)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        name = '.'.join(part for part in key if part)
+        # The most specific switch wins.
+        while True:
+            if name in self.switches:
+                result = self.switches[name]
+                break
+            if not name:
+                result = False
+                break
+            name = name.rpartition('.')[0]
+        self.cache[key] = result
+        return result
+
+    def refresh(self):
+        """Swap the decorated functions for their wrappers, or back."""
+        self.cache.clear()
+        self.active = any(self.switches.values())
+        for f, wrapper in self.traced:
+            qualname = getattr(f, '__qualname__', f.__name__)
+            if '<locals>' in qualname:
+                continue  # only wrapped if enabled when it was defined
+            owner = sys.modules.get(f.__module__)
+            path = qualname.split('.')
+            for name in path[:-1]:
+                owner = getattr(owner, name, None)
+            if owner is None or vars(owner).get(path[-1]) not in (f, wrapper):
+                continue  # replaced by something else; leave it alone
+            use = wrapper if self.enabled(f.__module__, qualname) else f
+            setattr(owner, path[-1], use)
 
     def __call__(self, *args, **kwargs):
-        if kwargs.pop('tron', self.tron):
-            from inspect import currentframe
-            caller = currentframe()
-            here = caller.f_code.co_filename
-            while caller.f_code.co_filename == here:
-                caller = caller.f_back
-            fname = caller.f_code.co_filename
-            if fname.startswith(self.cwd):
-                fname = '.' + fname[len(self.cwd):]
-            if fname.startswith(self.home):
-                fname = '~' + fname[len(self.home):]
-            print('File "%s", line %d:' % (fname, caller.f_lineno),
-                *args, file=self.stderr)
-
-    def repr(self, obj):
-        s = repr(obj)
-        if len(s) > 32:
-            s = s[:32] + '...'
-        return s
+        if not self.active and not kwargs.get('tron'):
+            return
+        caller = sys._getframe(1)
+        code = caller.f_code
+        qualname = getattr(code, 'co_qualname', code.co_name)
+        if kwargs.pop('tron', False) or self.enabled(caller.f_globals.get('__name__', ''), qualname):
+            self.emit(code.co_filename, caller.f_lineno, args)
+
+    def emit(self, fname, lineno, args):
+        """Trace a message; this is where the arguments become strings."""
+        if fname.startswith(self.cwd):
+            fname = '.' + fname[len(self.cwd):]
+        if fname.startswith(self.home):
+            fname = '~' + fname[len(self.home):]
+        message = ' '.join(['File "%s", line %d:' % (fname, lineno)] + [str(arg) for arg in args])
+        buffer = self.capturing()
+        if buffer is None:
+            print(message, file=self.stderr)
+        else:
+            buffer.append(message)
+
+    def capturing(self):
+        """Return the deque collecting messages in this context, if any."""
+        if ContextVar is not None:
+            return self.buffer.get()
+        return getattr(self.local, 'buffer', None)
+
+    @contextmanager
+    def capture(self, maxlen=None):
+        """\
+Collect the messages traced in this thread (or asyncio task) in a deque,
+keeping only the last maxlen of them, instead of printing them."""
+        buffer = deque(maxlen=maxlen or self.capacity)
+        if ContextVar is not None:
+            token = self.buffer.set(buffer)
+        else:
+            token = getattr(self.local, 'buffer', None)
+            self.local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            if ContextVar is not None:
+                self.buffer.reset(token)
+            else:
+                self.local.buffer = token
+
+    def repr(self, obj, limit=32):
+        """Return a Lazy repr of obj, cut short after limit characters."""
+        return Lazy(short_repr, obj, limit)
 
     # From https://cscheid.net/2017/12/11/minimal-tracing-decorator-python-3.html
     def tracing(self, f):
-        #from inspect import signature
-        #sig = signature(f)
-        if self.tron:
-            self.indent = 0
-            
-            @wraps(f)
-            def wrapper(*args, **kwargs):
-                ws = ' ' * (self.indent * 2)
-                fname = f.func_name
-                code = f.func_code
-                names = code.co_varnames[:code.co_argcount]
-                self("%sENTER %s:" % (ws, fname))
-                for name, value in zip(names, args):
-                    self("%s    %s: %s" % (ws, name, self.repr(value)))
-                #for ix, param in enumerate(sig.parameters.values()):
-                    #print_where("%s    %s: %s" % (ws, param.name, args[ix]))
-                self.indent += 1
-                try:
-                    result = f(*args, **kwargs)
-                except Exception as err:
-                    self.indent -= 1
-                    self("%sEXCEPTION %s: %r" % (ws, fname, err))
-                    raise
-                else:
-                    self.indent -= 1
-                    self("%sEXIT %s, returned %r" % (ws, fname, self.repr(result)))
-                return result
-            
-            return wrapper
-        else:
-            return f
+        """\
+Decorate a function to trace its calls, arguments and results whenever
+tracing is enabled for it."""
+        code = getattr(f, '__code__', None) or f.func_code
+        fname = getattr(f, '__qualname__', f.__name__)
+        names = code.co_varnames[:code.co_argcount]
+        emit = partial(self.emit, code.co_filename, code.co_firstlineno)
+        local = self.local
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            indent = getattr(local, 'indent', 0)
+            ws = ' ' * (indent * 2)
+            emit(["%sENTER %s:" % (ws, fname)])
+            for name, value in zip(names, args):
+                emit(["%s    %s: %s" % (ws, name, short_repr(value))])
+            local.indent = indent + 1
+            try:
+                result = f(*args, **kwargs)
+            except Exception as err:
+                emit(["%sEXCEPTION %s: %r" % (ws, fname, err)])
+                raise
+            finally:
+                local.indent = indent
+            emit(["%sEXIT %s, returned %s" % (ws, fname, short_repr(result))])
+            return result
+
+        self.traced.append((f, wrapper))
+        return wrapper if self.enabled(f.__module__, fname) else f
 
 print_where = PrintWhere()
 
-class b64id(object):
+class TicketRegistry(object):
+    """\
+Maps the values offered by a form (choices, and the consts of checkboxes)
+to the strings used for them in the HTML, and back again.
+
+Each named set of values gets its own table.  If the values are distinct
+strings, they are their own tickets; otherwise the tickets are '#0',
+'#1', and so on, in order.  So the tickets only depend on the parser,
+not on object ids or hashes; values needn't be hashable; and every
+process that builds the same form agrees on them.  Once frozen, the
+tables are only ever read, so they can be shared by threads and by
+forked workers, and redeem() is a single dict lookup."""
+
     def __init__(self):
-        self.d1 = {}
-        self.d2 = {}
-    def register(self, obj):
-        if obj in self.d1:
-            return self.d1[obj]
-        ticket = base64.b64encode(struct.pack('L', id(obj)))
-        self.d1[obj] = ticket
-        self.d2[ticket] = obj
-        return ticket
-    def redeem(self, ticket):
-        return self.d2.get(ticket, ticket)
+        self.tables = {}  # name -> {ticket: value}
+        self.frozen = False
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def register(self, name, values):
+        """\
+Return the tickets for a list of values, in the same order.  Registering
+more values under the same name (e.g. for several actions that share a
+dest) adds them to its table."""
+        if self.frozen:
+            raise RuntimeError('the registry is frozen')
+        table = self.tables.setdefault(name, {})
+        values = list(values)
+        if (all(isinstance(value, basestring) for value in values) and
+                len(set(values)) == len(values) and
+                not any(value in table for value in values)):
+            tickets = values
+        else:
+            tickets, n = [], len(table)
+            for value in values:
+                while '#%d' % n in table:
+                    n += 1
+                tickets.append('#%d' % n)
+                n += 1
+        table.update(zip(tickets, values))
+        return tickets
+
+    def table(self, name):
+        """Return the {ticket: value} dict for a name; don't change it."""
+        return self.tables.get(name, {})
+
+    def redeem(self, name, ticket, *default):
+        """\
+Return the value for a ticket.  If there isn't one, return the default,
+if one is given, or raise KeyError."""
+        try:
+            return self.tables[name][ticket]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+
+    def freeze(self):
+        self.frozen = True
+
+def etag_matches(if_none_match, etag):
+    """Return True if an If-None-Match header value matches an ETag.
+
+Weak comparison is used, as RFC 7232 requires for If-None-Match."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def accepted_encodings(accept_encoding):
+    """Return a dict mapping each content-coding in an Accept-Encoding
+header value (lower-cased, including '*') to its quality."""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+def accepts_encoding(accept_encoding, coding):
+    """Return True if an Accept-Encoding header value allows a content-coding."""
+    accepted = accepted_encodings(accept_encoding)
+    return accepted.get(coding, accepted.get('*', 0.0)) > 0
+
+class StreamProxy(object):
+    """\
+A stand-in for sys.stdin, sys.stdout or sys.stderr.  Each thread (or
+asyncio task) may set its own replacement stream; everyone else keeps
+using the original stream.  All attribute access is forwarded, so the
+proxy can be used anywhere the real stream could."""
+
+    def __init__(self, name):
+        self.__dict__['_proxy_name'] = name  # not 'name', which belongs to the stream
+        self.__dict__['original'] = getattr(sys, name)
+        if ContextVar is not None:
+            self.__dict__['target'] = ContextVar('wsgiwrapper.' + name, default=None)
+        else:
+            self.__dict__['local'] = threading.local()
+
+    def get(self):
+        """Return the stream in use by the current thread or context."""
+        if ContextVar is not None:
+            stream = self.target.get()
+        else:
+            stream = getattr(self.local, 'stream', None)
+        return self.original if stream is None else stream
+
+    def set(self, stream):
+        """Replace the stream for the current thread or context, and
+return a token to pass to reset()."""
+        if ContextVar is not None:
+            return self.target.set(stream)
+        token = getattr(self.local, 'stream', None)
+        self.local.stream = stream
+        return token
+
+    def reset(self, token):
+        """Restore the stream that was in use before set() was called."""
+        if ContextVar is not None:
+            self.target.reset(token)
+        else:
+            self.local.stream = token
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get(), name, value)
+
+    def __iter__(self):
+        return iter(self.get())
+
+_proxy_lock = threading.Lock()
+STREAM_NAMES = ('stdin', 'stdout', 'stderr')
+
+def install_stream_proxies():
+    """Replace sys.stdin/stdout/stderr with StreamProxy objects, if
+that hasn't already been done, and return the proxies."""
+    with _proxy_lock:
+        proxies = []
+        for name in STREAM_NAMES:
+            stream = getattr(sys, name)
+            if not isinstance(stream, StreamProxy):
+                stream = StreamProxy(name)
+                setattr(sys, name, stream)
+            proxies.append(stream)
+        return proxies
+
+class redirect_streams(object):
+    """\
+A context manager that redirects stdin, stdout and stderr for the
+current thread (or asyncio task) only.  A stream passed as None is
+left alone."""
+
+    def __init__(self, stdin=None, stdout=None, stderr=None):
+        self.streams = (stdin, stdout, stderr)
+
+    def __enter__(self):
+        self.tokens = []
+        for proxy, stream in zip(install_stream_proxies(), self.streams):
+            if stream is not None:
+                self.tokens.append((proxy, proxy.set(stream)))
+        return self
+
+    def __exit__(self, *args):
+        for proxy, token in reversed(self.tokens):
+            proxy.reset(token)
 
 class Backstop(object):
     """This is a context manager to catch exceptions that would